@@ -1,649 +1,931 @@
-#!/usr/bin/env python3
-import os
-import csv
-import time
-import threading
-from datetime import datetime
-import sys
-import subprocess
-import keyboard
-import RPi.GPIO as GPIO
-import pymysql
-import mysql.connector
-import calendar
-
-from config import (
-    PRODUCTION_DB, STAFF_DB,
-    DEVICE_LINE, DEVICE_ID,
-    CSV_FOLDER, LOG_PATH,
-    RESET_CODES, SCAN_INTERVAL,
-    DB_CONNECT_TIMEOUT, DB_READ_TIMEOUT, DB_WRITE_TIMEOUT,
-    UPLOAD_INTERVAL_SEC,
-)
-
-# ===================== SETTINGS =====================
-DEBUG_MODE = True
-
-# Error alert mode:
-#   "blink" -> (same as your old perfect code) red blink + buzzer beep pattern
-#   "solid" -> red ON continuously + buzzer ON continuously
-ERROR_ALERT_MODE = "blink"   # <-- if you want continuous ON, change to "solid"
-
-# Relay polarity (your old code assumes LOW=ON HIGH=OFF)
-ACTIVE_LOW = False # HF6 using Relay so using "True", others line no using Relay so using "False"
-CHANNEL_ACTIVE_LOW = {
-    "RED": ACTIVE_LOW,
-    "GREEN": ACTIVE_LOW,
-    "YELLOW": ACTIVE_LOW,
-    "BUZZER": ACTIVE_LOW,
-}
-# If any channel wiring differs, override:
-# CHANNEL_ACTIVE_LOW["BUZZER"] = False
-# CHANNEL_ACTIVE_LOW["RED"] = False
-
-def debug(msg):
-    if DEBUG_MODE:
-        print(f"[DEBUG] {msg}")
-
-# ===================== GPIO Setup =====================
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-
-RED_PIN = 5
-GREEN_PIN = 6
-YELLOW_PIN = 13
-BUZZER_PIN = 19
-
-GPIO.setup(RED_PIN, GPIO.OUT)
-GPIO.setup(GREEN_PIN, GPIO.OUT)
-GPIO.setup(YELLOW_PIN, GPIO.OUT)
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
-
-def _pin_write(pin: int, on: bool, active_low: bool):
-    if active_low:
-        GPIO.output(pin, GPIO.LOW if on else GPIO.HIGH)
-    else:
-        GPIO.output(pin, GPIO.HIGH if on else GPIO.LOW)
-
-def set_light(pin, state=True):
-    # state=True means ON logically
-    if pin == RED_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["RED"])
-    elif pin == GREEN_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["GREEN"])
-    elif pin == YELLOW_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["YELLOW"])
-    elif pin == BUZZER_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["BUZZER"])
-    else:
-        GPIO.output(pin, GPIO.LOW if state else GPIO.HIGH)
-
-# init OFF
-set_light(RED_PIN, False)
-set_light(GREEN_PIN, False)
-set_light(YELLOW_PIN, False)
-set_light(BUZZER_PIN, False)
-
-# ===================== Log redirect =====================
-try:
-    sys.stdout = open(LOG_PATH, "a", buffering=1)
-    sys.stderr = sys.stdout
-    debug("🔁 Script started (log ready)")
-except Exception as e:
-    with open("/home/pi/gwim-scanner/gwim_fallback.txt", "a") as f:
-        f.write(f"Logging failed: {e}\n")
-
-# ===================== Logs writable check (for your old chown issue) =====================
-os.makedirs(CSV_FOLDER, exist_ok=True)
-
-def ensure_logs_writable() -> bool:
-    test_path = os.path.join(CSV_FOLDER, ".write_test")
-    try:
-        with open(test_path, "w") as f:
-            f.write("ok")
-        os.remove(test_path)
-        debug(f"✅ Logs folder writable: {CSV_FOLDER}")
-        return True
-    except Exception as e:
-        debug(f"❌ Logs folder NOT writable: {CSV_FOLDER} ({e})")
-        debug("Fix on Raspberry Pi terminal:")
-        debug("  sudo chown -R pi:pi /home/pi/gwim-scanner/logs")
-        debug("  sudo chmod -R 775 /home/pi/gwim-scanner/logs")
-        return False
-
-LOGS_WRITABLE = ensure_logs_writable()
-
-# ===================== State Control (exactly like your old) =====================
-green_blink_running = True
-green_blink_thread = None
-
-red_alert_active = False
-red_alert_thread = None
-buzzer_alert_active = False
-buzzer_alert_thread = None
-
-def blink_light(pin, duration=0.3, times=3):
-    for _ in range(times):
-        set_light(pin, True)
-        time.sleep(duration)
-        set_light(pin, False)
-        time.sleep(duration)
-
-def buzz(times=1, duration=0.15):
-    for _ in range(times):
-        set_light(BUZZER_PIN, True)
-        time.sleep(duration)
-        set_light(BUZZER_PIN, False)
-        time.sleep(0.1)
-
-def continuous_green_blink():
-    global green_blink_running
-    # Fast blink 5 times
-    for _ in range(5):
-        set_light(GREEN_PIN, True)
-        time.sleep(0.2)
-        set_light(GREEN_PIN, False)
-        time.sleep(0.1)
-    # Slow blink until stopped
-    while green_blink_running:
-        set_light(GREEN_PIN, True)
-        time.sleep(0.5)
-        set_light(GREEN_PIN, False)
-        time.sleep(0.5)
-    set_light(GREEN_PIN, False)
-
-def continuous_red_alert():
-    global red_alert_active
-    while red_alert_active:
-        if ERROR_ALERT_MODE == "solid":
-            set_light(RED_PIN, True)
-            time.sleep(0.1)
-        else:
-            set_light(RED_PIN, True); time.sleep(0.5)
-            set_light(RED_PIN, False); time.sleep(0.5)
-    set_light(RED_PIN, False)
-
-def continuous_buzzer_alert():
-    global buzzer_alert_active
-    while buzzer_alert_active:
-        if ERROR_ALERT_MODE == "solid":
-            set_light(BUZZER_PIN, True)
-            time.sleep(0.1)
-        else:
-            set_light(BUZZER_PIN, True); time.sleep(0.15)
-            set_light(BUZZER_PIN, False); time.sleep(0.5)
-    set_light(BUZZER_PIN, False)
-
-def stop_all_alerts():
-    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
-    debug("Stopping all active alerts...")
-    red_alert_active = False
-    buzzer_alert_active = False
-
-    if red_alert_thread and red_alert_thread.is_alive():
-        red_alert_thread.join(timeout=0.6)
-    set_light(RED_PIN, False)
-
-    if buzzer_alert_thread and buzzer_alert_thread.is_alive():
-        buzzer_alert_thread.join(timeout=0.6)
-    set_light(BUZZER_PIN, False)
-    debug("All alerts stopped.")
-
-def start_red_buzzer_alert():
-    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
-
-    debug(f"🚨 START ALERT (mode={ERROR_ALERT_MODE})")
-    red_alert_active = True
-    buzzer_alert_active = True
-
-    # IMPORTANT: always restart threads if they died
-    if not (red_alert_thread and red_alert_thread.is_alive()):
-        red_alert_thread = threading.Thread(target=continuous_red_alert, daemon=True)
-        red_alert_thread.start()
-
-    if not (buzzer_alert_thread and buzzer_alert_thread.is_alive()):
-        buzzer_alert_thread = threading.Thread(target=continuous_buzzer_alert, daemon=True)
-        buzzer_alert_thread.start()
-
-# ===================== Internet Yellow (same as your old) =====================
-yellow_checker_timer = None
-
-def check_internet():
-    try:
-        return subprocess.call(
-            ["ping", "-c", "1", "-W", "1", "8.8.8.8"],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        ) == 0
-    except Exception:
-        return False
-
-def update_yellow_light():
-    global yellow_checker_timer
-    if yellow_checker_timer and yellow_checker_timer.is_alive():
-        yellow_checker_timer.cancel()
-
-    if check_internet():
-        set_light(YELLOW_PIN, True)
-    else:
-        blink_light(YELLOW_PIN, duration=0.5, times=1)
-
-    yellow_checker_timer = threading.Timer(10, update_yellow_light)
-    yellow_checker_timer.daemon = True
-    yellow_checker_timer.start()
-
-update_yellow_light()
-
-# ===================== Helpers =====================
-def safe_int(value):
-    try:
-        return int(value)
-    except Exception:
-        return None
-
-def normalize_barcode(code):
-    return (
-        code.strip()
-            .replace("–", "-")
-            .replace("−", "-")
-            .replace("—", "-")
-            .replace("_", "-")
-            .upper()
-    )
-
-def is_reset_code(barcode):
-    return normalize_barcode(barcode) in {normalize_barcode(r) for r in RESET_CODES}
-
-def resolve_image_url(path):
-    path = (path or "").strip().lstrip("../")
-    return f"http://192.168.20.17/{path}"
-
-# ===================== DB Connect helpers (NEW, minimal) =====================
-def connect_production(dict_cursor=False):
-    kwargs = dict(
-        host=PRODUCTION_DB["host"],
-        user=PRODUCTION_DB["user"],
-        password=PRODUCTION_DB["password"],
-        database=PRODUCTION_DB["database"],
-        port=int(PRODUCTION_DB.get("port", 3306)),
-        connect_timeout=int(DB_CONNECT_TIMEOUT),
-        read_timeout=int(DB_READ_TIMEOUT),
-        write_timeout=int(DB_WRITE_TIMEOUT),
-        autocommit=True,
-    )
-    if dict_cursor:
-        kwargs["cursorclass"] = pymysql.cursors.DictCursor
-    return pymysql.connect(**kwargs)
-
-# ===================== Global vars =====================
-current_batch = None
-current_muf = None
-template_code = None
-muf_info = None
-last_scan_time = 0
-last_barcode = None
-barcode_buffer = ""
-staff_id = None
-
-csv_lock = threading.Lock()
-
-# ===================== MUF query =====================
-def fetch_muf_info(cursor, muf_code):
-    debug(f"Querying table 'main' for muf_no = '{muf_code}'")
-    cursor.execute("SELECT * FROM main WHERE muf_no = %s", (muf_code,))
-    return cursor.fetchone()
-
-# ===================== CSV write (keep, but add safety) =====================
-CSV_HEADER = [
-    "muf_no", "line", "fg_no", "pack_per_ctn", "pack_per_hr",
-    "actual_pack", "ctn_count", "scanned_code", "scanned_count",
-    "scanned_at", "scanned_by", "remarks", "is_uploaded"
-]
-
-def write_to_csv(data_11, muf_no, uploaded=0, remarks=""):
-    if not LOGS_WRITABLE:
-        debug("⚠️ logs not writable; CSV not saved.")
-        return
-
-    with csv_lock:
-        filename = os.path.join(CSV_FOLDER, f"{muf_no}_{datetime.now().strftime('%Y%m%d')}.csv")
-        is_new = not os.path.exists(filename)
-        try:
-            with open(filename, "a", newline="") as f:
-                writer = csv.writer(f)
-                if is_new:
-                    writer.writerow(CSV_HEADER)
-                writer.writerow(list(data_11) + [remarks, int(uploaded)])
-            debug(f"📂 Written to CSV: {filename} (uploaded={uploaded}, remarks={remarks})")
-        except Exception as e:
-            debug(f"⚠️ CSV write failed: {e}")
-
-# ===================== Insert output_log (minimal change) =====================
-def process_and_store(barcode, muf_info_dict, remarks=""):
-    pack_per_ctn = safe_int(muf_info_dict.get("pack_per_ctn"))
-    ctn_count = 1
-    actual_pack = pack_per_ctn * ctn_count if pack_per_ctn is not None else None
-
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    data_11 = (
-        current_muf,
-        DEVICE_LINE,
-        muf_info_dict.get("fg_no"),
-        pack_per_ctn,
-        safe_int(muf_info_dict.get("pack_per_hr")),
-        actual_pack,
-        ctn_count,
-        normalize_barcode(barcode),
-        1,
-        timestamp,
-        staff_id if staff_id else DEVICE_ID,
-    )
-
-    try:
-        conn = connect_production(dict_cursor=False)
-        cursor = conn.cursor()
-        sql = (
-            "INSERT INTO output_log ("
-            "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
-            "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
-            ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        )
-        cursor.execute(sql, data_11 + (remarks,))
-        conn.commit()
-        conn.close()
-
-        debug("✅ DB insert successful")
-        write_to_csv(data_11, current_muf, uploaded=1, remarks=remarks)
-
-    except Exception as e:
-        debug(f"⚠️ DB insert failed. Cached locally: {e}")
-        write_to_csv(data_11, current_muf, uploaded=0, remarks=remarks)
-
-# ===================== Upload pending CSV (fix 0-byte/empty) =====================
-def upload_from_csv():
-    debug("⏫ Attempting to upload cached CSV data...")
-
-    if not os.path.isdir(CSV_FOLDER):
-        return
-
-    for file in os.listdir(CSV_FOLDER):
-        if not file.endswith(".csv"):
-            continue
-
-        path = os.path.join(CSV_FOLDER, file)
-
-        # Fix: remove 0-byte CSV
-        try:
-            if os.path.getsize(path) == 0:
-                debug(f"🧹 Removing 0-byte CSV: {path}")
-                try:
-                    os.remove(path)
-                except Exception:
-                    pass
-                continue
-        except Exception:
-            continue
-
-        with csv_lock:
-            try:
-                with open(path, "r", newline="") as f:
-                    reader = list(csv.reader(f))
-            except Exception:
-                continue
-
-        if len(reader) <= 1:
-            debug(f"ℹ️ Skip CSV (empty/header-only): {path}")
-            continue
-
-        headers = reader[0]
-        data_rows = reader[1:]
-
-        # ensure header has our required fields
-        if "is_uploaded" not in headers:
-            debug(f"⚠️ CSV header unexpected, skip: {path}")
-            continue
-
-        idx_uploaded = headers.index("is_uploaded")
-        idx_remarks = headers.index("remarks") if "remarks" in headers else None
-
-        pending = []
-        pending_row_index = []
-
-        for i, row in enumerate(data_rows, start=1):
-            if len(row) <= idx_uploaded:
-                continue
-            if row[idx_uploaded] == "0":
-                pending.append(row)
-                pending_row_index.append(i)
-
-        if not pending:
-            continue
-
-        try:
-            conn = connect_production(dict_cursor=False)
-            cursor = conn.cursor()
-
-            sql = (
-                "INSERT INTO output_log ("
-                "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
-                "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
-                ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-            )
-
-            for row in pending:
-                # Map using our known header order CSV_HEADER
-                # If old files exist, still handle by header index
-                def get(col):
-                    return row[headers.index(col)] if col in headers and headers.index(col) < len(row) else None
-
-                data_to_insert = (
-                    get("muf_no"),
-                    get("line"),
-                    get("fg_no"),
-                    get("pack_per_ctn"),
-                    get("pack_per_hr"),
-                    get("actual_pack"),
-                    get("ctn_count"),
-                    get("scanned_code"),
-                    get("scanned_count"),
-                    get("scanned_at"),
-                    get("scanned_by"),
-                    get("remarks") if idx_remarks is not None else "",
-                )
-                cursor.execute(sql, data_to_insert)
-
-            conn.commit()
-            conn.close()
-
-            # mark uploaded=1
-            with csv_lock:
-                for i in pending_row_index:
-                    if len(reader[i]) > idx_uploaded:
-                        reader[i][idx_uploaded] = "1"
-                with open(path, "w", newline="") as f:
-                    w = csv.writer(f)
-                    w.writerows(reader)
-
-            debug(f"✅ Upload complete and marked: {path}")
-
-        except Exception as e:
-            debug(f"⚠️ Upload failed: {e}")
-
-    threading.Timer(UPLOAD_INTERVAL_SEC, upload_from_csv).start()
-
-# ===================== Staff verification (keep old behavior, use STAFF_DB) =====================
-def is_valid_staff_id(staff_id_in):
-    try:
-        debug("Connecting to allocation_m3 for staff verification...")
-        connection = mysql.connector.connect(
-            host=STAFF_DB["host"],
-            port=int(STAFF_DB.get("port", 3306)),
-            user=STAFF_DB["user"],
-            password=STAFF_DB["password"],
-            database=STAFF_DB["database"]
-        )
-        cursor = connection.cursor()
-        cursor.execute("SELECT staffid FROM staff_list WHERE staffpos = 'OPERATOR'")
-        valid_ids = {row[0].strip().upper() for row in cursor.fetchall()}
-        connection.close()
-        debug(f"Retrieved {len(valid_ids)} staff IDs")
-        return staff_id_in.upper() in valid_ids
-    except Exception as e:
-        debug(f"Staff DB connection error: {e}")
-        return False
-
-# ===================== Barcode listener (KEEP YOUR PERFECT FLOW ORDER) =====================
-def on_key(event):
-    global barcode_buffer, last_barcode, last_scan_time
-    global current_batch, current_muf, template_code, muf_info, staff_id
-    global green_blink_running, green_blink_thread
-
-    if event.name == "enter":
-        barcode = barcode_buffer.strip()
-        normalized_barcode = normalize_barcode(barcode)
-        barcode_buffer = ""
-
-        now = datetime.now()
-        now_ts = time.time()
-
-        if barcode == last_barcode and now_ts - last_scan_time < SCAN_INTERVAL:
-            debug(f"⏱️ Duplicate scan ignored: {barcode}")
-            return
-
-        last_barcode = barcode
-        last_scan_time = now_ts
-
-        debug(f"📥 Scanned barcode: '{barcode}' → normalized: '{normalized_barcode}'")
-        debug(f"STATE before: batch={current_batch}, muf={current_muf}, template={template_code}, staff={staff_id}")
-
-        # stop alerts first (exact old behavior)
-        stop_all_alerts()
-
-        # RESET
-        if is_reset_code(barcode):
-            debug("🔄 RESET scanned. Starting new batch")
-            current_batch = f"batch_{now.strftime('%Y%m%d_%H%M%S')}"
-            current_muf = None
-            template_code = None
-            muf_info = None
-
-            green_blink_running = False
-            if green_blink_thread and green_blink_thread.is_alive():
-                green_blink_thread.join(timeout=1)
-            set_light(GREEN_PIN, False)
-
-            green_blink_running = True
-            green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
-            green_blink_thread.start()
-            debug("✅ Green light blinking restarted (RESET)")
-            return
-
-        # Staff
-        if any(c.isalpha() for c in normalized_barcode):
-            debug("Detected alpha -> treat as staff barcode")
-            # (keep your old staff IN/OUT block if you want full attendance logic;
-            #  you can paste it here unchanged. For now, we just validate and store session.)
-            if staff_id is None:
-                if not is_valid_staff_id(normalized_barcode):
-                    debug(f"Invalid staff ID: {normalized_barcode}")
-                    start_red_buzzer_alert()
-                    return
-                staff_id = normalized_barcode
-                debug(f"✅ Staff IN: {staff_id}")
-                blink_light(GREEN_PIN, times=1)
-                buzz(times=1)
-                return
-            elif normalized_barcode == staff_id:
-                debug(f"🔁 Staff OUT: {staff_id}")
-                staff_id = None
-                blink_light(GREEN_PIN, times=1)
-                buzz(times=1)
-                return
-            else:
-                debug(f"⚠️ Different staff scanned while staff session active. current={staff_id}, scanned={normalized_barcode}")
-                start_red_buzzer_alert()
-                return
-
-        # Must RESET first
-        if not current_batch:
-            debug("⚠️ Please scan RESET first.")
-            start_red_buzzer_alert()
-            return
-
-        # MUF stage
-        if current_muf is None:
-            try:
-                clean = normalize_barcode(barcode)
-                conn = connect_production(dict_cursor=True)
-                cursor = conn.cursor()
-                muf_info = fetch_muf_info(cursor, clean)
-                conn.close()
-
-                if muf_info:
-                    current_muf = clean
-                    debug(f"✅ MUF found: {current_muf}")
-                    debug("Green continues blinking until template set.")
-                else:
-                    debug(f"❌ MUF not found: {clean}")
-                    start_red_buzzer_alert()
-                return
-
-            except Exception as e:
-                debug(f"⚠️ DB connection error: {e}")
-                start_red_buzzer_alert()
-                return
-
-        # Template stage
-        if template_code is None:
-            normalized = normalize_barcode(barcode)
-            if normalized == current_muf:
-                debug(f"⚠️ Duplicate MUF barcode scanned as template: {normalized}")
-                start_red_buzzer_alert()
-                return
-
-            template_code = normalized
-            debug(f"🧾 Template barcode set: {template_code}")
-
-            green_blink_running = False
-            if green_blink_thread and green_blink_thread.is_alive():
-                green_blink_thread.join(timeout=1)
-
-            set_light(GREEN_PIN, True)  # solid ON
-            debug("✅ Green light solid ON (Template Set)")
-
-            process_and_store(barcode, muf_info, remarks="TEMPLATE")
-            return
-
-        # MISMATCH stage (THIS MUST ALERT)
-        if normalize_barcode(barcode) != template_code:
-            debug(f"❌ Carton mismatch! scanned={normalize_barcode(barcode)} != template={template_code}")
-            start_red_buzzer_alert()
-            return
-
-        # MATCH stage
-        debug(f"✅ Carton matches template: {template_code}")
-        process_and_store(template_code, muf_info, remarks="SCAN")
-        return
-
-    elif len(event.name) == 1:
-        barcode_buffer += event.name
-    elif event.name == "minus":
-        barcode_buffer += "-"
-
-# ===================== Main =====================
-if __name__ == "__main__":
-    debug("🔌 GPIO initialized")
-    debug(f"ERROR_ALERT_MODE={ERROR_ALERT_MODE}")
-    debug(f"CHANNEL_ACTIVE_LOW={CHANNEL_ACTIVE_LOW}")
-
-    upload_from_csv()
-
-    green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
-    green_blink_thread.start()
-    debug("Initial green light blinking started.")
-
-    debug("🧭 Listening for barcode scan via keyboard...")
-    keyboard.on_press(on_key)
-    keyboard.wait()
-
-
+#!/usr/bin/env python3
+import os
+import csv
+import mmap
+import time
+import queue
+import struct
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from functools import lru_cache
+import sys
+import socket
+import traceback
+from evdev import InputDevice, ecodes, list_devices
+import RPi.GPIO as GPIO
+import pymysql
+import mysql.connector
+import mysql.connector.pooling
+import calendar
+
+from config import (
+    PRODUCTION_DB, STAFF_DB,
+    DEVICE_LINE, DEVICE_ID,
+    CSV_FOLDER, LOG_PATH,
+    RESET_CODES, SCAN_INTERVAL,
+    DB_CONNECT_TIMEOUT, DB_READ_TIMEOUT, DB_WRITE_TIMEOUT,
+    UPLOAD_INTERVAL_SEC,
+)
+
+# ===================== SETTINGS =====================
+DEBUG_MODE = True
+
+# Error alert mode:
+#   "blink" -> (same as your old perfect code) red blink + buzzer beep pattern
+#   "solid" -> red ON continuously + buzzer ON continuously
+ERROR_ALERT_MODE = "blink"   # <-- if you want continuous ON, change to "solid"
+
+# Relay polarity (your old code assumes LOW=ON HIGH=OFF)
+ACTIVE_LOW = False # HF6 using Relay so using "True", others line no using Relay so using "False"
+CHANNEL_ACTIVE_LOW = {
+    "RED": ACTIVE_LOW,
+    "GREEN": ACTIVE_LOW,
+    "YELLOW": ACTIVE_LOW,
+    "BUZZER": ACTIVE_LOW,
+}
+# If any channel wiring differs, override:
+# CHANNEL_ACTIVE_LOW["BUZZER"] = False
+# CHANNEL_ACTIVE_LOW["RED"] = False
+
+def debug(msg):
+    if DEBUG_MODE:
+        print(f"[DEBUG] {msg}")
+
+# ===================== GPIO Setup =====================
+GPIO.setmode(GPIO.BCM)
+GPIO.setwarnings(False)
+
+RED_PIN = 5
+GREEN_PIN = 6
+YELLOW_PIN = 13
+BUZZER_PIN = 19
+
+GPIO.setup(RED_PIN, GPIO.OUT)
+GPIO.setup(GREEN_PIN, GPIO.OUT)
+GPIO.setup(YELLOW_PIN, GPIO.OUT)
+GPIO.setup(BUZZER_PIN, GPIO.OUT)
+
+_PIN_CHANNEL = {RED_PIN: "RED", GREEN_PIN: "GREEN", YELLOW_PIN: "YELLOW", BUZZER_PIN: "BUZZER"}
+
+def _level_for(pin: int, on: bool):
+    active_low = CHANNEL_ACTIVE_LOW.get(_PIN_CHANNEL.get(pin), False)
+    if active_low:
+        return GPIO.LOW if on else GPIO.HIGH
+    return GPIO.HIGH if on else GPIO.LOW
+
+# Pin writes go straight to the BCM283x set/clear registers via
+# /dev/gpiomem: one 32-bit store per edge instead of RPi.GPIO's per-call
+# lock + C wrapper, which adds jitter in the tight blink loops. RPi.GPIO
+# still does the mode/direction setup above; if the mapping isn't
+# available we fall back to GPIO.output.
+_GPSET0 = 0x1C
+_GPCLR0 = 0x28
+_gpio_mem = None
+try:
+    with open("/dev/gpiomem", "r+b") as _f:
+        _gpio_mem = mmap.mmap(_f.fileno(), 4096)
+except Exception as _e:
+    print(f"[DEBUG] gpiomem mmap unavailable, using RPi.GPIO writes: {_e}")
+
+# Polarity and the register path never change after boot, so each channel
+# gets a specialized writer closure: the mask bytes are pre-packed and the
+# set/clear offsets pre-swapped for active-low wiring, leaving a single
+# on/off branch per edge.
+def _make_pin_writer(pin, active_low):
+    if _gpio_mem is not None:
+        mask = struct.pack("<I", 1 << pin)
+        on_offset, off_offset = (_GPCLR0, _GPSET0) if active_low else (_GPSET0, _GPCLR0)
+
+        def write(on):
+            offset = on_offset if on else off_offset
+            _gpio_mem[offset:offset + 4] = mask
+    else:
+        on_level, off_level = (GPIO.LOW, GPIO.HIGH) if active_low else (GPIO.HIGH, GPIO.LOW)
+
+        def write(on):
+            GPIO.output(pin, on_level if on else off_level)
+    return write
+
+_PIN_WRITERS = {
+    pin: _make_pin_writer(pin, CHANNEL_ACTIVE_LOW[ch])
+    for pin, ch in _PIN_CHANNEL.items()
+}
+
+def set_light(pin, state=True):
+    # state=True means ON logically
+    writer = _PIN_WRITERS.get(pin)
+    if writer is not None:
+        writer(state)
+    else:
+        GPIO.output(pin, _level_for(pin, state))
+
+def set_lights(states):
+    if _gpio_mem is not None:
+        # each write is already a single MMIO store; nothing to batch
+        for pin, on in states:
+            _PIN_WRITERS[pin](on)
+    else:
+        # one RPi.GPIO call for all channels instead of a C crossing per pin
+        pins = [pin for pin, _ in states]
+        levels = [_level_for(pin, on) for pin, on in states]
+        GPIO.output(pins, levels)
+
+# init OFF
+set_lights([(RED_PIN, False), (GREEN_PIN, False), (YELLOW_PIN, False), (BUZZER_PIN, False)])
+
+# ===================== Log redirect =====================
+try:
+    sys.stdout = open(LOG_PATH, "a", buffering=1)
+    sys.stderr = sys.stdout
+    debug("🔁 Script started (log ready)")
+except Exception as e:
+    with open("/home/pi/gwim-scanner/gwim_fallback.txt", "a") as f:
+        f.write(f"Logging failed: {e}\n")
+
+# ===================== Logs writable check (for your old chown issue) =====================
+os.makedirs(CSV_FOLDER, exist_ok=True)
+
+def ensure_logs_writable() -> bool:
+    test_path = os.path.join(CSV_FOLDER, ".write_test")
+    try:
+        with open(test_path, "w") as f:
+            f.write("ok")
+        os.remove(test_path)
+        debug(f"✅ Logs folder writable: {CSV_FOLDER}")
+        return True
+    except Exception as e:
+        debug(f"❌ Logs folder NOT writable: {CSV_FOLDER} ({e})")
+        debug("Fix on Raspberry Pi terminal:")
+        debug("  sudo chown -R pi:pi /home/pi/gwim-scanner/logs")
+        debug("  sudo chmod -R 775 /home/pi/gwim-scanner/logs")
+        return False
+
+LOGS_WRITABLE = ensure_logs_writable()
+
+# ===================== State Control (exactly like your old) =====================
+green_blink_running = True
+green_blink_thread = None
+
+red_alert_active = False
+red_alert_thread = None
+buzzer_alert_active = False
+buzzer_alert_thread = None
+
+def blink_light(pin, duration=0.3, times=3):
+    for _ in range(times):
+        set_light(pin, True)
+        time.sleep(duration)
+        set_light(pin, False)
+        time.sleep(duration)
+
+def buzz(times=1, duration=0.15):
+    for _ in range(times):
+        set_light(BUZZER_PIN, True)
+        time.sleep(duration)
+        set_light(BUZZER_PIN, False)
+        time.sleep(0.1)
+
+def continuous_green_blink():
+    global green_blink_running
+    # Fast blink 5 times
+    for _ in range(5):
+        set_light(GREEN_PIN, True)
+        time.sleep(0.2)
+        set_light(GREEN_PIN, False)
+        time.sleep(0.1)
+    # Slow blink until stopped
+    while green_blink_running:
+        set_light(GREEN_PIN, True)
+        time.sleep(0.5)
+        set_light(GREEN_PIN, False)
+        time.sleep(0.5)
+    set_light(GREEN_PIN, False)
+
+def continuous_red_alert():
+    global red_alert_active
+    while red_alert_active:
+        if ERROR_ALERT_MODE == "solid":
+            set_light(RED_PIN, True)
+            time.sleep(0.1)
+        else:
+            set_light(RED_PIN, True); time.sleep(0.5)
+            set_light(RED_PIN, False); time.sleep(0.5)
+    set_light(RED_PIN, False)
+
+def continuous_buzzer_alert():
+    global buzzer_alert_active
+    while buzzer_alert_active:
+        if ERROR_ALERT_MODE == "solid":
+            set_light(BUZZER_PIN, True)
+            time.sleep(0.1)
+        else:
+            set_light(BUZZER_PIN, True); time.sleep(0.15)
+            set_light(BUZZER_PIN, False); time.sleep(0.5)
+    set_light(BUZZER_PIN, False)
+
+def stop_all_alerts():
+    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
+    debug("Stopping all active alerts...")
+    red_alert_active = False
+    buzzer_alert_active = False
+
+    if red_alert_thread and red_alert_thread.is_alive():
+        red_alert_thread.join(timeout=0.6)
+
+    if buzzer_alert_thread and buzzer_alert_thread.is_alive():
+        buzzer_alert_thread.join(timeout=0.6)
+
+    set_lights([(RED_PIN, False), (BUZZER_PIN, False)])
+    debug("All alerts stopped.")
+
+def start_red_buzzer_alert():
+    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
+
+    debug(f"🚨 START ALERT (mode={ERROR_ALERT_MODE})")
+    red_alert_active = True
+    buzzer_alert_active = True
+
+    # IMPORTANT: always restart threads if they died
+    if not (red_alert_thread and red_alert_thread.is_alive()):
+        red_alert_thread = threading.Thread(target=continuous_red_alert, daemon=True)
+        red_alert_thread.start()
+
+    if not (buzzer_alert_thread and buzzer_alert_thread.is_alive()):
+        buzzer_alert_thread = threading.Thread(target=continuous_buzzer_alert, daemon=True)
+        buzzer_alert_thread.start()
+
+# ===================== Internet Yellow (same as your old) =====================
+def check_internet(host="8.8.8.8", port=53, timeout=1.0):
+    # TCP connect to a public DNS server: one syscall instead of
+    # fork+exec of /bin/ping every 10 seconds.
+    try:
+        socket.create_connection((host, port), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+YELLOW_CHECK_INTERVAL_SEC = 10
+
+def update_yellow_light():
+    if check_internet():
+        set_light(YELLOW_PIN, True)
+    else:
+        blink_light(YELLOW_PIN, duration=0.5, times=1)
+
+def _yellow_loop():
+    # One long-lived thread with a monotonic deadline instead of a
+    # threading.Timer respawned per cycle: no Thread allocation every 10s,
+    # no cancel races, and the schedule doesn't drift by however long the
+    # probe (up to its 1s timeout) plus the blink took.
+    deadline = time.monotonic()
+    while True:
+        try:
+            update_yellow_light()
+        except Exception as e:
+            debug(f"⚠️ Yellow check error: {e}")
+        deadline += YELLOW_CHECK_INTERVAL_SEC
+        time.sleep(max(0.0, deadline - time.monotonic()))
+
+threading.Thread(target=_yellow_loop, daemon=True).start()
+
+# ===================== Helpers =====================
+def safe_int(value):
+    try:
+        return int(value)
+    except Exception:
+        return None
+
+# Map the odd dash variants some scanners emit (plus underscore) to "-"
+# in one translate pass instead of four chained .replace() copies.
+_DASH_TABLE = str.maketrans({"–": "-", "−": "-", "—": "-", "_": "-"})
+
+# A batch re-scans the same handful of codes hundreds of times and
+# handle_barcode normalizes 3-4 times per scan, so memoize: repeats are a
+# hash probe instead of strip+translate+upper allocating three strings.
+@lru_cache(maxsize=4096)
+def normalize_barcode(code):
+    return code.strip().translate(_DASH_TABLE).upper()
+
+# RESET_CODES is immutable config; normalize it once instead of per scan.
+_NORMALIZED_RESET = frozenset(normalize_barcode(r) for r in RESET_CODES)
+
+def is_reset_code(barcode):
+    return normalize_barcode(barcode) in _NORMALIZED_RESET
+
+def resolve_image_url(path):
+    path = (path or "").strip().lstrip("../")
+    return f"http://192.168.20.17/{path}"
+
+# ===================== DB Connect helpers (NEW, minimal) =====================
+def connect_production(dict_cursor=False):
+    kwargs = dict(
+        host=PRODUCTION_DB["host"],
+        user=PRODUCTION_DB["user"],
+        password=PRODUCTION_DB["password"],
+        database=PRODUCTION_DB["database"],
+        port=int(PRODUCTION_DB.get("port", 3306)),
+        connect_timeout=int(DB_CONNECT_TIMEOUT),
+        read_timeout=int(DB_READ_TIMEOUT),
+        write_timeout=int(DB_WRITE_TIMEOUT),
+        autocommit=True,
+    )
+    if dict_cursor:
+        kwargs["cursorclass"] = pymysql.cursors.DictCursor
+    conn = pymysql.connect(**kwargs)
+    _enable_keepalive(conn)
+    return conn
+
+def _enable_keepalive(conn):
+    # Arm TCP keepalive on the WAN socket: probe after 30s idle, every 10s,
+    # give up after 3 misses. Without this a silently dead link sits in the
+    # kernel's ~2h default window and every borrow of the connection hangs
+    # until the read timeout.
+    try:
+        sock = conn._sock  # pymysql keeps the raw socket here
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    except Exception:
+        pass
+
+# A couple of warm production connections instead of one shared behind a
+# lock: each scan used to pay a fresh TCP+auth handshake to the WAN DB,
+# and with a single connection the scan thread queued behind the upload
+# loop for the length of a whole backlog batch. Slots start empty and
+# connect lazily; borrowed connections are validated with
+# ping(reconnect=True) so a dropped link heals transparently.
+PROD_POOL_SIZE = 2
+
+_prod_pool = queue.Queue(maxsize=PROD_POOL_SIZE)
+for _ in range(PROD_POOL_SIZE):
+    _prod_pool.put(None)
+
+def _prod_pool_get():
+    conn = _prod_pool.get()
+    if conn is not None:
+        try:
+            conn.ping(reconnect=True)
+            return conn
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    try:
+        return connect_production()
+    except Exception:
+        _prod_pool.put(None)  # give the slot back so the pool never shrinks
+        raise
+
+def _prod_pool_put(conn, broken=False):
+    if broken and conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        conn = None
+    _prod_pool.put(conn)
+
+@contextmanager
+def production_conn():
+    conn = _prod_pool_get()
+    try:
+        yield conn
+    except Exception:
+        # Conservatively discard: the failure may have left the connection
+        # mid-transaction or with unread results.
+        _prod_pool_put(conn, broken=True)
+        raise
+    else:
+        _prod_pool_put(conn)
+
+# ===================== Global vars =====================
+current_batch = None
+current_muf = None
+template_code = None
+muf_info = None
+last_scan_time = 0
+last_barcode = None
+barcode_buffer = ""
+staff_id = None
+
+csv_lock = threading.Lock()
+
+# ===================== MUF query =====================
+# The same MUF is scanned over and over within a batch; remember rows we
+# already fetched so re-scans skip the WAN round-trip. Cleared on RESET.
+_MUF_CACHE = {}
+
+def fetch_muf_info(muf_code):
+    cached = _MUF_CACHE.get(muf_code)
+    if cached is not None:
+        debug(f"📦 MUF cache hit: {muf_code}")
+        return cached
+
+    debug(f"Querying table 'main' for muf_no = '{muf_code}'")
+    with production_conn() as conn:
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor.execute("SELECT * FROM main WHERE muf_no = %s", (muf_code,))
+        row = cursor.fetchone()
+        cursor.close()
+
+    if row:
+        _MUF_CACHE[muf_code] = row
+    return row
+
+# ===================== CSV write (keep, but add safety) =====================
+CSV_HEADER = [
+    "muf_no", "line", "fg_no", "pack_per_ctn", "pack_per_hr",
+    "actual_pack", "ctn_count", "scanned_code", "scanned_count",
+    "scanned_at", "scanned_by", "remarks", "is_uploaded"
+]
+
+# Rows per executemany batch when draining cached CSVs (bounds packet size)
+UPLOAD_BATCH_SIZE = 100
+
+# Built once: the live insert and the CSV upload send the identical
+# statement, so the string (and the server's plan for it, on the
+# long-lived connection) is reused instead of rebuilt per scan.
+INSERT_OUTPUT_SQL = (
+    "INSERT INTO output_log ("
+    "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
+    "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
+    ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+)
+
+# The %Y%m%d stamp only changes at midnight; cache it with its expiry in
+# epoch seconds so a scan costs one time.time() instead of a strftime.
+_day_stamp = None
+_day_stamp_expiry = 0.0
+
+def _today_stamp():
+    global _day_stamp, _day_stamp_expiry
+    now_ts = time.time()
+    if now_ts >= _day_stamp_expiry:
+        lt = time.localtime(now_ts)
+        _day_stamp = time.strftime("%Y%m%d", lt)
+        secs_today = lt.tm_hour * 3600 + lt.tm_min * 60 + lt.tm_sec
+        _day_stamp_expiry = now_ts + (86400 - secs_today)
+    return _day_stamp
+
+def write_to_csv(data_11, muf_no, uploaded=0, remarks=""):
+    if not LOGS_WRITABLE:
+        debug("⚠️ logs not writable; CSV not saved.")
+        return
+
+    with csv_lock:
+        filename = os.path.join(CSV_FOLDER, f"{muf_no}_{_today_stamp()}.csv")
+        is_new = not os.path.exists(filename)
+        try:
+            with open(filename, "a", newline="") as f:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(CSV_HEADER)
+                writer.writerow(list(data_11) + [remarks, int(uploaded)])
+            debug(f"📂 Written to CSV: {filename} (uploaded={uploaded}, remarks={remarks})")
+        except Exception as e:
+            debug(f"⚠️ CSV write failed: {e}")
+
+# ===================== Insert output_log (minimal change) =====================
+def process_and_store(barcode, muf_info_dict, remarks=""):
+    pack_per_ctn = safe_int(muf_info_dict.get("pack_per_ctn"))
+    ctn_count = 1
+    actual_pack = pack_per_ctn * ctn_count if pack_per_ctn is not None else None
+
+    # time.strftime skips datetime object construction per scan
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    data_11 = (
+        current_muf,
+        DEVICE_LINE,
+        muf_info_dict.get("fg_no"),
+        pack_per_ctn,
+        safe_int(muf_info_dict.get("pack_per_hr")),
+        actual_pack,
+        ctn_count,
+        normalize_barcode(barcode),
+        1,
+        timestamp,
+        staff_id if staff_id else DEVICE_ID,
+    )
+
+    try:
+        with production_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(INSERT_OUTPUT_SQL, data_11 + (remarks,))
+            conn.commit()
+            cursor.close()
+
+        debug("✅ DB insert successful")
+        write_to_csv(data_11, current_muf, uploaded=1, remarks=remarks)
+
+    except Exception as e:
+        debug(f"⚠️ DB insert failed. Cached locally: {e}")
+        write_to_csv(data_11, current_muf, uploaded=0, remarks=remarks)
+
+# ===================== Upload pending CSV (fix 0-byte/empty) =====================
+# Each CSV gets a small "<name>.csv.offset" sidecar holding the byte offset
+# of the first row not yet examined. Every cycle we only read from there,
+# upload pending rows, then advance the offset — no more reading and
+# rewriting the whole file just to flip is_uploaded flags.
+def _read_upload_offset(offset_path):
+    try:
+        with open(offset_path) as f:
+            return int(f.read().strip() or 0)
+    except Exception:
+        return 0
+
+def _write_upload_offset(offset_path, offset):
+    tmp = offset_path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, offset_path)
+    except Exception as e:
+        debug(f"⚠️ Offset write failed: {e}")
+
+def upload_from_csv_once():
+    debug("⏫ Attempting to upload cached CSV data...")
+
+    if not os.path.isdir(CSV_FOLDER):
+        return
+
+    for file in os.listdir(CSV_FOLDER):
+        if not file.endswith(".csv"):
+            continue
+
+        path = os.path.join(CSV_FOLDER, file)
+        offset_path = path + ".offset"
+
+        # Fix: remove 0-byte CSV
+        try:
+            if os.path.getsize(path) == 0:
+                debug(f"🧹 Removing 0-byte CSV: {path}")
+                try:
+                    os.remove(path)
+                    os.remove(offset_path)
+                except Exception:
+                    pass
+                continue
+        except Exception:
+            continue
+
+        offset = _read_upload_offset(offset_path)
+
+        with csv_lock:
+            try:
+                with open(path, "rb") as f:
+                    # Re-read the real header every cycle (one readline
+                    # before the seek): legacy files with a different
+                    # column order must keep their own mapping instead of
+                    # being parsed as CSV_HEADER from cycle 2 onward.
+                    header_line = f.readline()
+                    headers = next(
+                        csv.reader([header_line.decode("utf-8", "replace")]), None
+                    )
+                    # ensure header has our required fields
+                    if not headers or "is_uploaded" not in headers:
+                        debug(f"⚠️ CSV header unexpected, skip: {path}")
+                        continue
+                    if offset > f.tell():
+                        f.seek(offset)
+
+                    idx_uploaded = headers.index("is_uploaded")
+                    idx_remarks = headers.index("remarks") if "remarks" in headers else None
+                    # the flag is the last column, so a one-byte check on
+                    # the raw line skips uploaded rows without decoding
+                    flag_is_last = idx_uploaded == len(headers) - 1
+
+                    # Map using our known header order CSV_HEADER
+                    # If old files exist, still handle by header index
+                    col_idx = {col: i for i, col in enumerate(headers)}
+
+                    def get(row, col):
+                        i = col_idx.get(col)
+                        return row[i] if i is not None and i < len(row) else None
+
+                    # Stream in binary: only pending lines pay the decode +
+                    # csv parse, and memory holds just the insert tuples.
+                    rows_to_insert = []
+                    for raw in f:
+                        stripped = raw.rstrip(b"\r\n")
+                        if not stripped or (flag_is_last and not stripped.endswith(b"0")):
+                            continue
+                        row = next(
+                            csv.reader([stripped.decode("utf-8", "replace")]), None
+                        )
+                        if row and len(row) > idx_uploaded and row[idx_uploaded] == "0":
+                            rows_to_insert.append((
+                                get(row, "muf_no"),
+                                get(row, "line"),
+                                get(row, "fg_no"),
+                                get(row, "pack_per_ctn"),
+                                get(row, "pack_per_hr"),
+                                get(row, "actual_pack"),
+                                get(row, "ctn_count"),
+                                get(row, "scanned_code"),
+                                get(row, "scanned_count"),
+                                get(row, "scanned_at"),
+                                get(row, "scanned_by"),
+                                get(row, "remarks") if idx_remarks is not None else "",
+                            ))
+                    end_offset = f.tell()
+            except Exception:
+                continue
+
+        if not rows_to_insert:
+            # Nothing new to upload; remember how far we got — but only
+            # when the file actually grew, so an idle line doesn't pay a
+            # tmp-write + rename to the SD card every cycle.
+            if end_offset != offset:
+                _write_upload_offset(offset_path, end_offset)
+            continue
+
+        try:
+            with production_conn() as conn:
+                cursor = conn.cursor()
+
+                # One multi-VALUES round-trip per chunk instead of one per
+                # row, and BEGIN suspends the connection's per-statement
+                # autocommit so the whole file commits atomically — one
+                # server fsync at COMMIT instead of one per chunk, and a
+                # failure mid-backlog leaves nothing half-uploaded.
+                conn.begin()
+                for start in range(0, len(rows_to_insert), UPLOAD_BATCH_SIZE):
+                    cursor.executemany(INSERT_OUTPUT_SQL,
+                                       rows_to_insert[start:start + UPLOAD_BATCH_SIZE])
+
+                conn.commit()
+                cursor.close()
+
+            # All rows up to end_offset are now in the DB.
+            with csv_lock:
+                _write_upload_offset(offset_path, end_offset)
+
+            debug(f"✅ Upload complete ({len(rows_to_insert)} rows): {path}")
+
+        except Exception as e:
+            debug(f"⚠️ Upload failed: {e}")
+
+# One long-lived daemon thread instead of a threading.Timer re-arming
+# itself every cycle: no per-cycle Thread allocation, and an exception in
+# one pass no longer kills the schedule.
+_upload_stop = threading.Event()
+
+def _upload_loop():
+    # Monotonic deadline keeps the cadence fixed: waiting a flat interval
+    # after each pass let the schedule drift by however long a backlog
+    # drain took, which matters once a cycle runs tens of seconds.
+    deadline = time.monotonic() + UPLOAD_INTERVAL_SEC
+    while True:
+        try:
+            upload_from_csv_once()
+        except Exception:
+            traceback.print_exc()
+        if _upload_stop.wait(max(0.0, deadline - time.monotonic())):
+            break
+        deadline += UPLOAD_INTERVAL_SEC
+
+# ===================== Staff verification (keep old behavior, use STAFF_DB) =====================
+# IDs that validated OK recently; only positive answers are cached so a
+# DB hiccup never poisons the cache, and entries expire so operators
+# removed from the roster stop validating within a few minutes instead
+# of staying valid for the rest of the shift.
+STAFF_CACHE_TTL_SEC = 300
+_VALID_STAFF_CACHE = {}  # sid -> expiry timestamp
+
+# Cache misses used to open a fresh TCP+auth connection to allocation_m3
+# per scan; a small pool keeps those sockets warm. close() on a pooled
+# connection returns it to the pool instead of tearing down the socket.
+STAFF_POOL = mysql.connector.pooling.MySQLConnectionPool(
+    pool_name="staff",
+    pool_size=4,
+    host=STAFF_DB["host"],
+    port=int(STAFF_DB.get("port", 3306)),
+    user=STAFF_DB["user"],
+    password=STAFF_DB["password"],
+    database=STAFF_DB["database"],
+)
+
+def is_valid_staff_id(staff_id_in):
+    sid = staff_id_in.upper()
+    expiry = _VALID_STAFF_CACHE.get(sid)
+    if expiry is not None and expiry > time.time():
+        return True
+    try:
+        debug("Connecting to allocation_m3 for staff verification...")
+        connection = STAFF_POOL.get_connection()
+        cursor = connection.cursor()
+        # One indexed lookup for this ID; the old query pulled the entire
+        # OPERATOR roster over the wire on every staff scan.
+        cursor.execute(
+            "SELECT 1 FROM staff_list WHERE staffid = %s AND staffpos = 'OPERATOR' LIMIT 1",
+            (sid,)
+        )
+        found = cursor.fetchone() is not None
+        connection.close()
+        debug(f"Staff lookup: {sid} -> {'valid' if found else 'not found'}")
+        if found:
+            _VALID_STAFF_CACHE[sid] = time.time() + STAFF_CACHE_TTL_SEC
+            return True
+        return False
+    except Exception as e:
+        debug(f"Staff DB connection error: {e}")
+        return False
+
+# ===================== Barcode listener (KEEP YOUR PERFECT FLOW ORDER) =====================
+def handle_barcode(barcode):
+    global last_barcode, last_scan_time
+    global current_batch, current_muf, template_code, muf_info, staff_id
+    global green_blink_running, green_blink_thread
+
+    barcode = barcode.strip()
+    normalized_barcode = normalize_barcode(barcode)
+
+    now = datetime.now()
+    now_ts = time.time()
+
+    if barcode == last_barcode and now_ts - last_scan_time < SCAN_INTERVAL:
+        debug(f"⏱️ Duplicate scan ignored: {barcode}")
+        return
+
+    last_barcode = barcode
+    last_scan_time = now_ts
+
+    debug(f"📥 Scanned barcode: '{barcode}' → normalized: '{normalized_barcode}'")
+    debug(f"STATE before: batch={current_batch}, muf={current_muf}, template={template_code}, staff={staff_id}")
+
+    # stop alerts first (exact old behavior)
+    stop_all_alerts()
+
+    # RESET
+    if is_reset_code(barcode):
+        debug("🔄 RESET scanned. Starting new batch")
+        current_batch = f"batch_{now.strftime('%Y%m%d_%H%M%S')}"
+        current_muf = None
+        template_code = None
+        muf_info = None
+        _MUF_CACHE.clear()
+
+        green_blink_running = False
+        if green_blink_thread and green_blink_thread.is_alive():
+            green_blink_thread.join(timeout=1)
+        set_light(GREEN_PIN, False)
+
+        green_blink_running = True
+        green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
+        green_blink_thread.start()
+        debug("✅ Green light blinking restarted (RESET)")
+        return
+
+    # Staff
+    if any(c.isalpha() for c in normalized_barcode):
+        debug("Detected alpha -> treat as staff barcode")
+        # (this build keeps the staff session purely in-memory — validate
+        #  and remember, no status table writes. For the full attendance
+        #  logic use main_final.py / pi4/main.py, whose IN/OUT toggle is a
+        #  single INSERT ... ON DUPLICATE KEY UPDATE round-trip.)
+        if staff_id is None:
+            if not is_valid_staff_id(normalized_barcode):
+                debug(f"Invalid staff ID: {normalized_barcode}")
+                start_red_buzzer_alert()
+                return
+            staff_id = normalized_barcode
+            debug(f"✅ Staff IN: {staff_id}")
+            blink_light(GREEN_PIN, times=1)
+            buzz(times=1)
+            return
+        elif normalized_barcode == staff_id:
+            debug(f"🔁 Staff OUT: {staff_id}")
+            staff_id = None
+            blink_light(GREEN_PIN, times=1)
+            buzz(times=1)
+            return
+        else:
+            debug(f"⚠️ Different staff scanned while staff session active. current={staff_id}, scanned={normalized_barcode}")
+            start_red_buzzer_alert()
+            return
+
+    # Must RESET first
+    if not current_batch:
+        debug("⚠️ Please scan RESET first.")
+        start_red_buzzer_alert()
+        return
+
+    # MUF stage
+    if current_muf is None:
+        try:
+            clean = normalize_barcode(barcode)
+            muf_info = fetch_muf_info(clean)
+
+            if muf_info:
+                current_muf = clean
+                debug(f"✅ MUF found: {current_muf}")
+                debug("Green continues blinking until template set.")
+            else:
+                debug(f"❌ MUF not found: {clean}")
+                start_red_buzzer_alert()
+            return
+
+        except Exception as e:
+            debug(f"⚠️ DB connection error: {e}")
+            start_red_buzzer_alert()
+            return
+
+    # Template stage
+    if template_code is None:
+        normalized = normalize_barcode(barcode)
+        if normalized == current_muf:
+            debug(f"⚠️ Duplicate MUF barcode scanned as template: {normalized}")
+            start_red_buzzer_alert()
+            return
+
+        template_code = normalized
+        debug(f"🧾 Template barcode set: {template_code}")
+
+        green_blink_running = False
+        if green_blink_thread and green_blink_thread.is_alive():
+            green_blink_thread.join(timeout=1)
+
+        set_light(GREEN_PIN, True)  # solid ON
+        debug("✅ Green light solid ON (Template Set)")
+
+        process_and_store(barcode, muf_info, remarks="TEMPLATE")
+        return
+
+    # MISMATCH stage (THIS MUST ALERT)
+    if normalize_barcode(barcode) != template_code:
+        debug(f"❌ Carton mismatch! scanned={normalize_barcode(barcode)} != template={template_code}")
+        start_red_buzzer_alert()
+        return
+
+    # MATCH stage
+    debug(f"✅ Carton matches template: {template_code}")
+    process_and_store(template_code, muf_info, remarks="SCAN")
+    return
+
+# ===================== Barcode input (evdev) =====================
+# The scanner is a USB HID keyboard; reading its event node directly
+# replaces the keyboard module's global hook (which woke Python for every
+# keystroke on every keyboard). Only key-down events we care about are
+# mapped; handle_barcode fires once per Enter.
+_KEYCODE_TO_CHAR = {ecodes.KEY_MINUS: "-"}
+for _d in "0123456789":
+    _KEYCODE_TO_CHAR[getattr(ecodes, f"KEY_{_d}")] = _d
+for _c in "abcdefghijklmnopqrstuvwxyz":
+    _KEYCODE_TO_CHAR[getattr(ecodes, f"KEY_{_c.upper()}")] = _c
+
+def find_scanner_device():
+    by_id = "/dev/input/by-id"
+    try:
+        for name in sorted(os.listdir(by_id)):
+            if name.endswith("-kbd"):
+                return InputDevice(os.path.join(by_id, name))
+    except OSError:
+        pass  # by-id symlinks missing on some images; fall through
+    # Fallback: first event node that reports key events (a HID scanner
+    # shows up as a keyboard) — scanned in order so event0 wins ties.
+    for path in list_devices():
+        dev = InputDevice(path)
+        if ecodes.EV_KEY in dev.capabilities():
+            return dev
+        dev.close()
+    raise RuntimeError(f"No scanner device found via {by_id} or capabilities")
+
+def input_loop():
+    global barcode_buffer
+    dev = find_scanner_device()
+    debug(f"🧭 Reading barcodes from {dev.path} ({dev.name})")
+    for event in dev.read_loop():
+        if event.type != ecodes.EV_KEY or event.value != 1:
+            continue
+        if event.code == ecodes.KEY_ENTER:
+            barcode = barcode_buffer
+            barcode_buffer = ""
+            handle_barcode(barcode)
+        else:
+            ch = _KEYCODE_TO_CHAR.get(event.code)
+            if ch:
+                barcode_buffer += ch
+
+# ===================== Main =====================
+if __name__ == "__main__":
+    debug("🔌 GPIO initialized")
+    debug(f"ERROR_ALERT_MODE={ERROR_ALERT_MODE}")
+    debug(f"CHANNEL_ACTIVE_LOW={CHANNEL_ACTIVE_LOW}")
+
+    threading.Thread(target=_upload_loop, daemon=True).start()
+
+    green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
+    green_blink_thread.start()
+    debug("Initial green light blinking started.")
+
+    debug("🧭 Listening for barcode scans via evdev...")
+    input_loop()
+
+
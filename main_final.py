@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 import os
+import re
 import csv
 import time
+import queue
 import threading
+from contextlib import contextmanager
 from datetime import datetime
 import sys
-import subprocess
-import keyboard
+import atexit
+import signal
+import socket
+from evdev import InputDevice, ecodes
 import RPi.GPIO as GPIO
 import pymysql
 import mysql.connector
@@ -59,35 +64,68 @@ GPIO.setup(GREEN_PIN, GPIO.OUT)
 GPIO.setup(YELLOW_PIN, GPIO.OUT)
 GPIO.setup(BUZZER_PIN, GPIO.OUT)
 
-def _pin_write(pin: int, on: bool, active_low: bool):
-    if active_low:
-        GPIO.output(pin, GPIO.LOW if on else GPIO.HIGH)
-    else:
-        GPIO.output(pin, GPIO.HIGH if on else GPIO.LOW)
+# Per-pin (off, on) levels resolved once at import: a toggle indexes the
+# tuple with its bool instead of re-reading CHANNEL_ACTIVE_LOW and
+# branching on the wiring for every blink edge.
+_PIN_LEVELS = {
+    pin: ((GPIO.HIGH, GPIO.LOW) if CHANNEL_ACTIVE_LOW[ch] else (GPIO.LOW, GPIO.HIGH))
+    for pin, ch in ((RED_PIN, "RED"), (GREEN_PIN, "GREEN"),
+                    (YELLOW_PIN, "YELLOW"), (BUZZER_PIN, "BUZZER"))
+}
+
+# Last logical state per pin: every GPIO.output is a /sys write, so skip
+# the syscall when the pin is already where we want it.
+_led_state = {}
 
 def set_light(pin, state=True):
     # state=True means ON logically
-    if pin == RED_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["RED"])
-    elif pin == GREEN_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["GREEN"])
-    elif pin == YELLOW_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["YELLOW"])
-    elif pin == BUZZER_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["BUZZER"])
+    if _led_state.get(pin) == state:
+        return
+    _led_state[pin] = state
+    levels = _PIN_LEVELS.get(pin)
+    if levels is not None:
+        GPIO.output(pin, levels[state])
     else:
         GPIO.output(pin, GPIO.LOW if state else GPIO.HIGH)
 
+# RPi.GPIO accepts pin/value lists, so clearing the whole tower is one
+# C-level call instead of four. Off levels depend on each channel's wiring.
+_ALL_PINS = [RED_PIN, GREEN_PIN, YELLOW_PIN, BUZZER_PIN]
+_ALL_OFF_LEVELS = [_PIN_LEVELS[pin][0] for pin in _ALL_PINS]
+
+def tower_all_off():
+    for pin in _ALL_PINS:
+        _led_state[pin] = False
+    GPIO.output(_ALL_PINS, _ALL_OFF_LEVELS)
+
 # init OFF
-set_light(RED_PIN, False)
-set_light(GREEN_PIN, False)
-set_light(YELLOW_PIN, False)
-set_light(BUZZER_PIN, False)
+tower_all_off()
 
 # ===================== Log redirect =====================
+# Block-buffered (8 KB) instead of line-buffered: debug() fires 5-10 times
+# per scan and line buffering meant a write() syscall per line. A daemon
+# thread flushes every 2s; atexit + SIGTERM cover shutdown.
+def _flush_log():
+    try:
+        sys.stdout.flush()
+    except Exception:
+        pass
+
+def _log_flush_loop():
+    while True:
+        time.sleep(2)
+        _flush_log()
+
+def _on_sigterm(signum, frame):
+    _flush_log()
+    sys.exit(0)
+
 try:
-    sys.stdout = open(LOG_PATH, "a", buffering=1)
+    sys.stdout = open(LOG_PATH, "a", buffering=8192)
     sys.stderr = sys.stdout
+    atexit.register(_flush_log)
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    threading.Thread(target=_log_flush_loop, daemon=True).start()
     debug("🔁 Script started (log ready)")
 except Exception as e:
     with open("/home/pi/gwim-scanner/gwim_fallback.txt", "a") as f:
@@ -114,13 +152,19 @@ def ensure_logs_writable() -> bool:
 LOGS_WRITABLE = ensure_logs_writable()
 
 # ===================== State Control (exactly like your old) =====================
-green_blink_running = True
-green_blink_thread = None
-
-red_alert_active = False
-red_alert_thread = None
-buzzer_alert_active = False
-buzzer_alert_thread = None
+# Green light target mode ("blink" / "solid" / "off"), served by one
+# persistent worker thread. _green_mode_changed preempts the current
+# pattern edge, so a switch takes effect immediately instead of waiting
+# out a sleep — and RESET no longer spawns a fresh thread per scan.
+_green_mode = "off"
+_green_mode_changed = threading.Event()
+
+# Error alert state. _error_event is set while the red/buzzer alert is
+# active; _error_cleared is its complement and wakes any blink wait the
+# instant the alert ends, so the workers never sleep-and-poll.
+_error_event = threading.Event()
+_error_cleared = threading.Event()
+_error_cleared.set()
 
 def blink_light(pin, duration=0.3, times=3):
     for _ in range(times):
@@ -136,102 +180,153 @@ def buzz(times=1, duration=0.15):
         set_light(BUZZER_PIN, False)
         time.sleep(0.1)
 
-def continuous_green_blink():
-    global green_blink_running
-    # Fast blink 5 times
-    for _ in range(5):
-        set_light(GREEN_PIN, True)
-        time.sleep(0.2)
-        set_light(GREEN_PIN, False)
-        time.sleep(0.1)
-    # Slow blink until stopped
-    while green_blink_running:
-        set_light(GREEN_PIN, True)
-        time.sleep(0.5)
-        set_light(GREEN_PIN, False)
-        time.sleep(0.5)
-    set_light(GREEN_PIN, False)
-
-def continuous_red_alert():
-    global red_alert_active
-    while red_alert_active:
+def set_green_mode(mode):
+    global _green_mode
+    _green_mode = mode
+    _green_mode_changed.set()
+
+def _green_worker():
+    while True:
+        _green_mode_changed.wait()
+        _green_mode_changed.clear()
+        mode = _green_mode
+        if mode == "solid":
+            set_light(GREEN_PIN, True)
+        elif mode == "off":
+            set_light(GREEN_PIN, False)
+        else:
+            # blink: fast 5 times, then slow until the mode changes; a
+            # True from wait(timeout) means we were preempted mid-edge
+            preempted = False
+            for _ in range(5):
+                set_light(GREEN_PIN, True)
+                if _green_mode_changed.wait(0.2):
+                    preempted = True
+                    break
+                set_light(GREEN_PIN, False)
+                if _green_mode_changed.wait(0.1):
+                    preempted = True
+                    break
+            while not preempted:
+                set_light(GREEN_PIN, True)
+                if _green_mode_changed.wait(0.5):
+                    break
+                set_light(GREEN_PIN, False)
+                if _green_mode_changed.wait(0.5):
+                    break
+
+def red_alert_worker():
+    # Persistent worker: blocks on _error_event while idle (zero CPU),
+    # then times each blink edge with _error_cleared.wait(timeout) — the
+    # True return means the alert was cleared mid-edge.
+    while True:
+        _error_event.wait()
         if ERROR_ALERT_MODE == "solid":
             set_light(RED_PIN, True)
-            time.sleep(0.1)
+            _error_cleared.wait()
         else:
-            set_light(RED_PIN, True); time.sleep(0.5)
-            set_light(RED_PIN, False); time.sleep(0.5)
-    set_light(RED_PIN, False)
-
-def continuous_buzzer_alert():
-    global buzzer_alert_active
-    while buzzer_alert_active:
+            while True:
+                set_light(RED_PIN, True)
+                if _error_cleared.wait(0.5):
+                    break
+                set_light(RED_PIN, False)
+                if _error_cleared.wait(0.5):
+                    break
+        set_light(RED_PIN, False)
+
+def buzzer_alert_worker():
+    while True:
+        _error_event.wait()
         if ERROR_ALERT_MODE == "solid":
             set_light(BUZZER_PIN, True)
-            time.sleep(0.1)
+            _error_cleared.wait()
         else:
-            set_light(BUZZER_PIN, True); time.sleep(0.15)
-            set_light(BUZZER_PIN, False); time.sleep(0.5)
-    set_light(BUZZER_PIN, False)
+            while True:
+                set_light(BUZZER_PIN, True)
+                if _error_cleared.wait(0.15):
+                    break
+                set_light(BUZZER_PIN, False)
+                if _error_cleared.wait(0.5):
+                    break
+        set_light(BUZZER_PIN, False)
+
+# ===================== Feedback effects worker =====================
+# blink_light/buzz sleep for hundreds of ms; run on the scan thread they
+# stall handle_barcode while the scanner keeps emitting keystrokes.
+# The handler enqueues the effect and returns immediately; one daemon
+# thread plays them back in order. The queue is kept short so rapid-fire
+# feedback can't build a multi-second beeper backlog.
+_fx_queue = queue.Queue()
+FX_QUEUE_MAX = 4
+
+def queue_fx(effect, arg=1):
+    if _fx_queue.qsize() < FX_QUEUE_MAX:
+        _fx_queue.put((effect, arg))
+
+def _fx_worker():
+    while True:
+        effect, arg = _fx_queue.get()
+        try:
+            if effect == "blink_green":
+                blink_light(GREEN_PIN, times=arg)
+            elif effect == "buzz":
+                buzz(times=arg)
+            elif effect == "green_solid":
+                set_light(GREEN_PIN, bool(arg))
+        except Exception as e:
+            debug(f"⚠️ FX error: {e}")
 
 def stop_all_alerts():
-    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
     debug("Stopping all active alerts...")
-    red_alert_active = False
-    buzzer_alert_active = False
-
-    if red_alert_thread and red_alert_thread.is_alive():
-        red_alert_thread.join(timeout=0.6)
+    _error_event.clear()
+    _error_cleared.set()  # wakes both workers mid-edge
     set_light(RED_PIN, False)
-
-    if buzzer_alert_thread and buzzer_alert_thread.is_alive():
-        buzzer_alert_thread.join(timeout=0.6)
     set_light(BUZZER_PIN, False)
     debug("All alerts stopped.")
 
 def start_red_buzzer_alert():
-    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
-
     debug(f"🚨 START ALERT (mode={ERROR_ALERT_MODE})")
-    red_alert_active = True
-    buzzer_alert_active = True
-
-    # IMPORTANT: always restart threads if they died
-    if not (red_alert_thread and red_alert_thread.is_alive()):
-        red_alert_thread = threading.Thread(target=continuous_red_alert, daemon=True)
-        red_alert_thread.start()
-
-    if not (buzzer_alert_thread and buzzer_alert_thread.is_alive()):
-        buzzer_alert_thread = threading.Thread(target=continuous_buzzer_alert, daemon=True)
-        buzzer_alert_thread.start()
+    _error_cleared.clear()
+    _error_event.set()
 
 # ===================== Internet Yellow (same as your old) =====================
-yellow_checker_timer = None
-
-def check_internet():
+# Last probe result, kept for 5s so back-to-back callers between yellow
+# cycles share one socket probe instead of each paying a round-trip.
+_net_status = False
+_net_status_expires = 0.0
+
+def check_internet(host="8.8.8.8", port=53, timeout=1.0):
+    # TCP connect to Google's public resolver: one syscall pair instead of
+    # fork+exec of /bin/ping every 10s
+    global _net_status, _net_status_expires
+    now = time.monotonic()
+    if now < _net_status_expires:
+        return _net_status
     try:
-        return subprocess.call(
-            ["ping", "-c", "1", "-W", "1", "8.8.8.8"],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        ) == 0
-    except Exception:
-        return False
+        socket.create_connection((host, port), timeout=timeout).close()
+        _net_status = True
+    except OSError:
+        _net_status = False
+    _net_status_expires = now + 5.0
+    return _net_status
 
 def update_yellow_light():
-    global yellow_checker_timer
-    if yellow_checker_timer and yellow_checker_timer.is_alive():
-        yellow_checker_timer.cancel()
-
     if check_internet():
         set_light(YELLOW_PIN, True)
     else:
         blink_light(YELLOW_PIN, duration=0.5, times=1)
 
-    yellow_checker_timer = threading.Timer(10, update_yellow_light)
-    yellow_checker_timer.daemon = True
-    yellow_checker_timer.start()
+def _yellow_loop():
+    # Same long-lived-thread shape as _upload_loop: no Timer spawned per
+    # cycle, no cancel races, and an exception can't break the chain.
+    while True:
+        try:
+            update_yellow_light()
+        except Exception as e:
+            debug(f"⚠️ Yellow check error: {e}")
+        time.sleep(10)
 
-update_yellow_light()
+threading.Thread(target=_yellow_loop, daemon=True).start()
 
 # ===================== Helpers =====================
 def safe_int(value):
@@ -240,18 +335,24 @@ def safe_int(value):
     except Exception:
         return None
 
+# One precompiled table: 4 chained .replace() passes (each allocating a new
+# string) become a single translate pass. Called several times per scan.
+_DASH_TRANS = str.maketrans({"–": "-", "−": "-", "—": "-", "_": "-"})
+
 def normalize_barcode(code):
-    return (
-        code.strip()
-            .replace("–", "-")
-            .replace("−", "-")
-            .replace("—", "-")
-            .replace("_", "-")
-            .upper()
-    )
+    return code.strip().translate(_DASH_TRANS).upper()
 
-def is_reset_code(barcode):
-    return normalize_barcode(barcode) in {normalize_barcode(r) for r in RESET_CODES}
+# normalized once at import; frozenset signals immutability and keeps the
+# O(1) lookup
+RESET_SET = frozenset(normalize_barcode(r) for r in RESET_CODES)
+
+def is_reset_code(norm_code):
+    # expects an already-normalized barcode
+    return norm_code in RESET_SET
+
+# Staff barcodes are the ones containing letters; one C-level regex scan
+# instead of a per-char Python generator.
+_ALPHA_RE = re.compile(r"[A-Za-z]")
 
 def resolve_image_url(path):
     path = (path or "").strip().lstrip("../")
@@ -322,7 +423,7 @@ def connect_allocation_m3(dict_cursor=False):
         kwargs["dictionary"] = True
     return mysql.connector.connect(**kwargs)
 
-def connect_staff_gwidb(dict_cursor=False):
+def connect_staff_gwidb():
     kwargs = dict(
         host=STAFF_GWI_DB["host"],
         user=STAFF_GWI_DB["user"],
@@ -330,10 +431,68 @@ def connect_staff_gwidb(dict_cursor=False):
         database=STAFF_GWI_DB["database"],
         port=int(STAFF_GWI_DB.get("port", 3306)),
     )
-    conn = mysql.connector.connect(**kwargs)
-    if dict_cursor:
-        return conn, conn.cursor(dictionary=True)
-    return conn, conn.cursor()
+    return mysql.connector.connect(**kwargs)
+
+# ===================== DB connection pools =====================
+class DBPool:
+    """
+    Keep a few warm connections per database instead of doing a full
+    TCP + MySQL handshake on every scan (each scan touches 2-3 databases).
+
+    Bounded queue -> at most `size` connections exist. get() validates the
+    borrowed connection with ping(reconnect=True), so a link dropped between
+    scans is healed transparently. Connections are created lazily on first use.
+    """
+
+    def __init__(self, factory, size):
+        self._factory = factory
+        self._q = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._q.put(None)  # placeholder slots; connect on first borrow
+
+    def get(self):
+        conn = self._q.get()
+        if conn is not None:
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except Exception:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+        try:
+            return self._factory()
+        except Exception:
+            self._q.put(None)  # give the slot back so the pool never shrinks
+            raise
+
+    def put(self, conn, broken=False):
+        if broken and conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            conn = None
+        self._q.put(conn)
+
+    @contextmanager
+    def acquire(self):
+        conn = self.get()
+        try:
+            yield conn
+        except Exception:
+            # Conservatively discard: the failure may have left the
+            # connection mid-transaction or with unread results.
+            self.put(conn, broken=True)
+            raise
+        else:
+            self.put(conn)
+
+PROD_POOL = DBPool(connect_production, size=4)
+ALLOC_POOL = DBPool(connect_allocation_m3, size=2)
+STAFF_POOL = DBPool(connect_staff_gwidb, size=2)
 
 # ===================== Global vars =====================
 current_batch = None
@@ -342,19 +501,43 @@ template_code = None
 muf_info = None
 last_scan_time = 0
 last_barcode = None
-barcode_buffer = ""
 staff_id = None
 
+# Scan input buffer: preallocated bytearray instead of a growing str, so the
+# per-keystroke handler does one byte store instead of allocating a new
+# string per char (scanners burst 10-20 chars).
+_buf = bytearray(64)
+_buf_len = 0
+
+# Hoisted: checked on every scan
+_SCAN_INTERVAL = float(SCAN_INTERVAL)
+
 # Per-staff anti-double-scan (seconds) for STAFF barcodes only
 STAFF_MIN_INTERVAL_SEC = 60
 staff_last_scan_ts = {}
 
 csv_lock = threading.Lock()
 
+# ===================== Hot-path SQL (built once, reused per execute) =====================
+# pymysql/mysql.connector re-send the statement text each execute; keeping
+# one shared string per statement at least makes the text byte-identical
+# every time (server statement digest/caching) and avoids rebuilding the
+# literal on each call.
+INSERT_OUTPUT_SQL = (
+    "INSERT INTO output_log ("
+    "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
+    "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
+    ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+)
+
+SELECT_MUF_SQL = "SELECT * FROM main WHERE muf_no = %s"
+
+STAFF_LOOKUP_SQL = "SELECT * FROM staff_list WHERE UPPER(staffid) = %s"
+
 # ===================== MUF query =====================
 def fetch_muf_info(cursor, muf_code):
     debug(f"Querying table 'main' for muf_no = '{muf_code}'")
-    cursor.execute("SELECT * FROM main WHERE muf_no = %s", (muf_code,))
+    cursor.execute(SELECT_MUF_SQL, (muf_code,))
     return cursor.fetchone()
 
 # ===================== CSV write (keep, but add safety) =====================
@@ -364,26 +547,128 @@ CSV_HEADER = [
     "scanned_at", "scanned_by", "remarks", "is_uploaded"
 ]
 
+# Rows per executemany batch when draining a backlog (bounds packet size)
+UPLOAD_BATCH_SIZE = 500
+
+# CSV path is a pure function of MUF + calendar day, so resolve it once per
+# MUF/day instead of strftime + join on every row. The day stamp itself only
+# re-runs strftime after midnight.
+_today_str = None
+_today_expires = 0.0
+
+def _today_stamp():
+    global _today_str, _today_expires
+    if time.time() >= _today_expires:
+        now_dt = datetime.now()
+        _today_str = now_dt.strftime("%Y%m%d")
+        midnight = datetime(now_dt.year, now_dt.month, now_dt.day)
+        _today_expires = midnight.timestamp() + 86400
+    return _today_str
+
+_csv_path_cache = {}  # muf_no -> (day_stamp, path)
+
+def _csv_path_for_muf(muf_no):
+    today = _today_stamp()
+    cached = _csv_path_cache.get(muf_no)
+    if cached and cached[0] == today:
+        return cached[1]
+    path = os.path.join(CSV_FOLDER, f"{muf_no}_{today}.csv")
+    _csv_path_cache[muf_no] = (today, path)
+    return path
+
+# CSV writes happen off the scan thread: the scan handler only enqueues,
+# a daemon thread drains the queue in batches with one flush per batch, so
+# disk latency never sits between a scan and its LED/buzzer feedback.
+_csv_queue = queue.Queue()
+CSV_BATCH_MAX = 32
+
 def write_to_csv(data_11, muf_no, uploaded=0, remarks=""):
     if not LOGS_WRITABLE:
         debug("⚠️ logs not writable; CSV not saved.")
         return
-
+    # every other field is scanner/DB controlled; remarks is the only one
+    # that could smuggle a delimiter into the raw line writes below
+    remarks = str(remarks).replace(",", " ").replace("\n", " ").replace("\r", " ")
+    _csv_queue.put((data_11, _csv_path_for_muf(muf_no), int(uploaded), remarks))
+
+# path -> open append handle, kept open across batches; guarded by csv_lock.
+# Handles for previous days are pruned on rollover and everything is closed
+# at exit, so the cache never grows past one fd per active MUF.
+_csv_handles = {}
+
+def _csv_handle_for(filename):
+    f = _csv_handles.get(filename)
+    if f is not None and not f.closed:
+        return f
+    # day rollover: filenames carry the day stamp, so anything not ending
+    # with today's stamp is a finished file whose fd we no longer need
+    today = _today_stamp()
+    for old_path in [p for p in _csv_handles if not p.endswith(f"{today}.csv")]:
+        old_f = _csv_handles.pop(old_path)
+        try:
+            old_f.close()
+        except Exception:
+            pass
+    is_new = not os.path.exists(filename)
+    f = open(filename, "a", newline="")
+    _csv_handles[filename] = f
+    if is_new:
+        csv.writer(f).writerow(CSV_HEADER)
+    return f
+
+def _close_csv_handles():
     with csv_lock:
-        filename = os.path.join(CSV_FOLDER, f"{muf_no}_{datetime.now().strftime('%Y%m%d')}.csv")
-        is_new = not os.path.exists(filename)
+        for f in _csv_handles.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        _csv_handles.clear()
+
+atexit.register(_close_csv_handles)
+
+def _csv_writer_loop():
+    while True:
         try:
-            with open(filename, "a", newline="") as f:
-                writer = csv.writer(f)
-                if is_new:
-                    writer.writerow(CSV_HEADER)
-                writer.writerow(list(data_11) + [remarks, int(uploaded)])
-            debug(f"📂 Written to CSV: {filename} (uploaded={uploaded}, remarks={remarks})")
-        except Exception as e:
-            debug(f"⚠️ CSV write failed: {e}")
+            item = _csv_queue.get(timeout=0.2)
+        except queue.Empty:
+            continue
+
+        batch = [item]
+        while len(batch) < CSV_BATCH_MAX:
+            try:
+                batch.append(_csv_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        with csv_lock:
+            touched = set()
+            for data_11, filename, uploaded, remarks in batch:
+                try:
+                    f = _csv_handle_for(filename)
+                except Exception as e:
+                    debug(f"⚠️ CSV open failed: {e}")
+                    continue
+                try:
+                    # fields are digit/ASCII-safe and remarks is sanitized at
+                    # enqueue, so skip csv.writer's per-field quoting state
+                    # machine; header still goes through csv.writer above
+                    values = ",".join("" if v is None else str(v) for v in data_11)
+                    f.write(f"{values},{remarks},{uploaded}\n")
+                    touched.add(filename)
+                    debug(f"📂 Written to CSV: {filename} (uploaded={uploaded}, remarks={remarks})")
+                except Exception as e:
+                    debug(f"⚠️ CSV write failed: {e}")
+
+            # one flush per batch, not per row
+            for p in touched:
+                try:
+                    _csv_handles[p].flush()
+                except Exception:
+                    pass
 
 # ===================== Insert output_log (minimal change) =====================
-def process_and_store(barcode, muf_info_dict, remarks=""):
+def process_and_store(norm_code, muf_info_dict, remarks=""):
     pack_per_ctn = safe_int(muf_info_dict.get("pack_per_ctn"))
     ctn_count = 1
     actual_pack = pack_per_ctn * ctn_count if pack_per_ctn is not None else None
@@ -398,49 +683,97 @@ def process_and_store(barcode, muf_info_dict, remarks=""):
         safe_int(muf_info_dict.get("pack_per_hr")),
         actual_pack,
         ctn_count,
-        normalize_barcode(barcode),
+        norm_code,
         1,
         timestamp,
         staff_id if staff_id else DEVICE_ID,
     )
 
+    # Hand the row to the DB worker and return immediately: operator
+    # feedback no longer waits out a 50-500ms WAN round-trip per carton.
     try:
-        conn = connect_production(dict_cursor=False)
-        cursor = conn.cursor()
-        sql = (
-            "INSERT INTO output_log ("
-            "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
-            "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
-            ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        )
-        cursor.execute(sql, data_11 + (remarks,))
-        conn.commit()
-        conn.close()
-
-        debug("✅ DB insert successful")
-        write_to_csv(data_11, current_muf, uploaded=1, remarks=remarks)
+        _db_queue.put_nowait((data_11, remarks))
+    except queue.Full:
+        debug("⚠️ DB queue full; caching row to CSV")
+        write_to_csv(data_11, data_11[0], uploaded=0, remarks=remarks)
+
+# Scan-thread inserts go through this queue; the worker owns the DB
+# round-trip. Failed rows fall back to CSV with uploaded=0 exactly as the
+# synchronous path did, so the upload loop picks them up later.
+_db_queue = queue.Queue(maxsize=1000)
+
+# Batch bounds: small enough that a row is durably in the DB within ~200ms
+# of its scan, large enough to amortize the round-trip during bursts
+# (pymysql rewrites the executemany into one multi-VALUES INSERT).
+DB_BATCH_MAX = 64
+DB_BATCH_WINDOW_SEC = 0.2
+
+def _db_worker():
+    while True:
+        batch = [_db_queue.get()]
+        deadline = time.monotonic() + DB_BATCH_WINDOW_SEC
+        while len(batch) < DB_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_db_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
 
-    except Exception as e:
-        debug(f"⚠️ DB insert failed. Cached locally: {e}")
-        write_to_csv(data_11, current_muf, uploaded=0, remarks=remarks)
+        try:
+            with PROD_POOL.acquire() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    INSERT_OUTPUT_SQL,
+                    [data_11 + (remarks,) for data_11, remarks in batch],
+                )
+                conn.commit()
+                cursor.close()
+            debug(f"✅ DB insert successful ({len(batch)} row(s))")
+            for data_11, remarks in batch:
+                write_to_csv(data_11, data_11[0], uploaded=1, remarks=remarks)
+        except Exception as e:
+            debug(f"⚠️ DB insert failed. Cached locally: {e}")
+            for data_11, remarks in batch:
+                write_to_csv(data_11, data_11[0], uploaded=0, remarks=remarks)
 
 # ===================== Upload pending CSV (fix 0-byte/empty) =====================
-def upload_from_csv():
+# Byte offset per CSV below which every row is known uploaded, plus the
+# parsed header. Files only grow between cycles (the writer appends), so
+# the next pass can seek straight past the settled prefix instead of
+# re-reading it. Dropped whenever the file shrinks or gets rewritten.
+_upload_resume = {}  # path -> (offset, headers)
+
+def _upload_once():
     debug("⏫ Attempting to upload cached CSV data...")
 
     if not os.path.isdir(CSV_FOLDER):
         return
 
-    for file in os.listdir(CSV_FOLDER):
-        if not file.endswith(".csv"):
+    # scandir: DirEntry carries the size from the directory read, so no
+    # separate getsize() stat per file
+    for entry in os.scandir(CSV_FOLDER):
+        if not entry.name.endswith(".csv"):
             continue
 
-        path = os.path.join(CSV_FOLDER, file)
+        path = entry.path
 
         # Fix: remove 0-byte CSV
         try:
-            if os.path.getsize(path) == 0:
+            size = entry.stat().st_size
+            if size == 0:
                 debug(f"🧹 Removing 0-byte CSV: {path}")
+                _upload_resume.pop(path, None)
+                # drop any cached append handle too, or later rows would
+                # land on the unlinked inode and never reach a real file
+                with csv_lock:
+                    stale = _csv_handles.pop(path, None)
+                    if stale is not None:
+                        try:
+                            stale.close()
+                        except Exception:
+                            pass
                 try:
                     os.remove(path)
                 except Exception:
@@ -449,58 +782,85 @@ def upload_from_csv():
         except Exception:
             continue
 
+        # Stream the file instead of materializing every row: most lines are
+        # already flagged "1" and a one-byte check on the raw line skips them
+        # without ever touching csv.reader. Peak memory is O(pending), and
+        # the recorded byte offsets feed the in-place flag patch below.
+        headers = None
+        idx_uploaded = None
+        idx_remarks = None
+        can_patch = False
+        data_seen = False
+        pending = []
+        patch_offsets = []
+
+        resume = _upload_resume.get(path)
+        if resume and resume[0] > size:
+            # file shrank (rewritten outside the append path): full rescan
+            _upload_resume.pop(path, None)
+            resume = None
+
+        scan_end = None
         with csv_lock:
             try:
-                with open(path, "r", newline="") as f:
-                    reader = list(csv.reader(f))
+                with open(path, "rb") as f:
+                    if resume:
+                        headers = resume[1]
+                        f.seek(resume[0])
+                        data_seen = True  # settled rows exist below the offset
+                    else:
+                        header_line = f.readline()
+                        headers = next(
+                            csv.reader([header_line.decode("utf-8", "replace")]), None
+                        )
+                    if headers and "is_uploaded" in headers:
+                        idx_uploaded = headers.index("is_uploaded")
+                        idx_remarks = headers.index("remarks") if "remarks" in headers else None
+                        # in-place patching is only safe when the flag is
+                        # the last (single-byte) column on the line
+                        can_patch = idx_uploaded == len(headers) - 1
+
+                        off = f.tell()
+                        for line in f:
+                            data_seen = True
+                            stripped = line.rstrip(b"\r\n")
+                            if can_patch and not stripped.endswith(b"0"):
+                                off += len(line)
+                                continue
+                            row = next(
+                                csv.reader([line.decode("utf-8", "replace")]), None
+                            )
+                            if row and len(row) > idx_uploaded and row[idx_uploaded] == "0":
+                                pending.append(row)
+                                patch_offsets.append(off + len(stripped) - 1)
+                            off += len(line)
+                        scan_end = off
+                    else:
+                        headers = None
             except Exception:
                 continue
 
-        if len(reader) <= 1:
-            debug(f"ℹ️ Skip CSV (empty/header-only): {path}")
-            continue
-
-        headers = reader[0]
-        data_rows = reader[1:]
-
-        # ensure header has our required fields
-        if "is_uploaded" not in headers:
+        if headers is None:
             debug(f"⚠️ CSV header unexpected, skip: {path}")
             continue
 
-        idx_uploaded = headers.index("is_uploaded")
-        idx_remarks = headers.index("remarks") if "remarks" in headers else None
-
-        pending = []
-        pending_row_index = []
-
-        for i, row in enumerate(data_rows, start=1):
-            if len(row) <= idx_uploaded:
-                continue
-            if row[idx_uploaded] == "0":
-                pending.append(row)
-                pending_row_index.append(i)
+        if not data_seen:
+            debug(f"ℹ️ Skip CSV (empty/header-only): {path}")
+            continue
 
         if not pending:
+            if can_patch and scan_end is not None:
+                _upload_resume[path] = (scan_end, headers)
             continue
 
         try:
-            conn = connect_production(dict_cursor=False)
-            cursor = conn.cursor()
-
-            sql = (
-                "INSERT INTO output_log ("
-                "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
-                "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
-                ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-            )
-
+            rows_to_insert = []
             for row in pending:
                 # Map using our known header order CSV_HEADER
                 def get(col):
                     return row[headers.index(col)] if col in headers and headers.index(col) < len(row) else None
 
-                data_to_insert = (
+                rows_to_insert.append((
                     get("muf_no"),
                     get("line"),
                     get("fg_no"),
@@ -513,452 +873,454 @@ def upload_from_csv():
                     get("scanned_at"),
                     get("scanned_by"),
                     get("remarks") if idx_remarks is not None else "",
-                )
-                cursor.execute(sql, data_to_insert)
+                ))
 
-            conn.commit()
-            conn.close()
+            with PROD_POOL.acquire() as conn:
+                cursor = conn.cursor()
+                # Bulk insert: one round-trip per UPLOAD_BATCH_SIZE rows
+                # instead of one per row, which is what made big backlogs
+                # crawl over WAN.
+                for start in range(0, len(rows_to_insert), UPLOAD_BATCH_SIZE):
+                    cursor.executemany(INSERT_OUTPUT_SQL, rows_to_insert[start:start + UPLOAD_BATCH_SIZE])
+
+                conn.commit()
+                cursor.close()
 
-            # mark uploaded=1
+            # mark uploaded=1 — O(pending) flag bytes patched in place,
+            # not an O(file) rewrite per upload cycle
             with csv_lock:
-                for i in pending_row_index:
-                    if len(reader[i]) > idx_uploaded:
-                        reader[i][idx_uploaded] = "1"
-                with open(path, "w", newline="") as f:
-                    w = csv.writer(f)
-                    w.writerows(reader)
+                patched = False
+                if can_patch:
+                    try:
+                        with open(path, "r+b") as f:
+                            for flag_off in patch_offsets:
+                                f.seek(flag_off)
+                                f.write(b"1")
+                        patched = True
+                        if scan_end is not None:
+                            _upload_resume[path] = (scan_end, headers)
+                    except Exception as e:
+                        debug(f"⚠️ In-place flag patch failed, rewriting: {e}")
+                if not patched:
+                    _upload_resume.pop(path, None)
+                    # rare path (unexpected layout or patch failure): re-read
+                    # and rewrite the whole file, legacy style
+                    try:
+                        with open(path, "r", newline="") as f:
+                            rows = list(csv.reader(f))
+                        for r in rows[1:]:
+                            if len(r) > idx_uploaded and r[idx_uploaded] == "0":
+                                r[idx_uploaded] = "1"
+                        with open(path, "w", newline="") as f:
+                            csv.writer(f).writerows(rows)
+                    except Exception as e:
+                        debug(f"⚠️ CSV rewrite failed: {e}")
 
             debug(f"✅ Upload complete and marked: {path}")
 
         except Exception as e:
+            # The pool discards the broken connection; the next file (or
+            # the next pass) borrows a fresh one.
             debug(f"⚠️ Upload failed: {e}")
 
-    threading.Timer(UPLOAD_INTERVAL_SEC, upload_from_csv).start()
+def _upload_loop():
+    # One long-lived daemon thread instead of a threading.Timer chain that
+    # spawned (and tore down) a fresh thread every cycle — and a crash in
+    # one cycle no longer kills the reschedule chain.
+    while True:
+        try:
+            _upload_once()
+        except Exception as e:
+            debug(f"⚠️ Upload cycle error: {e}")
+        time.sleep(UPLOAD_INTERVAL_SEC)
 
 # ===================== Staff verification (UPDATED: use staff_gwidb.staff_list) =====================
-def is_valid_staff_id(staff_id_in: str) -> bool:
+# The roster changes on the scale of hours, so a short TTL cache turns the
+# per-scan lookup into a dict hit. DB errors are never cached.
+STAFF_CACHE_TTL_SEC = 300
+
+_staff_cache = {}  # sid -> (staff_row_or_None, expiry_ts)
+_staff_cache_lock = threading.Lock()
+
+def invalidate_staff_cache():
+    """Drop cached staff rows (e.g. after a roster update)."""
+    with _staff_cache_lock:
+        _staff_cache.clear()
+
+def validate_and_fetch_staff(staff_id_in):
     """
-    Validate OPERATOR staffid from staff_gwidb.staff_list.
+    One staff_gwidb round-trip replacing the old validate + fetch pair.
+    Returns the staff row when the id is valid, else None.
     Duplicate staffid rule (supervisor):
-      - If returned > 1 rows, ONLY accept if any row has factory='m3'
+      - If returned > 1 rows, ONLY accept (and use) a factory='m3' row
     """
     sid = (staff_id_in or "").strip().upper()
     if not sid:
-        return False
+        return None
+
+    now_ts = time.time()
+    with _staff_cache_lock:
+        hit = _staff_cache.get(sid)
+    if hit is not None and hit[1] > now_ts:
+        debug(f"staff cache hit: staffid={sid}, valid={hit[0] is not None}")
+        return hit[0]
 
-    conn = None
-    cur = None
     try:
         debug("Connecting to staff_gwidb for staff verification...")
-        conn, cur = connect_staff_gwidb(dict_cursor=True)
-
-        # More efficient than fetching all operators:
-        cur.execute(
-            "SELECT staffid, factory FROM staff_list WHERE UPPER(staffid) = %s",
-            (sid,)
-        )
-        rows = cur.fetchall() or []
+        with STAFF_POOL.acquire() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(STAFF_LOOKUP_SQL, (sid,))
+            rows = cur.fetchall() or []
+            cur.close()
         debug(f"staff_gwidb.staff_list lookup: staffid={sid}, rows={len(rows)}")
 
-        if len(rows) == 0:
-            return False
-
-        if len(rows) == 1:
-            return True
-
-        # duplicate -> must match factory='m3'
-        for r in rows:
-            fac = (r.get("factory") or "").strip().lower()
-            if fac == "m3":
-                debug("Duplicate staffid detected -> using factory='m3' match ✅")
-                return True
-
-        debug("Duplicate staffid detected but no factory='m3' row ❌")
-        return False
-
     except Exception as e:
+        # DB failure: fail closed but do NOT cache the result
         debug(f"Staff GWIDB connection/query error: {e}")
-        return False
-    finally:
-        try:
-            if cur:
-                cur.close()
-        except Exception:
-            pass
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
-
-def fetch_staff_row_from_gwidb(staffid_norm: str):
-    """
-    Fetch staff row from staff_gwidb.staff_list.
-    If multiple rows, prefer factory='m3'. Else take first.
-    """
-    conn = None
-    cur = None
-    sid = (staffid_norm or "").strip().upper()
-    try:
-        conn, cur = connect_staff_gwidb(dict_cursor=True)
-        cur.execute("SELECT * FROM staff_list WHERE UPPER(staffid) = %s", (sid,))
-        rows = cur.fetchall() or []
-        if not rows:
-            return None
-        if len(rows) == 1:
-            return rows[0]
-
-        # prefer factory='m3'
-        for r in rows:
-            if (r.get("factory") or "").strip().lower() == "m3":
-                return r
-        return rows[0]
-    except Exception as e:
-        debug(f"fetch_staff_row_from_gwidb error: {e}")
         return None
-    finally:
-        try:
-            if cur:
-                cur.close()
-        except Exception:
-            pass
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
+
+    if len(rows) == 0:
+        staff_row = None
+    elif len(rows) == 1:
+        staff_row = rows[0]
+    else:
+        # duplicate -> must match factory='m3'
+        staff_row = next(
+            (r for r in rows if (r.get("factory") or "").strip().lower() == "m3"),
+            None,
+        )
+        if staff_row is not None:
+            debug("Duplicate staffid detected -> using factory='m3' row ✅")
+        else:
+            debug("Duplicate staffid detected but no factory='m3' row ❌")
+
+    with _staff_cache_lock:
+        _staff_cache[sid] = (staff_row, now_ts + STAFF_CACHE_TTL_SEC)
+    return staff_row
 
 # ===================== Barcode listener (KEEP YOUR PERFECT FLOW ORDER) =====================
-def on_key(event):
-    global barcode_buffer, last_barcode, last_scan_time
+def handle_barcode(barcode):
+    global last_barcode, last_scan_time
     global current_batch, current_muf, template_code, muf_info, staff_id
-    global green_blink_running, green_blink_thread
-
-    if event.name == "enter":
-        barcode = barcode_buffer.strip()
-        normalized_barcode = normalize_barcode(barcode)
-        barcode_buffer = ""
 
-        now = datetime.now()
-        now_ts = time.time()
+    barcode = barcode.strip()
+    normalized_barcode = normalize_barcode(barcode)
 
-        if barcode == last_barcode and now_ts - last_scan_time < SCAN_INTERVAL:
-            debug(f"⏱️ Duplicate scan ignored: {barcode}")
-            return
+    now = datetime.now()
+    now_ts = time.time()
 
-        last_barcode = barcode
-        last_scan_time = now_ts
+    if barcode == last_barcode and now_ts - last_scan_time < _SCAN_INTERVAL:
+        debug(f"⏱️ Duplicate scan ignored: {barcode}")
+        return
 
-        debug(f"📥 Scanned barcode: '{barcode}' → normalized: '{normalized_barcode}'")
-        debug(f"STATE before: batch={current_batch}, muf={current_muf}, template={template_code}, staff={staff_id}")
+    last_barcode = barcode
+    last_scan_time = now_ts
 
-        # stop alerts first (exact old behavior)
-        stop_all_alerts()
+    debug(f"📥 Scanned barcode: '{barcode}' → normalized: '{normalized_barcode}'")
+    debug(f"STATE before: batch={current_batch}, muf={current_muf}, template={template_code}, staff={staff_id}")
 
-        # RESET
-        if is_reset_code(barcode):
-            debug("🔄 RESET scanned. Starting new batch")
-            current_batch = f"batch_{now.strftime('%Y%m%d_%H%M%S')}"
-            current_muf = None
-            template_code = None
-            muf_info = None
+    # stop alerts first (exact old behavior)
+    stop_all_alerts()
 
-            green_blink_running = False
-            if green_blink_thread and green_blink_thread.is_alive():
-                green_blink_thread.join(timeout=1)
-            set_light(GREEN_PIN, False)
+    # RESET (membership checked inline; the hot path already holds the
+    # normalized code)
+    if normalized_barcode in RESET_SET:
+        debug("🔄 RESET scanned. Starting new batch")
+        current_batch = f"batch_{now.strftime('%Y%m%d_%H%M%S')}"
+        current_muf = None
+        template_code = None
+        muf_info = None
 
-            green_blink_running = True
-            green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
-            green_blink_thread.start()
-            debug("✅ Green light blinking restarted (RESET)")
-            return
+        set_green_mode("blink")
+        debug("✅ Green light blinking restarted (RESET)")
+        return
 
-        # Staff (MULTI-USER, per-staff toggle; per-staff 60s anti-double-scan; does NOT affect production scanned_by)
-        if any(c.isalpha() for c in normalized_barcode):
-            debug("Detected alpha -> treat as staff barcode")
-
-            # Preserve production green state:
-            # - If template already set, green should stay SOLID ON after staff scan feedback blink.
-            green_should_be_solid = template_code is not None
-
-            # Per-staff anti-double-scan: same staff must wait >= 60s between scans
-            last_staff_ts = staff_last_scan_ts.get(normalized_barcode)
-            if last_staff_ts is not None and (now_ts - last_staff_ts) < STAFF_MIN_INTERVAL_SEC:
-                debug(f"⏱️ Staff scan ignored (<{STAFF_MIN_INTERVAL_SEC}s): {normalized_barcode}")
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
-
-            # 1) Validate staff barcode first (OPERATOR only) from staff_gwidb.staff_list
-            if not is_valid_staff_id(normalized_barcode):
-                debug(f"Invalid staff ID: {normalized_barcode}")
-                start_red_buzzer_alert()
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
+    # Staff (MULTI-USER, per-staff toggle; per-staff 60s anti-double-scan; does NOT affect production scanned_by)
+    if _ALPHA_RE.search(normalized_barcode):
+        debug("Detected alpha -> treat as staff barcode")
 
-            debug(f"✅ Staff validated (staff exists): {normalized_barcode}")
+        # Preserve production green state:
+        # - If template already set, green should stay SOLID ON after staff scan feedback blink.
+        green_should_be_solid = template_code is not None
 
-            # 2) Get staff details from staff_gwidb.staff_list (duplicate -> prefer factory='m3')
-            staff_row = fetch_staff_row_from_gwidb(normalized_barcode)
-            if not staff_row:
-                debug("❌ Staff ID not found in staff_gwidb.staff_list after validation")
-                start_red_buzzer_alert()
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
-
-            pic_url = resolve_image_url(staff_row.get("pic") or "")
-            debug(f"👷 Staff info: id={normalized_barcode}, name={staff_row.get('staffname')}, pos={staff_row.get('staffpos')}, dept={staff_row.get('staffdept')}, agency={staff_row.get('staffagency','')}, factory={staff_row.get('factory','')}")
+        # Per-staff anti-double-scan: same staff must wait >= 60s between scans
+        last_staff_ts = staff_last_scan_ts.get(normalized_barcode)
+        if last_staff_ts is not None and (now_ts - last_staff_ts) < STAFF_MIN_INTERVAL_SEC:
+            debug(f"⏱️ Staff scan ignored (<{STAFF_MIN_INTERVAL_SEC}s): {normalized_barcode}")
+            if green_should_be_solid:
+                set_light(GREEN_PIN, True)
+            return
 
-            # 3) Now do allocation_m3 operations (allocation_temp/prod_attendance/allcation_log) using STAFF_DB (unchanged)
-            connection = None
-            try:
-                connection = mysql.connector.connect(
-                    host=STAFF_DB["host"],
-                    user=STAFF_DB["user"],
-                    password=STAFF_DB["password"],
-                    database=STAFF_DB["database"],
-                    port=int(STAFF_DB.get("port", 3306)),
-                )
-                cursor = connection.cursor(dictionary=True)
+        # 1+2) Validate and fetch staff details in one staff_gwidb
+        # round-trip (duplicate -> prefer factory='m3')
+        staff_row = validate_and_fetch_staff(normalized_barcode)
+        if not staff_row:
+            debug(f"Invalid staff ID: {normalized_barcode}")
+            start_red_buzzer_alert()
+            if green_should_be_solid:
+                set_light(GREEN_PIN, True)
+            return
 
-                now_dt = datetime.now()
-                now_dt_sec = now_dt.replace(microsecond=0)
+        debug(f"✅ Staff validated (staff exists): {normalized_barcode}")
 
-                # Work date is ALWAYS today (no cross-midnight remapping)  <-- keep your current behavior
-                work_date_str = now_dt.strftime("%Y-%m-%d")
+        pic_url = resolve_image_url(staff_row.get("pic") or "")
+        debug(f"👷 Staff info: id={normalized_barcode}, name={staff_row.get('staffname')}, pos={staff_row.get('staffpos')}, dept={staff_row.get('staffdept')}, agency={staff_row.get('staffagency','')}, factory={staff_row.get('factory','')}")
 
-                # 3) allocation_temp (per-staff toggle; staffid is UNIQUE)
+        # 3) Now do allocation_m3 operations (allocation_temp/prod_attendance/allcation_log) using STAFF_DB (unchanged)
+        connection = None
+        conn_broken = False
+        try:
+            connection = ALLOC_POOL.get()
+            cursor = connection.cursor(dictionary=True)
+
+            now_dt = datetime.now()
+            now_dt_sec = now_dt.replace(microsecond=0)
+
+            # Work date is ALWAYS today (no cross-midnight remapping)  <-- keep your current behavior
+            work_date_str = now_dt.strftime("%Y-%m-%d")
+
+            # 3) allocation_temp (per-staff toggle; staffid is UNIQUE)
+            # Single upsert: the IF() flips IN/OUT server-side instead of
+            # SELECT + INSERT/UPDATE, and the session variable hands the
+            # resulting status back without re-reading the row.
+            cursor.execute("""
+                INSERT INTO allocation_temp (
+                    staffid, line, staffname, staffpos, staffdept,
+                    status, remark, created_date, pic, flg
+                ) VALUES (%s, %s, %s, %s, %s, @new_status := 'IN', '', %s, %s, NULL)
+                ON DUPLICATE KEY UPDATE
+                    line = VALUES(line),
+                    staffname = VALUES(staffname),
+                    staffpos = VALUES(staffpos),
+                    staffdept = VALUES(staffdept),
+                    status = (@new_status := IF(status = 'IN', 'OUT', 'IN')),
+                    remark = '',
+                    created_date = VALUES(created_date),
+                    pic = VALUES(pic)
+            """, (
+                normalized_barcode,
+                DEVICE_LINE,
+                staff_row.get("staffname"),
+                staff_row.get("staffpos"),
+                staff_row.get("staffdept"),
+                now_dt.date(),
+                pic_url
+            ))
+
+            # 4) prod_attendance (SHIFT source of truth)
+            # One upsert (unique key on staffid+date, see
+            # sql/add_staff_upsert_keys.sql): inserts the day's row with
+            # the computed shift, or stamps timeout and keeps any shift
+            # already locked in. @shift_final carries whichever value won
+            # so the readback below feeds allcation_log without another
+            # SELECT.
+            minutes = now_dt.hour * 60 + now_dt.minute
+            in_overlap = (6 * 60 + 30 <= minutes < 7 * 60) or (18 * 60 + 30 <= minutes < 19 * 60)
+            overlap_hint = None
+            if in_overlap:
                 cursor.execute(
-                    "SELECT status FROM allocation_temp WHERE staffid = %s LIMIT 1",
+                    "SELECT shift FROM prod_attendance "
+                    "WHERE staffid = %s AND shift IS NOT NULL AND TRIM(shift) <> '' "
+                    "ORDER BY date DESC, id DESC LIMIT 1",
                     (normalized_barcode,)
                 )
-                temp_row = cursor.fetchone()
-
-                prev_status = (temp_row.get("status") if temp_row else None)
-                prev_status_u = (prev_status or "").strip().upper()
-
-                toggle_to_in = True if not temp_row else (prev_status_u != "IN")
-                new_status = "IN" if toggle_to_in else "OUT"
-                debug(f"🧭 allocation_temp toggle: prev_status={prev_status_u or 'NULL'} -> new_status={new_status} (exists={bool(temp_row)})")
-
-                if not temp_row:
-                    cursor.execute("""
-                        INSERT INTO allocation_temp (
-                            staffid, line, staffname, staffpos, staffdept,
-                            status, remark, created_date, pic, flg
-                        ) VALUES (%s, %s, %s, %s, %s, %s, '', %s, %s, NULL)
-                    """, (
-                        normalized_barcode,
-                        DEVICE_LINE,
-                        staff_row.get("staffname"),
-                        staff_row.get("staffpos"),
-                        staff_row.get("staffdept"),
-                        new_status,
-                        now_dt.date(),
-                        pic_url
-                    ))
-                else:
-                    cursor.execute("""
-                        UPDATE allocation_temp
-                        SET line=%s, staffname=%s, staffpos=%s, staffdept=%s,
-                            status=%s, remark='', created_date=%s, pic=%s
-                        WHERE staffid=%s
-                    """, (
-                        DEVICE_LINE,
-                        staff_row.get("staffname"),
-                        staff_row.get("staffpos"),
-                        staff_row.get("staffdept"),
-                        new_status,
-                        now_dt.date(),
-                        pic_url,
-                        normalized_barcode
-                    ))
-
-                # 4) prod_attendance (SHIFT source of truth)
-                cursor.execute(
-                    "SELECT id, shift FROM prod_attendance WHERE staffid = %s AND date = %s",
-                    (normalized_barcode, work_date_str)
-                )
-                att_row = cursor.fetchone()
-                debug(f"📋 prod_attendance lookup: date={work_date_str}, found={bool(att_row)}, shift_in_db={(att_row.get('shift') if att_row else None)}")
-
-                shift_value = None
-                if att_row and (att_row.get("shift") or "").strip():
-                    shift_value = (att_row.get("shift") or "").strip().upper()
-                    debug(f"🕒 shift locked from prod_attendance: {shift_value}")
-                else:
-                    minutes = now_dt.hour * 60 + now_dt.minute
-                    in_overlap = (6 * 60 + 30 <= minutes < 7 * 60) or (18 * 60 + 30 <= minutes < 19 * 60)
-                    overlap_hint = None
-                    if in_overlap:
-                        cursor.execute(
-                            "SELECT shift FROM prod_attendance "
-                            "WHERE staffid = %s AND shift IS NOT NULL AND TRIM(shift) <> '' "
-                            "ORDER BY date DESC, id DESC LIMIT 1",
-                            (normalized_barcode,)
-                        )
-                        last_shift_row = cursor.fetchone()
-                        if last_shift_row and (last_shift_row.get("shift") or "").strip():
-                            overlap_hint = (last_shift_row.get("shift") or "").strip().upper()
-
-                    shift_value = compute_shift_value(now_dt, overlap_hint=overlap_hint)
-                    debug(f"🕒 shift computed: time={now_dt.strftime('%H:%M:%S')}, overlap_hint={overlap_hint}, shift_value={shift_value}")
-
-                if att_row:
-                    if not (att_row.get("shift") or "").strip():
-                        cursor.execute(
-                            "UPDATE prod_attendance SET timeout = %s, shift = %s WHERE id = %s",
-                            (now_dt, shift_value, att_row["id"])
-                        )
-                    else:
-                        debug(f"📝 prod_attendance update: id={att_row['id']} timeout={now_dt}")
-                        cursor.execute(
-                            "UPDATE prod_attendance SET timeout = %s WHERE id = %s",
-                            (now_dt, att_row["id"])
-                        )
-                else:
-                    debug(f"📝 prod_attendance insert: date={work_date_str} timein={now_dt} shift={shift_value}")
-                    cursor.execute("""
-                        INSERT INTO prod_attendance (
-                            staffid, name, staffpos, staffdept, timein, timeout, work_hr, pic, staffic,
-                            date, shift, flg, staffagency, day
-                        ) VALUES (%s, %s, %s, %s, %s, NULL, 0.00, %s, NULL, %s, %s, NULL, %s, %s)
-                    """, (
-                        normalized_barcode,
-                        staff_row.get("staffname"),
-                        staff_row.get("staffpos"),
-                        staff_row.get("staffdept"),
-                        now_dt,
-                        pic_url,
-                        work_date_str,
-                        shift_value,
-                        staff_row.get("staffagency", ""),
-                        calendar.day_name[now_dt.weekday()]
-                    ))
-
-                # 5) allcation_log (INSERT a new record on EVERY staff scan)
-                debug(f"🧾 allcation_log insert: status={new_status} datetime_log={now_dt} date_run={work_date_str} shift={shift_value}")
-                cursor.execute("""
-                    INSERT INTO allcation_log (
-                        line, employee_id, name, job_title, department, datetime_log, status, remark,
-                        file_path, date_run, in_datetime, out_datetime, time_taken, shift
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, '', %s, %s, %s, NULL, 0.00, %s)
-                """, (
-                    DEVICE_LINE,
-                    normalized_barcode,
-                    staff_row.get("staffname"),
-                    staff_row.get("staffpos"),
-                    staff_row.get("staffdept"),
-                    now_dt_sec,
-                    new_status,
-                    pic_url,
-                    work_date_str,
-                    now_dt_sec,
-                    shift_value
-                ))
+                last_shift_row = cursor.fetchone()
+                if last_shift_row and (last_shift_row.get("shift") or "").strip():
+                    overlap_hint = (last_shift_row.get("shift") or "").strip().upper()
+
+            shift_value = compute_shift_value(now_dt, overlap_hint=overlap_hint)
+            debug(f"🕒 shift computed: time={now_dt.strftime('%H:%M:%S')}, overlap_hint={overlap_hint}, shift_value={shift_value}")
+
+            cursor.execute("""
+                INSERT INTO prod_attendance (
+                    staffid, name, staffpos, staffdept, timein, timeout, work_hr, pic, staffic,
+                    date, shift, flg, staffagency, day
+                ) VALUES (%s, %s, %s, %s, %s, NULL, 0.00, %s, NULL, %s, (@shift_final := %s), NULL, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    timeout = VALUES(timein),
+                    shift = (@shift_final := IF(TRIM(COALESCE(shift, '')) = '', VALUES(shift), shift))
+            """, (
+                normalized_barcode,
+                staff_row.get("staffname"),
+                staff_row.get("staffpos"),
+                staff_row.get("staffdept"),
+                now_dt,
+                pic_url,
+                work_date_str,
+                shift_value,
+                staff_row.get("staffagency", ""),
+                calendar.day_name[now_dt.weekday()]
+            ))
+
+            # one readback for both server-side decisions
+            cursor.execute("SELECT @new_status AS new_status, @shift_final AS shift_value")
+            readback = cursor.fetchone() or {}
+            new_status = readback.get("new_status") or "IN"
+            if isinstance(new_status, bytes):  # session vars can come back as bytes
+                new_status = new_status.decode()
+            shift_value = readback.get("shift_value")
+            if isinstance(shift_value, bytes):
+                shift_value = shift_value.decode()
+            debug(f"🧭 allocation_temp toggle -> new_status={new_status}, shift locked={shift_value}")
+
+            # 5) allcation_log (INSERT a new record on EVERY staff scan)
+            debug(f"🧾 allcation_log insert: status={new_status} datetime_log={now_dt} date_run={work_date_str} shift={shift_value}")
+            cursor.execute("""
+                INSERT INTO allcation_log (
+                    line, employee_id, name, job_title, department, datetime_log, status, remark,
+                    file_path, date_run, in_datetime, out_datetime, time_taken, shift
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, '', %s, %s, %s, NULL, 0.00, %s)
+            """, (
+                DEVICE_LINE,
+                normalized_barcode,
+                staff_row.get("staffname"),
+                staff_row.get("staffpos"),
+                staff_row.get("staffdept"),
+                now_dt_sec,
+                new_status,
+                pic_url,
+                work_date_str,
+                now_dt_sec,
+                shift_value
+            ))
+
+            connection.commit()
+            cursor.close()
+
+            # Update per-staff last scan time after successful commit
+            staff_last_scan_ts[normalized_barcode] = now_ts
+
+            debug(f"✅ Staff toggled: {normalized_barcode} -> {new_status} (work_date={work_date_str}, shift={shift_value})")
+            queue_fx("blink_green", 1)
+            queue_fx("buzz", 1)
+
+            if green_should_be_solid:
+                # enqueued after the blink so it lands last and the
+                # light ends up solid, not off
+                queue_fx("green_solid", True)
+                debug("💡 Restored GREEN solid (template already set)")
 
-                connection.commit()
-
-                # Update per-staff last scan time after successful commit
-                staff_last_scan_ts[normalized_barcode] = now_ts
-
-                debug(f"✅ Staff toggled: {normalized_barcode} -> {new_status} (work_date={work_date_str}, shift={shift_value})")
-                blink_light(GREEN_PIN, times=1)
-                buzz(times=1)
-
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                    debug("💡 Restored GREEN solid (template already set)")
-
-                return
-
-            except Exception as e:
-                debug(f"🔥 Error during staff scan: {e}")
-                try:
-                    if connection:
-                        connection.rollback()
-                except Exception:
-                    pass
-                start_red_buzzer_alert()
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
-
-            finally:
-                try:
-                    if connection:
-                        connection.close()
-                except Exception:
-                    pass
+            return
 
-        # Must RESET first
-        if not current_batch:
-            debug("⚠️ Please scan RESET first.")
+        except Exception as e:
+            debug(f"🔥 Error during staff scan: {e}")
+            conn_broken = True
+            try:
+                if connection:
+                    connection.rollback()
+            except Exception:
+                pass
             start_red_buzzer_alert()
+            if green_should_be_solid:
+                set_light(GREEN_PIN, True)
             return
 
-        # MUF stage
-        if current_muf is None:
-            try:
-                clean = normalize_barcode(barcode)
-                conn = connect_production(dict_cursor=True)
-                cursor = conn.cursor()
-                muf_info = fetch_muf_info(cursor, clean)
-                conn.close()
+        finally:
+            if connection:
+                ALLOC_POOL.put(connection, broken=conn_broken)
 
-                if muf_info:
-                    current_muf = clean
-                    debug(f"✅ MUF found: {current_muf}")
-                    debug("Green continues blinking until template set.")
-                else:
-                    debug(f"❌ MUF not found: {clean}")
-                    start_red_buzzer_alert()
-                return
-
-            except Exception as e:
-                debug(f"⚠️ DB connection error: {e}")
-                start_red_buzzer_alert()
-                return
+    # Must RESET first
+    if not current_batch:
+        debug("⚠️ Please scan RESET first.")
+        start_red_buzzer_alert()
+        return
 
-        # Template stage
-        if template_code is None:
-            normalized = normalize_barcode(barcode)
-            if normalized == current_muf:
-                debug(f"⚠️ Duplicate MUF barcode scanned as template: {normalized}")
+    # MUF stage
+    if current_muf is None:
+        try:
+            with PROD_POOL.acquire() as conn:
+                cursor = conn.cursor(pymysql.cursors.DictCursor)
+                muf_info = fetch_muf_info(cursor, normalized_barcode)
+                cursor.close()
+
+            if muf_info:
+                current_muf = normalized_barcode
+                _csv_path_for_muf(current_muf)  # warm today's path cache
+                debug(f"✅ MUF found: {current_muf}")
+                debug("Green continues blinking until template set.")
+            else:
+                debug(f"❌ MUF not found: {normalized_barcode}")
                 start_red_buzzer_alert()
-                return
-
-            template_code = normalized
-            debug(f"🧾 Template barcode set: {template_code}")
-
-            green_blink_running = False
-            if green_blink_thread and green_blink_thread.is_alive():
-                green_blink_thread.join(timeout=1)
-
-            set_light(GREEN_PIN, True)  # solid ON
-            debug("✅ Green light solid ON (Template Set)")
+            return
 
-            process_and_store(barcode, muf_info, remarks="TEMPLATE")
+        except Exception as e:
+            debug(f"⚠️ DB connection error: {e}")
+            start_red_buzzer_alert()
             return
 
-        # MISMATCH stage (THIS MUST ALERT)
-        if normalize_barcode(barcode) != template_code:
-            debug(f"❌ Carton mismatch! scanned={normalize_barcode(barcode)} != template={template_code}")
+    # Template stage
+    if template_code is None:
+        if normalized_barcode == current_muf:
+            debug(f"⚠️ Duplicate MUF barcode scanned as template: {normalized_barcode}")
             start_red_buzzer_alert()
             return
 
-        # MATCH stage
-        debug(f"✅ Carton matches template: {template_code}")
-        process_and_store(template_code, muf_info, remarks="SCAN")
+        template_code = normalized_barcode
+        debug(f"🧾 Template barcode set: {template_code}")
+
+        set_green_mode("solid")
+        debug("✅ Green light solid ON (Template Set)")
+
+        process_and_store(normalized_barcode, muf_info, remarks="TEMPLATE")
         return
 
-    elif len(event.name) == 1:
-        barcode_buffer += event.name
-    elif event.name == "minus":
-        barcode_buffer += "-"
+    # MISMATCH stage (THIS MUST ALERT)
+    if normalized_barcode != template_code:
+        debug(f"❌ Carton mismatch! scanned={normalized_barcode} != template={template_code}")
+        start_red_buzzer_alert()
+        return
+
+    # MATCH stage
+    debug(f"✅ Carton matches template: {template_code}")
+    process_and_store(template_code, muf_info, remarks="SCAN")
+    return
+
+
+# ===================== Barcode input (evdev) =====================
+# The scanner is a USB HID keyboard; reading its event node directly
+# replaces the keyboard module's global hook (which woke Python for every
+# keystroke on every keyboard). Key-down scancodes map straight to bytes
+# in the preallocated buffer; handle_barcode fires once per Enter.
+_KEYCODE_TO_BYTE = {ecodes.KEY_MINUS: 0x2D}
+for _d in "0123456789":
+    _KEYCODE_TO_BYTE[getattr(ecodes, f"KEY_{_d}")] = ord(_d)
+for _c in "abcdefghijklmnopqrstuvwxyz":
+    _KEYCODE_TO_BYTE[getattr(ecodes, f"KEY_{_c.upper()}")] = ord(_c)
+
+def find_scanner_device():
+    by_id = "/dev/input/by-id"
+    try:
+        names = sorted(os.listdir(by_id))
+    except OSError:
+        # some images don't create by-id symlinks at all
+        names = []
+    for name in names:
+        if name.endswith("-kbd"):
+            return InputDevice(os.path.join(by_id, name))
+    raise RuntimeError(f"No *-kbd scanner device found in {by_id}")
+
+def input_loop():
+    global _buf_len
+    dev = find_scanner_device()
+    # Exclusive grab: scans stop doubling as console keystrokes, and no
+    # other reader competes for the event queue.
+    dev.grab()
+    debug(f"🧭 Reading barcodes from {dev.path} ({dev.name})")
+    for event in dev.read_loop():
+        if event.type != ecodes.EV_KEY or event.value != 1:
+            continue
+        if event.code == ecodes.KEY_ENTER:
+            barcode = _buf[:_buf_len].decode("ascii", "ignore")
+            _buf_len = 0
+            handle_barcode(barcode)
+        else:
+            b = _KEYCODE_TO_BYTE.get(event.code)
+            if b is not None:
+                if _buf_len >= len(_buf):
+                    _buf_len = 0  # overflow: not a real barcode, drop and restart
+                _buf[_buf_len] = b
+                _buf_len += 1
+
 
 # ===================== Main =====================
 if __name__ == "__main__":
@@ -966,12 +1328,25 @@ if __name__ == "__main__":
     debug(f"ERROR_ALERT_MODE={ERROR_ALERT_MODE}")
     debug(f"CHANNEL_ACTIVE_LOW={CHANNEL_ACTIVE_LOW}")
 
-    upload_from_csv()
+    threading.Thread(target=_csv_writer_loop, daemon=True).start()
+    debug("CSV writer thread started.")
+
+    threading.Thread(target=_fx_worker, daemon=True).start()
+    debug("Feedback FX thread started.")
+
+    threading.Thread(target=red_alert_worker, daemon=True).start()
+    threading.Thread(target=buzzer_alert_worker, daemon=True).start()
+    debug("Alert worker threads started.")
+
+    threading.Thread(target=_db_worker, daemon=True).start()
+    debug("DB worker thread started.")
+
+    threading.Thread(target=_upload_loop, daemon=True).start()
+    debug("Upload loop thread started.")
 
-    green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
-    green_blink_thread.start()
+    threading.Thread(target=_green_worker, daemon=True).start()
+    set_green_mode("blink")
     debug("Initial green light blinking started.")
 
-    debug("🧭 Listening for barcode scan via keyboard...")
-    keyboard.on_press(on_key)
-    keyboard.wait()
+    debug("🧭 Listening for barcode scans via evdev...")
+    input_loop()
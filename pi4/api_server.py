@@ -1,6 +1,21 @@
 # api_server.py
-from flask import Flask, jsonify
+import json
+import threading
+import time
+
+try:
+    import orjson  # Rust JSON encoder, several times faster than stdlib
+except ImportError:
+    orjson = None
+
+def _json_bytes(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+from flask import Flask, jsonify, Response
 import mysql.connector
+import mysql.connector.pooling
 from datetime import datetime as dt, timedelta
 
 from config import PRODUCTION_DB
@@ -8,158 +23,163 @@ from config import PRODUCTION_DB
 app = Flask(__name__)
 
 # -------------------- DB --------------------
+# One pool for the whole process: /summary runs six queries per request,
+# so opening a fresh TCP+auth connection per query was the dominant cost.
+# Size the pool to match Flask worker concurrency.
+DB_POOL_SIZE = 8
+
+_pool = mysql.connector.pooling.MySQLConnectionPool(
+    pool_name="prod",
+    pool_size=DB_POOL_SIZE,
+    host=PRODUCTION_DB["host"],
+    port=int(PRODUCTION_DB.get("port", 3306)),
+    user=PRODUCTION_DB["user"],
+    password=PRODUCTION_DB["password"],
+    database=PRODUCTION_DB["database"],
+    charset="utf8mb4",
+)
+
 def connect_production_db():
-    return mysql.connector.connect(
-        host=PRODUCTION_DB["host"],
-        port=int(PRODUCTION_DB.get("port", 3306)),
-        user=PRODUCTION_DB["user"],
-        password=PRODUCTION_DB["password"],
-        database=PRODUCTION_DB["database"],
-        charset="utf8mb4",
-    )
+    # close() on a pooled connection returns it to the pool instead of
+    # tearing down the socket, so all existing call sites stay unchanged.
+    return _pool.get_connection()
 
 # -------------------- Helpers --------------------
+# is_template is a stored generated column (see sql/add_output_log_is_template.sql),
+# so this filter rides the (muf_no, is_template, scanned_at) index instead of
+# scanning remarks with a non-sargable LIKE.
 EXCLUDE_TEMPLATE_SQL = """
-AND (remarks IS NULL OR LOWER(remarks) NOT LIKE '%template%')
+AND is_template = 0
 """
 
-def query_latest_muf(line: str):
-    conn = connect_production_db()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("""
-            SELECT muf_no
-            FROM output_log
-            WHERE muf_no IS NOT NULL
-              AND muf_no <> ''
-              AND line = %s
-            ORDER BY id DESC
-            LIMIT 1
-        """, (line,))
-        r = cur.fetchone()
-        return r["muf_no"] if r else None
-    finally:
-        cur.close()
-        conn.close()
-
-# -------------------- Summary Parts --------------------
-def get_total_carton_needed(muf_no: str):
-    conn = connect_production_db()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT qty_done FROM main WHERE muf_no = %s LIMIT 1", (muf_no,))
-        r = cur.fetchone()
-        return int(r[0]) if r and r[0] is not None else 0
-    finally:
-        cur.close()
-        conn.close()
+# -------------------- Summary (single round-trip) --------------------
+# One CTE query resolves the latest muf_no for the line and returns every
+# scalar the summary needs. The old per-part helpers each opened their own
+# connection and query (six round-trips per request); all derived numbers
+# are now computed in Python from this one row.
+SUMMARY_SQL = f"""
+WITH latest AS (
+    SELECT muf_no
+    FROM output_log
+    WHERE muf_no IS NOT NULL
+      AND muf_no <> ''
+      AND line = %s
+    ORDER BY id DESC
+    LIMIT 1
+),
+m AS (
+    SELECT qty_done
+    FROM main
+    WHERE muf_no = (SELECT muf_no FROM latest)
+    LIMIT 1
+),
+p AS (
+    SELECT pack_per_ctn, pack_per_hr
+    FROM output_log
+    WHERE muf_no = (SELECT muf_no FROM latest)
+    ORDER BY id DESC
+    LIMIT 1
+),
+h AS (
+    SELECT SUM(ctn_count) AS hour_done
+    FROM output_log
+    WHERE muf_no = (SELECT muf_no FROM latest)
+      AND line = %s
+      AND scanned_at >= %s
+      AND scanned_at < %s
+      {EXCLUDE_TEMPLATE_SQL}
+),
+t AS (
+    SELECT SUM(ctn_count) AS total_done
+    FROM output_log
+    WHERE muf_no = (SELECT muf_no FROM latest)
+      {EXCLUDE_TEMPLATE_SQL}
+)
+SELECT latest.muf_no,
+       COALESCE(m.qty_done, 0) AS qty_done,
+       p.pack_per_ctn, p.pack_per_hr,
+       COALESCE(h.hour_done, 0) AS hour_done,
+       COALESCE(t.total_done, 0) AS total_done
+FROM latest
+LEFT JOIN m ON 1=1
+LEFT JOIN p ON 1=1
+LEFT JOIN h ON 1=1
+LEFT JOIN t ON 1=1
+"""
 
-def get_target_hour(muf_no: str):
-    conn = connect_production_db()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("""
-            SELECT pack_per_ctn, pack_per_hr
-            FROM output_log
-            WHERE muf_no = %s
-            ORDER BY id DESC
-            LIMIT 1
-        """, (muf_no,))
-        r = cur.fetchone()
-        if r and r["pack_per_ctn"] and r["pack_per_hr"]:
-            return int(round(float(r["pack_per_hr"]) / float(r["pack_per_ctn"]), 0))
-        return 0
-    finally:
-        cur.close()
-        conn.close()
+SUMMARY_COLUMNS = ("muf_no", "qty_done", "pack_per_ctn", "pack_per_hr",
+                   "hour_done", "total_done")
 
-def get_average_hourly_output(muf_no: str, line: str):
+def fetch_summary(line: str):
     conn = connect_production_db()
-    cur = conn.cursor()
+    # prepared=True keeps the statement parsed server-side, so repeated
+    # executes on the same pooled connection only send parameter values.
+    # (Prepared cursors can't be dictionary cursors; zip the row instead.)
+    cur = conn.cursor(prepared=True)
     try:
         now = dt.now()
         hour_start = now.replace(minute=0, second=0, microsecond=0)
         hour_end = hour_start + timedelta(hours=1)
-
-        cur.execute(f"""
-            SELECT SUM(ctn_count)
-            FROM output_log
-            WHERE muf_no = %s
-              AND line = %s
-              AND scanned_at >= %s
-              AND scanned_at < %s
-              {EXCLUDE_TEMPLATE_SQL}
-        """, (muf_no, line, hour_start, hour_end))
-
-        r = cur.fetchone()
-        return int(r[0]) if r and r[0] else 0
+        cur.execute(SUMMARY_SQL, (line, line, hour_start, hour_end))
+        row = cur.fetchone()
+        return dict(zip(SUMMARY_COLUMNS, row)) if row else None
     finally:
         cur.close()
         conn.close()
 
-def get_balance_carton(muf_no: str):
-    conn = connect_production_db()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT qty_done FROM main WHERE muf_no = %s LIMIT 1", (muf_no,))
-        r = cur.fetchone()
-        total_needed = int(r[0]) if r and r[0] is not None else 0
-
-        cur.execute(f"""
-            SELECT SUM(ctn_count)
-            FROM output_log
-            WHERE muf_no = %s
-            {EXCLUDE_TEMPLATE_SQL}
-        """, (muf_no,))
-        done = cur.fetchone()
-        total_done = int(done[0]) if done and done[0] else 0
-
-        return total_needed - total_done
-    finally:
-        cur.close()
-        conn.close()
+# -------------------- Response cache --------------------
+# Dashboards/Pico clients poll /summary every few seconds but the counters
+# only move at scanner speed, so a short TTL absorbs the polling burst.
+# JSON is encoded once on a miss; hits return the cached bytes directly.
+SUMMARY_CACHE_TTL = 3  # seconds
 
-def get_balance_hours(muf_no: str):
-    conn = connect_production_db()
-    cur = conn.cursor(dictionary=True)
-    try:
-        cur.execute("""
-            SELECT pack_per_ctn, pack_per_hr
-            FROM output_log
-            WHERE muf_no = %s
-            ORDER BY id DESC
-            LIMIT 1
-        """, (muf_no,))
-        r = cur.fetchone()
-        if not r:
-            return 0.0
-
-        pack_per_ctn = float(r["pack_per_ctn"] or 0)
-        pack_per_hr = float(r["pack_per_hr"] or 0)
-        if pack_per_ctn <= 0 or pack_per_hr <= 0:
-            return 0.0
-
-        balance_cartons = get_balance_carton(muf_no)
-        return round((balance_cartons * pack_per_ctn) / pack_per_hr, 1)
-    finally:
-        cur.close()
-        conn.close()
+_summary_cache = {}  # line -> (expires_at, status_code, payload_bytes)
+_summary_cache_lock = threading.Lock()
 
 # -------------------- API --------------------
 @app.route("/summary/<line>", methods=["GET"])
 def summary(line):
-    muf_no = query_latest_muf(line)
-    if not muf_no:
-        return jsonify({"error": "No WIP muf_no found"}), 404
-
-    return jsonify({
-        "muf_no": muf_no,
-        "total_carton_needed": get_total_carton_needed(muf_no),
-        "target_hour": get_target_hour(muf_no),
-        "avg_hourly_output": get_average_hourly_output(muf_no, line),
-        "balance_carton": get_balance_carton(muf_no),
-        "balance_hours": get_balance_hours(muf_no),
-    })
+    now = time.monotonic()
+    with _summary_cache_lock:
+        cached = _summary_cache.get(line)
+    if cached and cached[0] > now:
+        return Response(cached[2], status=cached[1], mimetype="application/json")
+
+    status, payload = _build_summary(line)
+    body = _json_bytes(payload)
+    with _summary_cache_lock:
+        _summary_cache[line] = (now + SUMMARY_CACHE_TTL, status, body)
+    return Response(body, status=status, mimetype="application/json")
+
+def _build_summary(line):
+    row = fetch_summary(line)
+    if not row or not row["muf_no"]:
+        return 404, {"error": "No WIP muf_no found"}
+
+    # COALESCE in SUMMARY_SQL guarantees these are never NULL.
+    total_needed = int(row["qty_done"])
+    total_done = int(row["total_done"])
+    hour_done = int(row["hour_done"])
+    pack_per_ctn = float(row["pack_per_ctn"] or 0)
+    pack_per_hr = float(row["pack_per_hr"] or 0)
+
+    target_hour = 0
+    if pack_per_ctn > 0 and pack_per_hr > 0:
+        target_hour = int(round(pack_per_hr / pack_per_ctn, 0))
+
+    balance_carton = total_needed - total_done
+    balance_hours = 0.0
+    if pack_per_ctn > 0 and pack_per_hr > 0:
+        balance_hours = round((balance_carton * pack_per_ctn) / pack_per_hr, 1)
+
+    return 200, {
+        "muf_no": row["muf_no"],
+        "total_carton_needed": total_needed,
+        "target_hour": target_hour,
+        "avg_hourly_output": hour_done,
+        "balance_carton": balance_carton,
+        "balance_hours": balance_hours,
+    }
 
 @app.route("/health", methods=["GET"])
 def health():
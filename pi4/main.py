@@ -1,16 +1,26 @@
 #!/usr/bin/env python3
 import os
+import re
 import csv
+import mmap
 import time
+import heapq
+import queue
+import struct
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
-import subprocess
-import keyboard
+import atexit
+import socket
+from evdev import InputDevice, ecodes
 import RPi.GPIO as GPIO
 import pymysql
 import mysql.connector
+import mysql.connector.pooling
 import calendar
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
 
 from config import (
     PRODUCTION_DB, STAFF_DB, STAFF_GWI_DB,
@@ -41,9 +51,15 @@ CHANNEL_ACTIVE_LOW = {
 # CHANNEL_ACTIVE_LOW["BUZZER"] = False
 # CHANNEL_ACTIVE_LOW["RED"] = False
 
-def debug(msg):
-    if DEBUG_MODE:
+if DEBUG_MODE:
+    def debug(msg):
         print(f"[DEBUG] {msg}")
+else:
+    # production: a bound no-op keeps every call site untouched while the
+    # interpreter skips straight through. The f-strings at the call sites
+    # are still evaluated, so keep new hot-path messages cheap.
+    def debug(msg):
+        pass
 
 # ===================== GPIO Setup =====================
 GPIO.setmode(GPIO.BCM)
@@ -59,22 +75,51 @@ GPIO.setup(GREEN_PIN, GPIO.OUT)
 GPIO.setup(YELLOW_PIN, GPIO.OUT)
 GPIO.setup(BUZZER_PIN, GPIO.OUT)
 
-def _pin_write(pin: int, on: bool, active_low: bool):
-    if active_low:
-        GPIO.output(pin, GPIO.LOW if on else GPIO.HIGH)
+# Pin writes go straight to the BCM283x set/clear registers via
+# /dev/gpiomem: one 32-bit store per edge instead of RPi.GPIO's per-call
+# lock + C wrapper, which adds jitter in the tight blink loops. RPi.GPIO
+# still does the mode/direction setup above; if the mapping isn't
+# available we fall back to GPIO.output.
+_GPSET0 = 0x1C
+_GPCLR0 = 0x28
+_gpio_mem = None
+try:
+    with open("/dev/gpiomem", "r+b") as _f:
+        _gpio_mem = mmap.mmap(_f.fileno(), 4096)
+except Exception as _e:
+    print(f"[DEBUG] gpiomem mmap unavailable, using RPi.GPIO writes: {_e}")
+
+# Polarity and the register path never change after boot, so each channel
+# gets a specialized writer closure: the mask bytes are pre-packed and the
+# set/clear offsets pre-swapped for active-low wiring, leaving a single
+# on/off branch per edge.
+def _make_pin_writer(pin, active_low):
+    if _gpio_mem is not None:
+        mask = struct.pack("<I", 1 << pin)
+        on_offset, off_offset = (_GPCLR0, _GPSET0) if active_low else (_GPSET0, _GPCLR0)
+
+        def write(on):
+            offset = on_offset if on else off_offset
+            _gpio_mem[offset:offset + 4] = mask
     else:
-        GPIO.output(pin, GPIO.HIGH if on else GPIO.LOW)
+        on_level, off_level = (GPIO.LOW, GPIO.HIGH) if active_low else (GPIO.HIGH, GPIO.LOW)
+
+        def write(on):
+            GPIO.output(pin, on_level if on else off_level)
+    return write
+
+_PIN_WRITERS = {
+    RED_PIN: _make_pin_writer(RED_PIN, CHANNEL_ACTIVE_LOW["RED"]),
+    GREEN_PIN: _make_pin_writer(GREEN_PIN, CHANNEL_ACTIVE_LOW["GREEN"]),
+    YELLOW_PIN: _make_pin_writer(YELLOW_PIN, CHANNEL_ACTIVE_LOW["YELLOW"]),
+    BUZZER_PIN: _make_pin_writer(BUZZER_PIN, CHANNEL_ACTIVE_LOW["BUZZER"]),
+}
 
 def set_light(pin, state=True):
     # state=True means ON logically
-    if pin == RED_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["RED"])
-    elif pin == GREEN_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["GREEN"])
-    elif pin == YELLOW_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["YELLOW"])
-    elif pin == BUZZER_PIN:
-        _pin_write(pin, state, CHANNEL_ACTIVE_LOW["BUZZER"])
+    writer = _PIN_WRITERS.get(pin)
+    if writer is not None:
+        writer(state)
     else:
         GPIO.output(pin, GPIO.LOW if state else GPIO.HIGH)
 
@@ -114,124 +159,190 @@ def ensure_logs_writable() -> bool:
 LOGS_WRITABLE = ensure_logs_writable()
 
 # ===================== State Control (exactly like your old) =====================
-green_blink_running = True
-green_blink_thread = None
-
-red_alert_active = False
-red_alert_thread = None
-buzzer_alert_active = False
-buzzer_alert_thread = None
-
-def blink_light(pin, duration=0.3, times=3):
-    for _ in range(times):
-        set_light(pin, True)
-        time.sleep(duration)
-        set_light(pin, False)
-        time.sleep(duration)
+# One scheduler thread drives every blink/beep pattern instead of a
+# dedicated sleep-loop thread per channel. Each channel holds a pattern
+# generator yielding (state, seconds) edges; timed edges sit in a heap and
+# a single Event wakes the thread when the nearest edge is due or a
+# pattern is swapped. Same blink timings as the old per-channel threads.
+class LightScheduler:
+    def __init__(self, pins):
+        self._pins = pins                      # channel name -> GPIO pin
+        self._heap = []                        # (deadline, seq, channel, gen)
+        self._patterns = {}                    # channel -> active generator
+        self._gen = {ch: 0 for ch in pins}     # bumped on set(); stales old edges
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def set(self, channel, pattern):
+        """Steady state (True/False) or a (state, seconds) generator."""
+        with self._lock:
+            self._gen[channel] += 1
+            if isinstance(pattern, bool):
+                self._patterns.pop(channel, None)
+                set_light(self._pins[channel], pattern)
+            else:
+                self._patterns[channel] = pattern
+                self._seq += 1
+                heapq.heappush(self._heap,
+                               (time.monotonic(), self._seq, channel, self._gen[channel]))
+        self._wake.set()
+
+    def _run(self):
+        # Best effort: pin this thread to the last core and ask for
+        # SCHED_FIFO so blink/beep edges aren't delayed by GIL handoffs
+        # during DB or CSV work. Needs CAP_SYS_NICE; without it (or on
+        # non-Linux) the thread just stays SCHED_OTHER.
+        try:
+            os.sched_setaffinity(0, {os.cpu_count() - 1})
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(10))
+        except (AttributeError, OSError):
+            pass
 
-def buzz(times=1, duration=0.15):
-    for _ in range(times):
-        set_light(BUZZER_PIN, True)
-        time.sleep(duration)
-        set_light(BUZZER_PIN, False)
-        time.sleep(0.1)
-
-def continuous_green_blink():
-    global green_blink_running
-    # Fast blink 5 times
+        while True:
+            with self._lock:
+                now_m = time.monotonic()
+                while self._heap and self._heap[0][0] <= now_m:
+                    deadline, _seq, channel, gen = heapq.heappop(self._heap)
+                    if gen != self._gen[channel]:
+                        continue  # pattern was replaced after this edge was queued
+                    pattern = self._patterns.get(channel)
+                    if pattern is None:
+                        continue
+                    try:
+                        state, seconds = next(pattern)
+                    except StopIteration:
+                        self._patterns.pop(channel, None)
+                        continue
+                    set_light(self._pins[channel], state)
+                    if seconds > 0:
+                        self._seq += 1
+                        heapq.heappush(self._heap,
+                                       (deadline + seconds, self._seq, channel, gen))
+                timeout = None
+                if self._heap:
+                    timeout = max(0.0, self._heap[0][0] - time.monotonic())
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+def blink_pattern(on_s, off_s):
+    while True:
+        yield True, on_s
+        yield False, off_s
+
+def green_ready_pattern():
+    # Fast blink 5 times (boot/reset), then slow blink until replaced
     for _ in range(5):
-        set_light(GREEN_PIN, True)
-        time.sleep(0.2)
-        set_light(GREEN_PIN, False)
-        time.sleep(0.1)
-    # Slow blink until stopped
-    while green_blink_running:
-        set_light(GREEN_PIN, True)
-        time.sleep(0.5)
-        set_light(GREEN_PIN, False)
-        time.sleep(0.5)
-    set_light(GREEN_PIN, False)
-
-def continuous_red_alert():
-    global red_alert_active
-    while red_alert_active:
-        if ERROR_ALERT_MODE == "solid":
-            set_light(RED_PIN, True)
-            time.sleep(0.1)
-        else:
-            set_light(RED_PIN, True); time.sleep(0.5)
-            set_light(RED_PIN, False); time.sleep(0.5)
-    set_light(RED_PIN, False)
-
-def continuous_buzzer_alert():
-    global buzzer_alert_active
-    while buzzer_alert_active:
-        if ERROR_ALERT_MODE == "solid":
-            set_light(BUZZER_PIN, True)
-            time.sleep(0.1)
-        else:
-            set_light(BUZZER_PIN, True); time.sleep(0.15)
-            set_light(BUZZER_PIN, False); time.sleep(0.5)
-    set_light(BUZZER_PIN, False)
+        yield True, 0.2
+        yield False, 0.1
+    while True:
+        yield True, 0.5
+        yield False, 0.5
+
+def pulse_pattern(times=1, on_s=0.3, off_s=0.3, end=False):
+    # Finite feedback blink; end=True leaves the channel solid ON afterwards
+    for _ in range(times):
+        yield True, on_s
+        yield False, off_s
+    if end:
+        yield True, 0.0
+
+LIGHTS = LightScheduler({
+    "RED": RED_PIN,
+    "GREEN": GREEN_PIN,
+    "YELLOW": YELLOW_PIN,
+    "BUZZER": BUZZER_PIN,
+})
 
 def stop_all_alerts():
-    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
     debug("Stopping all active alerts...")
-    red_alert_active = False
-    buzzer_alert_active = False
-
-    if red_alert_thread and red_alert_thread.is_alive():
-        red_alert_thread.join(timeout=0.6)
-    set_light(RED_PIN, False)
-
-    if buzzer_alert_thread and buzzer_alert_thread.is_alive():
-        buzzer_alert_thread.join(timeout=0.6)
-    set_light(BUZZER_PIN, False)
+    LIGHTS.set("RED", False)
+    LIGHTS.set("BUZZER", False)
     debug("All alerts stopped.")
 
 def start_red_buzzer_alert():
-    global red_alert_active, buzzer_alert_active, red_alert_thread, buzzer_alert_thread
-
     debug(f"🚨 START ALERT (mode={ERROR_ALERT_MODE})")
-    red_alert_active = True
-    buzzer_alert_active = True
-
-    # IMPORTANT: always restart threads if they died
-    if not (red_alert_thread and red_alert_thread.is_alive()):
-        red_alert_thread = threading.Thread(target=continuous_red_alert, daemon=True)
-        red_alert_thread.start()
-
-    if not (buzzer_alert_thread and buzzer_alert_thread.is_alive()):
-        buzzer_alert_thread = threading.Thread(target=continuous_buzzer_alert, daemon=True)
-        buzzer_alert_thread.start()
+    if ERROR_ALERT_MODE == "solid":
+        LIGHTS.set("RED", True)
+        LIGHTS.set("BUZZER", True)
+    else:
+        LIGHTS.set("RED", blink_pattern(0.5, 0.5))
+        LIGHTS.set("BUZZER", blink_pattern(0.15, 0.5))
+
+# ===================== Periodic tasks =====================
+# Re-arming threading.Timer spawns (and tears down) a fresh OS thread per
+# tick. One long-lived thread with a heap of (next_due, period, fn) entries
+# runs every recurring job instead; next_due advances from the previous
+# deadline so periods don't drift with job runtime.
+class PeriodicRunner:
+    def __init__(self):
+        self._heap = []  # (next_due, seq, period, fn)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def add(self, period, fn):
+        """Run fn now, then every `period` seconds."""
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic(), self._seq, period, fn))
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            due = []
+            with self._lock:
+                now_m = time.monotonic()
+                while self._heap and self._heap[0][0] <= now_m:
+                    next_due, seq, period, fn = heapq.heappop(self._heap)
+                    due.append(fn)
+                    heapq.heappush(self._heap, (next_due + period, seq, period, fn))
+            for fn in due:
+                try:
+                    fn()
+                except Exception as e:
+                    debug(f"⚠️ Periodic task {getattr(fn, '__name__', fn)} failed: {e}")
+            with self._lock:
+                timeout = None
+                if self._heap:
+                    timeout = max(0.0, self._heap[0][0] - time.monotonic())
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+PERIODIC = PeriodicRunner()
 
 # ===================== Internet Yellow (same as your old) =====================
-yellow_checker_timer = None
 
-def check_internet():
+# TCP connect to a public resolver replaces fork+exec of /bin/ping; the
+# result is memoized for a few seconds so other callers get it for free.
+_NET_CHECK_TTL_SEC = 3
+_net_ok = False
+_net_checked_at = -_NET_CHECK_TTL_SEC
+
+def check_internet(host="8.8.8.8", port=53, timeout=0.5):
+    global _net_ok, _net_checked_at
+    now_ts = time.monotonic()
+    if now_ts - _net_checked_at < _NET_CHECK_TTL_SEC:
+        return _net_ok
     try:
-        return subprocess.call(
-            ["ping", "-c", "1", "-W", "1", "8.8.8.8"],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        ) == 0
-    except Exception:
-        return False
+        socket.create_connection((host, port), timeout=timeout).close()
+        _net_ok = True
+    except OSError:
+        _net_ok = False
+    _net_checked_at = now_ts
+    return _net_ok
 
 def update_yellow_light():
-    global yellow_checker_timer
-    if yellow_checker_timer and yellow_checker_timer.is_alive():
-        yellow_checker_timer.cancel()
-
     if check_internet():
-        set_light(YELLOW_PIN, True)
+        LIGHTS.set("YELLOW", True)
     else:
-        blink_light(YELLOW_PIN, duration=0.5, times=1)
-
-    yellow_checker_timer = threading.Timer(10, update_yellow_light)
-    yellow_checker_timer.daemon = True
-    yellow_checker_timer.start()
+        LIGHTS.set("YELLOW", pulse_pattern(times=1, on_s=0.5, off_s=0.5))
 
-update_yellow_light()
+PERIODIC.add(10, update_yellow_light)
 
 # ===================== Helpers =====================
 def safe_int(value):
@@ -240,23 +351,33 @@ def safe_int(value):
     except Exception:
         return None
 
+# Single-pass translate table instead of four chained .replace() calls,
+# each of which allocated an intermediate string.
+_NORMALIZE_TBL = str.maketrans({"–": "-", "−": "-", "—": "-", "_": "-"})
+
 def normalize_barcode(code):
-    return (
-        code.strip()
-            .replace("–", "-")
-            .replace("−", "-")
-            .replace("—", "-")
-            .replace("_", "-")
-            .upper()
-    )
+    return code.strip().translate(_NORMALIZE_TBL).upper()
+
+# RESET_CODES never changes at runtime; normalize it once instead of
+# rebuilding the set on every scan.
+_RESET_SET = frozenset(normalize_barcode(r) for r in RESET_CODES)
+
+# Input is already upper-cased by normalize_barcode, so one C-level
+# regex search replaces the per-character isalpha() generator.
+_HAS_ALPHA = re.compile(r"[A-Z]").search
 
-def is_reset_code(barcode):
-    return normalize_barcode(barcode) in {normalize_barcode(r) for r in RESET_CODES}
+def is_reset_code(normalized_code):
+    # expects the already-normalized form; handle_barcode normalizes once
+    return normalized_code in _RESET_SET
 
 def resolve_image_url(path):
     path = (path or "").strip().lstrip("../")
     return f"http://192.168.20.17/{path}"
 
+# calendar.day_name formats the locale name on every index; snapshot the
+# seven strings once since the attendance upsert needs one per staff scan.
+_DAY_NAMES = list(calendar.day_name)
+
 def compute_shift_value(now_dt: datetime, overlap_hint=None, overlap_window=None) -> str:
     """
     Compute shift by scan time using supervisor rule:
@@ -293,57 +414,128 @@ def compute_shift_value(now_dt: datetime, overlap_hint=None, overlap_window=None
     return "NIGHT"       # 18:30-19:00
 
 
+# Built once: the connect kwargs never change at runtime, so there is no
+# point rebuilding the dict and re-casting the ints on every reconnect.
+_PROD_KWARGS = dict(
+    host=PRODUCTION_DB["host"],
+    user=PRODUCTION_DB["user"],
+    password=PRODUCTION_DB["password"],
+    database=PRODUCTION_DB["database"],
+    port=int(PRODUCTION_DB.get("port", 3306)),
+    connect_timeout=int(DB_CONNECT_TIMEOUT),
+    read_timeout=int(DB_READ_TIMEOUT),
+    write_timeout=int(DB_WRITE_TIMEOUT),
+    autocommit=True,
+)
+
 def connect_production(dict_cursor=False):
-    kwargs = dict(
-        host=PRODUCTION_DB["host"],
-        user=PRODUCTION_DB["user"],
-        password=PRODUCTION_DB["password"],
-        database=PRODUCTION_DB["database"],
-        port=int(PRODUCTION_DB.get("port", 3306)),
-        connect_timeout=int(DB_CONNECT_TIMEOUT),
-        read_timeout=int(DB_READ_TIMEOUT),
-        write_timeout=int(DB_WRITE_TIMEOUT),
-        autocommit=True,
-    )
     if dict_cursor:
-        kwargs["cursorclass"] = pymysql.cursors.DictCursor
-    return pymysql.connect(**kwargs)
-
-def connect_allocation_m3(dict_cursor=False):
-    kwargs = dict(
-        host=STAFF_DB["host"],
-        user=STAFF_DB["user"],
-        password=STAFF_DB["password"],
-        database=STAFF_DB["database"],
-        port=int(STAFF_DB.get("port", 3306)),
-        autocommit=False,
-    )
-    if dict_cursor:
-        kwargs["dictionary"] = True
-    return mysql.connector.connect(**kwargs)
+        return pymysql.connect(cursorclass=pymysql.cursors.DictCursor,
+                               **_PROD_KWARGS)
+    return pymysql.connect(**_PROD_KWARGS)
+
+# Staff-side DBs go through mysql.connector's pool (same pattern as
+# api_server.py): close() on a pooled connection returns it to the pool
+# instead of tearing down the socket, so every existing close() call site
+# keeps working unchanged.
+ALLOC_POOL = mysql.connector.pooling.MySQLConnectionPool(
+    pool_name="alloc_m3",
+    pool_size=4,
+    host=STAFF_DB["host"],
+    user=STAFF_DB["user"],
+    password=STAFF_DB["password"],
+    database=STAFF_DB["database"],
+    port=int(STAFF_DB.get("port", 3306)),
+    autocommit=False,
+)
+
+STAFF_POOL = mysql.connector.pooling.MySQLConnectionPool(
+    pool_name="staff_gwidb",
+    pool_size=2,
+    host=STAFF_GWI_DB["host"],
+    user=STAFF_GWI_DB["user"],
+    password=STAFF_GWI_DB["password"],
+    database=STAFF_GWI_DB["database"],
+    port=int(STAFF_GWI_DB.get("port", 3306)),
+)
+
+def connect_allocation_m3():
+    return ALLOC_POOL.get_connection()
 
 def connect_staff_gwidb(dict_cursor=False):
-    kwargs = dict(
-        host=STAFF_GWI_DB["host"],
-        user=STAFF_GWI_DB["user"],
-        password=STAFF_GWI_DB["password"],
-        database=STAFF_GWI_DB["database"],
-        port=int(STAFF_GWI_DB.get("port", 3306)),
-    )
-    conn = mysql.connector.connect(**kwargs)
+    conn = STAFF_POOL.get_connection()
     if dict_cursor:
         return conn, conn.cursor(dictionary=True)
     return conn, conn.cursor()
 
-# ===================== Global vars =====================
-current_batch = None
-current_muf = None
-template_code = None
-muf_info = None
-last_scan_time = 0
-last_barcode = None
-barcode_buffer = ""
-staff_id = None
+# pymysql has no bundled pool, so the production side gets a small
+# hand-rolled one: a bounded queue of warm connections, validated with
+# ping(reconnect=True) on borrow. Two slots are enough for the two
+# consumers — the scan thread's insert never queues behind the upload
+# drain's multi-chunk executemany over WAN. Slots start empty and connect
+# lazily; broken connections are discarded, never re-queued.
+PROD_POOL_SIZE = 2
+
+_prod_pool = queue.Queue(maxsize=PROD_POOL_SIZE)
+for _ in range(PROD_POOL_SIZE):
+    _prod_pool.put(None)
+
+def _prod_pool_get():
+    conn = _prod_pool.get()
+    if conn is not None:
+        try:
+            conn.ping(reconnect=True)
+            return conn
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+    try:
+        return connect_production()
+    except Exception:
+        _prod_pool.put(None)  # give the slot back so the pool never shrinks
+        raise
+
+def _prod_pool_put(conn, broken=False):
+    if broken and conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        conn = None
+    _prod_pool.put(conn)
+
+@contextmanager
+def production_conn():
+    conn = _prod_pool_get()
+    try:
+        yield conn
+    except Exception:
+        # failure may leave the connection mid-transaction or with unread
+        # results; discard it and let the slot reconnect on next borrow
+        _prod_pool_put(conn, broken=True)
+        raise
+    else:
+        _prod_pool_put(conn)
+
+# ===================== Scan state =====================
+# One slotted dataclass instead of eight module globals: attribute access
+# beats module __dict__ lookups on the per-scan path and keeps all
+# cross-thread scan state in one visible place.
+@dataclass(slots=True)
+class ScanContext:
+    batch: str | None = None
+    muf: str | None = None
+    template: str | None = None
+    muf_info: dict | None = None
+    muf_prefix: tuple | None = None  # invariant output_log fields per MUF
+    staff_id: str | None = None
+    buffer: str = ""
+    last_hash: int | None = None  # hash of the raw buffer, for pre-normalize debounce
+    last_ts: float = 0.0
+
+ctx = ScanContext()
 
 # Per-staff anti-double-scan (seconds) for STAFF barcodes only
 STAFF_MIN_INTERVAL_SEC = 60
@@ -352,10 +544,96 @@ staff_last_scan_ts = {}
 csv_lock = threading.Lock()
 
 # ===================== MUF query =====================
+# Lines often RESET and re-scan the same MUF; remember rows for a few
+# minutes so those re-scans skip the WAN SELECT. LRU-bounded so a long
+# shift over many MUFs can't grow the dict unbounded.
+MUF_CACHE_TTL_SEC = 300
+MUF_CACHE_MAX = 128
+_muf_cache = OrderedDict()  # muf_code -> (expiry, row)
+
 def fetch_muf_info(cursor, muf_code):
+    hit = _muf_cache.get(muf_code)
+    if hit is not None and hit[0] > time.time():
+        _muf_cache.move_to_end(muf_code)
+        debug(f"📦 MUF cache hit: {muf_code}")
+        return hit[1]
+
     debug(f"Querying table 'main' for muf_no = '{muf_code}'")
     cursor.execute("SELECT * FROM main WHERE muf_no = %s", (muf_code,))
-    return cursor.fetchone()
+    row = cursor.fetchone()
+    if row:
+        _muf_cache[muf_code] = (time.time() + MUF_CACHE_TTL_SEC, row)
+        _muf_cache.move_to_end(muf_code)
+        while len(_muf_cache) > MUF_CACHE_MAX:
+            _muf_cache.popitem(last=False)
+    return row
+
+# ===================== SQL statements =====================
+# Every hot statement is defined once here and reused by all call sites.
+# Identical SQL text on every execute keeps MySQL's statement digest cache
+# warm on the pooled connections (mysql.connector's server-side prepared
+# handles don't survive the pool's session reset at check-in, and pymysql
+# has no server-side prepare, so shared constants are what actually helps).
+OUTPUT_INSERT_SQL = (
+    "INSERT INTO output_log ("
+    "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
+    "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
+    ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+)
+
+# Single-round-trip upserts replace the SELECT-then-INSERT/UPDATE pairs in
+# the staff flow (see sql/add_staff_upsert_keys.sql for the unique keys).
+# Session variables capture the server-side decisions — toggled status and
+# effective shift — so one readback SELECT feeds the allcation_log insert.
+ALLOC_TEMP_UPSERT_SQL = """
+    INSERT INTO allocation_temp (
+        staffid, line, staffname, staffpos, staffdept,
+        status, remark, created_date, pic, flg
+    ) VALUES (%s, %s, %s, %s, %s, @new_status := 'IN', '', %s, %s, NULL)
+    ON DUPLICATE KEY UPDATE
+        line = VALUES(line),
+        staffname = VALUES(staffname),
+        staffpos = VALUES(staffpos),
+        staffdept = VALUES(staffdept),
+        status = (@new_status := IF(UPPER(TRIM(status)) = 'IN', 'OUT', 'IN')),
+        remark = '',
+        created_date = VALUES(created_date),
+        pic = VALUES(pic)
+"""
+
+ATTENDANCE_LAST_SHIFT_SQL = (
+    "SELECT shift FROM prod_attendance "
+    "WHERE staffid = %s AND shift IS NOT NULL AND TRIM(shift) <> '' "
+    "ORDER BY date DESC, id DESC LIMIT 1"
+)
+
+ATTENDANCE_UPSERT_SQL = """
+    INSERT INTO prod_attendance (
+        staffid, name, staffpos, staffdept, timein, timeout, work_hr, pic, staffic,
+        date, shift, flg, staffagency, day
+    ) VALUES (%s, %s, %s, %s, %s, NULL, 0.00, %s, NULL, %s, (@shift_final := %s), NULL, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        timeout = VALUES(timein),
+        shift = (@shift_final := IF(TRIM(COALESCE(shift, '')) = '', VALUES(shift), shift))
+"""
+
+STAFF_READBACK_SQL = "SELECT @new_status AS new_status, @shift_final AS shift_value"
+
+# staff_scan_lookup is a narrow, indexable view over staff_gwidb.staff_list
+# (see sql/add_staff_list_lookup.sql): staffid_u is a stored generated
+# column with an index, so validation is a point read instead of an
+# UPPER() table scan that returned every column.
+STAFF_LOOKUP_SQL = (
+    "SELECT staffid, staffname, staffpos, staffdept, staffagency, factory, pic "
+    "FROM staff_scan_lookup WHERE staffid_u = %s"
+)
+
+ALLOC_LOG_INSERT_SQL = """
+    INSERT INTO allcation_log (
+        line, employee_id, name, job_title, department, datetime_log, status, remark,
+        file_path, date_run, in_datetime, out_datetime, time_taken, shift
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, '', %s, %s, %s, NULL, 0.00, %s)
+"""
 
 # ===================== CSV write (keep, but add safety) =====================
 CSV_HEADER = [
@@ -364,82 +642,206 @@ CSV_HEADER = [
     "scanned_at", "scanned_by", "remarks", "is_uploaded"
 ]
 
+# Rows per executemany batch when draining cached CSVs (stays well under
+# max_allowed_packet even after an overnight offline backlog)
+UPLOAD_BATCH_SIZE = 500
+
+# The target filename only changes when the MUF or the calendar day
+# changes, so the day stamp is cached until midnight and the joined path
+# per (muf, day) — no strftime or path join per scan.
+_day_stamp = None
+_day_stamp_expiry = 0.0
+_csv_path_cache = {}  # (muf_no, day_stamp) -> path
+
+def _today_stamp():
+    global _day_stamp, _day_stamp_expiry
+    now_ts = time.time()
+    if now_ts >= _day_stamp_expiry:
+        now_dt = datetime.now()
+        _day_stamp = now_dt.strftime("%Y%m%d")
+        midnight = now_dt.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        _day_stamp_expiry = now_ts + (midnight - now_dt).total_seconds()
+    return _day_stamp
+
+def _csv_path_for_muf(muf_no):
+    key = (muf_no, _today_stamp())
+    path = _csv_path_cache.get(key)
+    if path is None:
+        path = os.path.join(CSV_FOLDER, f"{muf_no}_{key[1]}.csv")
+        _csv_path_cache.clear()  # at most one MUF active; drop stale days
+        _csv_path_cache[key] = path
+    return path
+
+# Persistent append handles: opening/stat-ing/closing the file for every
+# scan is the slow part of a cache write on the Pi's SD card. Each day's
+# file stays open (O_APPEND, flushed per row); the date embedded in the
+# filename rolls the cache key at midnight and stale handles get closed.
+_csv_writers = {}  # path -> (file handle, csv.writer); guarded by csv_lock
+
+def _csv_writer_for(path):
+    ent = _csv_writers.get(path)
+    if ent is not None:
+        return ent
+
+    today = _today_stamp()
+    for old_path in [p for p in _csv_writers if not p.endswith(f"{today}.csv")]:
+        old_f, _w = _csv_writers.pop(old_path)
+        try:
+            old_f.close()
+        except Exception:
+            pass
+
+    is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+    f = open(path, "a", newline="")
+    writer = csv.writer(f)
+    if is_new:
+        writer.writerow(CSV_HEADER)
+        f.flush()
+    _csv_writers[path] = (f, writer)
+    return f, writer
+
+def _close_csv_writers():
+    with csv_lock:
+        for f, _w in _csv_writers.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        _csv_writers.clear()
+
+atexit.register(_close_csv_writers)
+
+def _needs_csv_quoting(s):
+    return "," in s or '"' in s or "\n" in s or "\r" in s
+
+# Scan feedback shouldn't wait on the SD card: write_to_csv only enqueues
+# (the path is resolved on the scan thread, where ctx lives) and a daemon
+# writer drains the queue in batches, flushing once per touched file per
+# batch instead of once per row.
+_csv_queue = queue.Queue()
+CSV_BATCH_MAX = 32
+
 def write_to_csv(data_11, muf_no, uploaded=0, remarks=""):
     if not LOGS_WRITABLE:
         debug("⚠️ logs not writable; CSV not saved.")
         return
+    _csv_queue.put((data_11, _csv_path_for_muf(muf_no), int(uploaded), remarks))
 
-    with csv_lock:
-        filename = os.path.join(CSV_FOLDER, f"{muf_no}_{datetime.now().strftime('%Y%m%d')}.csv")
-        is_new = not os.path.exists(filename)
-        try:
-            with open(filename, "a", newline="") as f:
-                writer = csv.writer(f)
-                if is_new:
-                    writer.writerow(CSV_HEADER)
-                writer.writerow(list(data_11) + [remarks, int(uploaded)])
-            debug(f"📂 Written to CSV: {filename} (uploaded={uploaded}, remarks={remarks})")
-        except Exception as e:
-            debug(f"⚠️ CSV write failed: {e}")
+def _csv_writer_loop():
+    while True:
+        batch = [_csv_queue.get()]
+        while len(batch) < CSV_BATCH_MAX:
+            try:
+                batch.append(_csv_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        with csv_lock:
+            touched = {}
+            for data_11, filename, uploaded, remarks in batch:
+                try:
+                    f, writer = _csv_writer_for(filename)
+                    fields = [
+                        "" if v is None else str(v)
+                        for v in (*data_11, remarks, uploaded)
+                    ]
+                    # The 13 columns are ints, ISO timestamps and
+                    # alphanumeric codes; a plain join skips csv.writer's
+                    # per-field quoting loop. Anything that does carry a
+                    # separator (a pasted remark, say) falls back to the
+                    # real writer.
+                    if any(_needs_csv_quoting(v) for v in fields):
+                        writer.writerow(fields)
+                    else:
+                        f.write(",".join(fields) + "\n")
+                    touched[filename] = f
+                    if DEBUG_MODE:  # skip f-string build per row in production
+                        debug(f"📂 Written to CSV: {filename} (uploaded={uploaded}, remarks={remarks})")
+                except Exception as e:
+                    debug(f"⚠️ CSV write failed: {e}")
+
+            for f in touched.values():
+                try:
+                    f.flush()
+                except Exception:
+                    pass
 
 # ===================== Insert output_log (minimal change) =====================
-def process_and_store(barcode, muf_info_dict, remarks=""):
+# The first 7 values of every output_log row are invariant for a given MUF,
+# so they're computed once when the MUF is scanned (ctx.muf_prefix) instead
+# of re-deriving them (dict gets + int casts) per carton.
+def _build_muf_prefix(muf_no, muf_info_dict):
     pack_per_ctn = safe_int(muf_info_dict.get("pack_per_ctn"))
     ctn_count = 1
     actual_pack = pack_per_ctn * ctn_count if pack_per_ctn is not None else None
-
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    data_11 = (
-        current_muf,
+    return (
+        muf_no,
         DEVICE_LINE,
         muf_info_dict.get("fg_no"),
         pack_per_ctn,
         safe_int(muf_info_dict.get("pack_per_hr")),
         actual_pack,
         ctn_count,
-        normalize_barcode(barcode),
+    )
+
+def process_and_store(norm_code, muf_info_dict, remarks="", now=None):
+    # norm_code is already normalized by handle_barcode, which also passes
+    # its clock snapshot so a scan reads the clock once
+    prefix = ctx.muf_prefix or _build_muf_prefix(ctx.muf, muf_info_dict)
+
+    # second-resolution datetime object; both MySQL and the CSV writer
+    # accept it directly, so no strftime on the hot path
+    scanned_at = (now or datetime.now()).replace(microsecond=0)
+
+    data_11 = prefix + (
+        norm_code,
         1,
-        timestamp,
-        staff_id if staff_id else DEVICE_ID,
+        scanned_at,
+        ctx.staff_id if ctx.staff_id else DEVICE_ID,
     )
 
     try:
-        conn = connect_production(dict_cursor=False)
-        cursor = conn.cursor()
-        sql = (
-            "INSERT INTO output_log ("
-            "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
-            "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
-            ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        )
-        cursor.execute(sql, data_11 + (remarks,))
-        conn.commit()
-        conn.close()
+        with production_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(OUTPUT_INSERT_SQL, data_11 + (remarks,))
+            conn.commit()
+            cursor.close()
 
         debug("✅ DB insert successful")
-        write_to_csv(data_11, current_muf, uploaded=1, remarks=remarks)
+        write_to_csv(data_11, ctx.muf, uploaded=1, remarks=remarks)
 
     except Exception as e:
         debug(f"⚠️ DB insert failed. Cached locally: {e}")
-        write_to_csv(data_11, current_muf, uploaded=0, remarks=remarks)
+        write_to_csv(data_11, ctx.muf, uploaded=0, remarks=remarks)
 
 # ===================== Upload pending CSV (fix 0-byte/empty) =====================
+# End of a pending row: is_uploaded is the last column, so a literal ",0"
+# right before the line terminator means not-yet-uploaded. Rows written by
+# csv.writer end \r\n, rows from the join fast path end \n; match both.
+_PENDING_FLAG_RE = re.compile(rb",0\r?\n")
+
 def upload_from_csv():
     debug("⏫ Attempting to upload cached CSV data...")
 
     if not os.path.isdir(CSV_FOLDER):
         return
 
-    for file in os.listdir(CSV_FOLDER):
-        if not file.endswith(".csv"):
+    # scandir: one directory pass with the size carried on each DirEntry,
+    # instead of listdir plus a separate stat per file
+    try:
+        entries = list(os.scandir(CSV_FOLDER))
+    except OSError:
+        return
+
+    for entry in entries:
+        if not entry.name.endswith(".csv"):
             continue
 
-        path = os.path.join(CSV_FOLDER, file)
+        path = entry.path
 
         # Fix: remove 0-byte CSV
         try:
-            if os.path.getsize(path) == 0:
+            if entry.stat().st_size == 0:
                 debug(f"🧹 Removing 0-byte CSV: {path}")
                 try:
                     os.remove(path)
@@ -449,136 +851,150 @@ def upload_from_csv():
         except Exception:
             continue
 
+        # Scan the file via mmap instead of list(csv.reader(f)): the flag
+        # is the last column, so ",0\n" can only occur at the end of a
+        # pending row and one C-level regex pass finds them all. Only the
+        # pending lines are decoded/parsed; memory stays O(pending) and
+        # the byte offset of each flag is kept so it can be flipped in
+        # place afterwards.
+        pending_vals = []
+        patch_offsets = []
+        can_patch = True
+
         with csv_lock:
             try:
-                with open(path, "r", newline="") as f:
-                    reader = list(csv.reader(f))
+                with open(path, "rb") as f:
+                    header_line = f.readline()
+                    headers = next(csv.reader([header_line.decode("utf-8", "replace")]))
+                    if "is_uploaded" not in headers:
+                        debug(f"⚠️ CSV header unexpected, skip: {path}")
+                        continue
+
+                    idx_uploaded = headers.index("is_uploaded")
+                    col_idx = {name: i for i, name in enumerate(headers)}
+                    flag_is_last = idx_uploaded == len(headers) - 1
+
+                    def get(row, col):
+                        i = col_idx.get(col)
+                        return row[i] if i is not None and i < len(row) else None
+
+                    def take(stripped, flag_off):
+                        row = next(csv.reader([stripped.decode("utf-8", "replace")]))
+                        if len(row) > idx_uploaded and row[idx_uploaded] == "0":
+                            pending_vals.append((
+                                get(row, "muf_no"),
+                                get(row, "line"),
+                                get(row, "fg_no"),
+                                get(row, "pack_per_ctn"),
+                                get(row, "pack_per_hr"),
+                                get(row, "actual_pack"),
+                                get(row, "ctn_count"),
+                                get(row, "scanned_code"),
+                                get(row, "scanned_count"),
+                                get(row, "scanned_at"),
+                                get(row, "scanned_by"),
+                                get(row, "remarks") or "",
+                            ))
+                            patch_offsets.append(flag_off)
+
+                    data_start = f.tell()
+                    if flag_is_last:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            for m in _PENDING_FLAG_RE.finditer(mm, data_start):
+                                pos = m.start()  # the comma before the flag
+                                nl = mm.rfind(b"\n", data_start, pos)
+                                start = nl + 1 if nl != -1 else data_start
+                                take(mm[start:pos + 2], pos + 1)
+                            # last line may lack a trailing newline
+                            end = len(mm)
+                            if end - data_start >= 2 and mm[end - 2:end] == b",0":
+                                nl = mm.rfind(b"\n", data_start, end - 2)
+                                start = nl + 1 if nl != -1 else data_start
+                                take(mm[start:end], end - 1)
+                    else:
+                        # unexpected layout: parse every row, rewrite whole file
+                        can_patch = False
+                        for raw in f:
+                            stripped = raw.rstrip(b"\r\n")
+                            if stripped:
+                                take(stripped, None)
+                        patch_offsets = []
             except Exception:
                 continue
 
-        if len(reader) <= 1:
-            debug(f"ℹ️ Skip CSV (empty/header-only): {path}")
-            continue
-
-        headers = reader[0]
-        data_rows = reader[1:]
-
-        # ensure header has our required fields
-        if "is_uploaded" not in headers:
-            debug(f"⚠️ CSV header unexpected, skip: {path}")
-            continue
-
-        idx_uploaded = headers.index("is_uploaded")
-        idx_remarks = headers.index("remarks") if "remarks" in headers else None
-
-        pending = []
-        pending_row_index = []
-
-        for i, row in enumerate(data_rows, start=1):
-            if len(row) <= idx_uploaded:
-                continue
-            if row[idx_uploaded] == "0":
-                pending.append(row)
-                pending_row_index.append(i)
-
-        if not pending:
+        if not pending_vals:
             continue
 
         try:
-            conn = connect_production(dict_cursor=False)
-            cursor = conn.cursor()
-
-            sql = (
-                "INSERT INTO output_log ("
-                "muf_no, line, fg_no, pack_per_ctn, pack_per_hr, actual_pack, "
-                "ctn_count, scanned_code, scanned_count, scanned_at, scanned_by, remarks"
-                ") VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-            )
-
-            for row in pending:
-                # Map using our known header order CSV_HEADER
-                def get(col):
-                    return row[headers.index(col)] if col in headers and headers.index(col) < len(row) else None
-
-                data_to_insert = (
-                    get("muf_no"),
-                    get("line"),
-                    get("fg_no"),
-                    get("pack_per_ctn"),
-                    get("pack_per_hr"),
-                    get("actual_pack"),
-                    get("ctn_count"),
-                    get("scanned_code"),
-                    get("scanned_count"),
-                    get("scanned_at"),
-                    get("scanned_by"),
-                    get("remarks") if idx_remarks is not None else "",
-                )
-                cursor.execute(sql, data_to_insert)
-
-            conn.commit()
-            conn.close()
-
-            # mark uploaded=1
+            with production_conn() as conn:
+                cursor = conn.cursor()
+                # multi-VALUES INSERTs in chunks (bounds the packet size
+                # for big backlogs). BEGIN suspends the connection's
+                # per-statement autocommit so the whole file commits
+                # atomically: a WAN drop mid-drain rolls everything back
+                # instead of leaving committed chunks whose flags are
+                # still "0" — those would be re-inserted next cycle.
+                conn.begin()
+                for i in range(0, len(pending_vals), UPLOAD_BATCH_SIZE):
+                    cursor.executemany(OUTPUT_INSERT_SQL, pending_vals[i:i + UPLOAD_BATCH_SIZE])
+                conn.commit()
+                cursor.close()
+
+            # mark uploaded=1: flip just the flag bytes in place; rows
+            # appended meanwhile keep their 0 and go out on the next pass
             with csv_lock:
-                for i in pending_row_index:
-                    if len(reader[i]) > idx_uploaded:
-                        reader[i][idx_uploaded] = "1"
-                with open(path, "w", newline="") as f:
-                    w = csv.writer(f)
-                    w.writerows(reader)
+                if can_patch:
+                    with open(path, "r+b") as f:
+                        for off in patch_offsets:
+                            f.seek(off)
+                            f.write(b"1")
+                else:
+                    # fallback full rewrite for unexpected layouts
+                    with open(path, "r", newline="") as f:
+                        rows = list(csv.reader(f))
+                    for row in rows[1:]:
+                        if len(row) > idx_uploaded and row[idx_uploaded] == "0":
+                            row[idx_uploaded] = "1"
+                    with open(path, "w", newline="") as f:
+                        csv.writer(f).writerows(rows)
 
             debug(f"✅ Upload complete and marked: {path}")
 
         except Exception as e:
             debug(f"⚠️ Upload failed: {e}")
 
-    threading.Timer(UPLOAD_INTERVAL_SEC, upload_from_csv).start()
-
 # ===================== Staff verification (UPDATED: use staff_gwidb.staff_list) =====================
-def is_valid_staff_id(staff_id_in: str) -> bool:
+# One lookup per staffid feeds both validation and the detail fetch, and the
+# result is cached for a minute — so a staff scan costs at most one
+# staff_gwidb round-trip instead of two, and repeats cost none. DB errors
+# are never cached.
+STAFF_CACHE_TTL_SEC = 60
+
+_staff_cache = {}  # sid -> ((is_valid, staff_row), expiry_ts)
+_staff_cache_lock = threading.Lock()
+
+def _lookup_staff(sid):
     """
-    Validate OPERATOR staffid from staff_gwidb.staff_list.
+    Returns (is_valid, staff_row) for an upper-cased staffid.
     Duplicate staffid rule (supervisor):
       - If returned > 1 rows, ONLY accept if any row has factory='m3'
+        (and use that row); the row fetch falls back to the first row.
+    Raises on DB errors so callers can fail soft without caching.
     """
-    sid = (staff_id_in or "").strip().upper()
-    if not sid:
-        return False
+    now_ts = time.time()
+    with _staff_cache_lock:
+        hit = _staff_cache.get(sid)
+    if hit is not None and hit[1] > now_ts:
+        debug(f"staff cache hit: staffid={sid}, valid={hit[0][0]}")
+        return hit[0]
 
     conn = None
     cur = None
     try:
         debug("Connecting to staff_gwidb for staff verification...")
         conn, cur = connect_staff_gwidb(dict_cursor=True)
-
-        # More efficient than fetching all operators:
-        cur.execute(
-            "SELECT staffid, factory FROM staff_list WHERE UPPER(staffid) = %s",
-            (sid,)
-        )
+        cur.execute(STAFF_LOOKUP_SQL, (sid,))
         rows = cur.fetchall() or []
-        debug(f"staff_gwidb.staff_list lookup: staffid={sid}, rows={len(rows)}")
-
-        if len(rows) == 0:
-            return False
-
-        if len(rows) == 1:
-            return True
-
-        # duplicate -> must match factory='m3'
-        for r in rows:
-            fac = (r.get("factory") or "").strip().lower()
-            if fac == "m3":
-                debug("Duplicate staffid detected -> using factory='m3' match ✅")
-                return True
-
-        debug("Duplicate staffid detected but no factory='m3' row ❌")
-        return False
-
-    except Exception as e:
-        debug(f"Staff GWIDB connection/query error: {e}")
-        return False
     finally:
         try:
             if cur:
@@ -591,374 +1007,349 @@ def is_valid_staff_id(staff_id_in: str) -> bool:
         except Exception:
             pass
 
-def fetch_staff_row_from_gwidb(staffid_norm: str):
-    """
-    Fetch staff row from staff_gwidb.staff_list.
-    If multiple rows, prefer factory='m3'. Else take first.
-    """
-    conn = None
-    cur = None
-    sid = (staffid_norm or "").strip().upper()
-    try:
-        conn, cur = connect_staff_gwidb(dict_cursor=True)
-        cur.execute("SELECT * FROM staff_list WHERE UPPER(staffid) = %s", (sid,))
-        rows = cur.fetchall() or []
-        if not rows:
-            return None
-        if len(rows) == 1:
-            return rows[0]
+    debug(f"staff_gwidb.staff_list lookup: staffid={sid}, rows={len(rows)}")
 
-        # prefer factory='m3'
+    if len(rows) == 0:
+        result = (False, None)
+    elif len(rows) == 1:
+        result = (True, rows[0])
+    else:
+        # duplicate -> must match factory='m3'
+        m3_row = None
         for r in rows:
             if (r.get("factory") or "").strip().lower() == "m3":
-                return r
-        return rows[0]
+                m3_row = r
+                break
+        if m3_row is not None:
+            debug("Duplicate staffid detected -> using factory='m3' match ✅")
+            result = (True, m3_row)
+        else:
+            debug("Duplicate staffid detected but no factory='m3' row ❌")
+            result = (False, rows[0])
+
+    with _staff_cache_lock:
+        _staff_cache[sid] = (result, now_ts + STAFF_CACHE_TTL_SEC)
+    return result
+
+def is_valid_staff_id(staff_id_in: str) -> bool:
+    sid = (staff_id_in or "").strip().upper()
+    if not sid:
+        return False
+    try:
+        return _lookup_staff(sid)[0]
+    except Exception as e:
+        debug(f"Staff GWIDB connection/query error: {e}")
+        return False
+
+def fetch_staff_row_from_gwidb(staffid_norm: str):
+    sid = (staffid_norm or "").strip().upper()
+    try:
+        return _lookup_staff(sid)[1]
     except Exception as e:
         debug(f"fetch_staff_row_from_gwidb error: {e}")
         return None
-    finally:
-        try:
-            if cur:
-                cur.close()
-        except Exception:
-            pass
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
 
 # ===================== Barcode listener (KEEP YOUR PERFECT FLOW ORDER) =====================
-def on_key(event):
-    global barcode_buffer, last_barcode, last_scan_time
-    global current_batch, current_muf, template_code, muf_info, staff_id
-    global green_blink_running, green_blink_thread
+def handle_barcode():
+    # Debounce on the raw buffer hash before doing any other work, so a
+    # scanner misfire/double-trigger is rejected without running the
+    # normalize/dispatch chain at all.
+    scan_hash = hash(ctx.buffer)
+    now_ts = time.time()
+    if scan_hash == ctx.last_hash and now_ts - ctx.last_ts < SCAN_INTERVAL:
+        debug("⏱️ Duplicate scan ignored")
+        ctx.buffer = ""
+        return
 
-    if event.name == "enter":
-        barcode = barcode_buffer.strip()
-        normalized_barcode = normalize_barcode(barcode)
-        barcode_buffer = ""
+    ctx.last_hash = scan_hash
+    ctx.last_ts = now_ts
 
-        now = datetime.now()
-        now_ts = time.time()
+    barcode = ctx.buffer.strip()
+    normalized_barcode = normalize_barcode(barcode)
+    ctx.buffer = ""
 
-        if barcode == last_barcode and now_ts - last_scan_time < SCAN_INTERVAL:
-            debug(f"⏱️ Duplicate scan ignored: {barcode}")
-            return
+    now = datetime.now()
 
-        last_barcode = barcode
-        last_scan_time = now_ts
+    debug(f"📥 Scanned barcode: '{barcode}' → normalized: '{normalized_barcode}'")
+    debug(f"STATE before: batch={ctx.batch}, muf={ctx.muf}, template={ctx.template}, staff={ctx.staff_id}")
 
-        debug(f"📥 Scanned barcode: '{barcode}' → normalized: '{normalized_barcode}'")
-        debug(f"STATE before: batch={current_batch}, muf={current_muf}, template={template_code}, staff={staff_id}")
+    # stop alerts first (exact old behavior)
+    stop_all_alerts()
 
-        # stop alerts first (exact old behavior)
-        stop_all_alerts()
+    # RESET
+    if is_reset_code(normalized_barcode):
+        debug("🔄 RESET scanned. Starting new batch")
+        ctx.batch = f"batch_{now.strftime('%Y%m%d_%H%M%S')}"
+        ctx.muf = None
+        ctx.template = None
+        ctx.muf_info = None
+        ctx.muf_prefix = None
 
-        # RESET
-        if is_reset_code(barcode):
-            debug("🔄 RESET scanned. Starting new batch")
-            current_batch = f"batch_{now.strftime('%Y%m%d_%H%M%S')}"
-            current_muf = None
-            template_code = None
-            muf_info = None
+        LIGHTS.set("GREEN", green_ready_pattern())
+        debug("✅ Green light blinking restarted (RESET)")
+        return
 
-            green_blink_running = False
-            if green_blink_thread and green_blink_thread.is_alive():
-                green_blink_thread.join(timeout=1)
-            set_light(GREEN_PIN, False)
+    # Staff (MULTI-USER, per-staff toggle; per-staff 60s anti-double-scan; does NOT affect production scanned_by)
+    if _HAS_ALPHA(normalized_barcode):
+        debug("Detected alpha -> treat as staff barcode")
 
-            green_blink_running = True
-            green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
-            green_blink_thread.start()
-            debug("✅ Green light blinking restarted (RESET)")
-            return
+        # Preserve production green state:
+        # - If template already set, green should stay SOLID ON after staff scan feedback blink.
+        green_should_be_solid = ctx.template is not None
 
-        # Staff (MULTI-USER, per-staff toggle; per-staff 60s anti-double-scan; does NOT affect production scanned_by)
-        if any(c.isalpha() for c in normalized_barcode):
-            debug("Detected alpha -> treat as staff barcode")
-
-            # Preserve production green state:
-            # - If template already set, green should stay SOLID ON after staff scan feedback blink.
-            green_should_be_solid = template_code is not None
-
-            # Per-staff anti-double-scan: same staff must wait >= 60s between scans
-            last_staff_ts = staff_last_scan_ts.get(normalized_barcode)
-            if last_staff_ts is not None and (now_ts - last_staff_ts) < STAFF_MIN_INTERVAL_SEC:
-                debug(f"⏱️ Staff scan ignored (<{STAFF_MIN_INTERVAL_SEC}s): {normalized_barcode}")
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
-
-            # 1) Validate staff barcode first (OPERATOR only) from staff_gwidb.staff_list
-            if not is_valid_staff_id(normalized_barcode):
-                debug(f"Invalid staff ID: {normalized_barcode}")
-                start_red_buzzer_alert()
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
+        # Per-staff anti-double-scan: same staff must wait >= 60s between scans
+        last_staff_ts = staff_last_scan_ts.get(normalized_barcode)
+        if last_staff_ts is not None and (now_ts - last_staff_ts) < STAFF_MIN_INTERVAL_SEC:
+            debug(f"⏱️ Staff scan ignored (<{STAFF_MIN_INTERVAL_SEC}s): {normalized_barcode}")
+            if green_should_be_solid:
+                LIGHTS.set("GREEN", True)
+            return
 
-            debug(f"✅ Staff validated (staff exists): {normalized_barcode}")
+        # 1) Validate staff barcode first (OPERATOR only) from staff_gwidb.staff_list
+        if not is_valid_staff_id(normalized_barcode):
+            debug(f"Invalid staff ID: {normalized_barcode}")
+            start_red_buzzer_alert()
+            if green_should_be_solid:
+                LIGHTS.set("GREEN", True)
+            return
 
-            # 2) Get staff details from staff_gwidb.staff_list (duplicate -> prefer factory='m3')
-            staff_row = fetch_staff_row_from_gwidb(normalized_barcode)
-            if not staff_row:
-                debug("❌ Staff ID not found in staff_gwidb.staff_list after validation")
-                start_red_buzzer_alert()
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
+        debug(f"✅ Staff validated (staff exists): {normalized_barcode}")
 
-            pic_url = resolve_image_url(staff_row.get("pic") or "")
-            debug(f"👷 Staff info: id={normalized_barcode}, name={staff_row.get('staffname')}, pos={staff_row.get('staffpos')}, dept={staff_row.get('staffdept')}, agency={staff_row.get('staffagency','')}, factory={staff_row.get('factory','')}")
+        # 2) Get staff details from staff_gwidb.staff_list (duplicate -> prefer factory='m3')
+        staff_row = fetch_staff_row_from_gwidb(normalized_barcode)
+        if not staff_row:
+            debug("❌ Staff ID not found in staff_gwidb.staff_list after validation")
+            start_red_buzzer_alert()
+            if green_should_be_solid:
+                LIGHTS.set("GREEN", True)
+            return
 
-            # 3) Now do allocation_m3 operations (allocation_temp/prod_attendance/allcation_log) using STAFF_DB (unchanged)
-            connection = None
-            try:
-                connection = mysql.connector.connect(
-                    host=STAFF_DB["host"],
-                    user=STAFF_DB["user"],
-                    password=STAFF_DB["password"],
-                    database=STAFF_DB["database"],
-                    port=int(STAFF_DB.get("port", 3306)),
-                )
-                cursor = connection.cursor(dictionary=True)
-
-                now_dt = datetime.now()
-                now_dt_sec = now_dt.replace(microsecond=0)
-
-                # Work date is ALWAYS today (no cross-midnight remapping)  <-- keep your current behavior
-                work_date_str = now_dt.strftime("%Y-%m-%d")
-
-                # 3) allocation_temp (per-staff toggle; staffid is UNIQUE)
-                cursor.execute(
-                    "SELECT status FROM allocation_temp WHERE staffid = %s LIMIT 1",
-                    (normalized_barcode,)
-                )
-                temp_row = cursor.fetchone()
-
-                prev_status = (temp_row.get("status") if temp_row else None)
-                prev_status_u = (prev_status or "").strip().upper()
-
-                toggle_to_in = True if not temp_row else (prev_status_u != "IN")
-                new_status = "IN" if toggle_to_in else "OUT"
-                debug(f"🧭 allocation_temp toggle: prev_status={prev_status_u or 'NULL'} -> new_status={new_status} (exists={bool(temp_row)})")
-
-                if not temp_row:
-                    cursor.execute("""
-                        INSERT INTO allocation_temp (
-                            staffid, line, staffname, staffpos, staffdept,
-                            status, remark, created_date, pic, flg
-                        ) VALUES (%s, %s, %s, %s, %s, %s, '', %s, %s, NULL)
-                    """, (
-                        normalized_barcode,
-                        DEVICE_LINE,
-                        staff_row.get("staffname"),
-                        staff_row.get("staffpos"),
-                        staff_row.get("staffdept"),
-                        new_status,
-                        now_dt.date(),
-                        pic_url
-                    ))
-                else:
-                    cursor.execute("""
-                        UPDATE allocation_temp
-                        SET line=%s, staffname=%s, staffpos=%s, staffdept=%s,
-                            status=%s, remark='', created_date=%s, pic=%s
-                        WHERE staffid=%s
-                    """, (
-                        DEVICE_LINE,
-                        staff_row.get("staffname"),
-                        staff_row.get("staffpos"),
-                        staff_row.get("staffdept"),
-                        new_status,
-                        now_dt.date(),
-                        pic_url,
-                        normalized_barcode
-                    ))
-
-                # 4) prod_attendance (SHIFT source of truth)
-                cursor.execute(
-                    "SELECT id, shift FROM prod_attendance WHERE staffid = %s AND date = %s",
-                    (normalized_barcode, work_date_str)
-                )
-                att_row = cursor.fetchone()
-                debug(f"📋 prod_attendance lookup: date={work_date_str}, found={bool(att_row)}, shift_in_db={(att_row.get('shift') if att_row else None)}")
-
-                shift_value = None
-                if att_row and (att_row.get("shift") or "").strip():
-                    shift_value = (att_row.get("shift") or "").strip().upper()
-                    debug(f"🕒 shift locked from prod_attendance: {shift_value}")
-                else:
-                    minutes = now_dt.hour * 60 + now_dt.minute
-                    in_overlap = (6 * 60 + 30 <= minutes < 7 * 60) or (18 * 60 + 30 <= minutes < 19 * 60)
-                    overlap_hint = None
-                    if in_overlap:
-                        cursor.execute(
-                            "SELECT shift FROM prod_attendance "
-                            "WHERE staffid = %s AND shift IS NOT NULL AND TRIM(shift) <> '' "
-                            "ORDER BY date DESC, id DESC LIMIT 1",
-                            (normalized_barcode,)
-                        )
-                        last_shift_row = cursor.fetchone()
-                        if last_shift_row and (last_shift_row.get("shift") or "").strip():
-                            overlap_hint = (last_shift_row.get("shift") or "").strip().upper()
-
-                    shift_value = compute_shift_value(now_dt, overlap_hint=overlap_hint)
-                    debug(f"🕒 shift computed: time={now_dt.strftime('%H:%M:%S')}, overlap_hint={overlap_hint}, shift_value={shift_value}")
-
-                if att_row:
-                    if not (att_row.get("shift") or "").strip():
-                        cursor.execute(
-                            "UPDATE prod_attendance SET timeout = %s, shift = %s WHERE id = %s",
-                            (now_dt, shift_value, att_row["id"])
-                        )
-                    else:
-                        debug(f"📝 prod_attendance update: id={att_row['id']} timeout={now_dt}")
-                        cursor.execute(
-                            "UPDATE prod_attendance SET timeout = %s WHERE id = %s",
-                            (now_dt, att_row["id"])
-                        )
-                else:
-                    debug(f"📝 prod_attendance insert: date={work_date_str} timein={now_dt} shift={shift_value}")
-                    cursor.execute("""
-                        INSERT INTO prod_attendance (
-                            staffid, name, staffpos, staffdept, timein, timeout, work_hr, pic, staffic,
-                            date, shift, flg, staffagency, day
-                        ) VALUES (%s, %s, %s, %s, %s, NULL, 0.00, %s, NULL, %s, %s, NULL, %s, %s)
-                    """, (
-                        normalized_barcode,
-                        staff_row.get("staffname"),
-                        staff_row.get("staffpos"),
-                        staff_row.get("staffdept"),
-                        now_dt,
-                        pic_url,
-                        work_date_str,
-                        shift_value,
-                        staff_row.get("staffagency", ""),
-                        calendar.day_name[now_dt.weekday()]
-                    ))
-
-                # 5) allcation_log (INSERT a new record on EVERY staff scan)
-                debug(f"🧾 allcation_log insert: status={new_status} datetime_log={now_dt} date_run={work_date_str} shift={shift_value}")
-                cursor.execute("""
-                    INSERT INTO allcation_log (
-                        line, employee_id, name, job_title, department, datetime_log, status, remark,
-                        file_path, date_run, in_datetime, out_datetime, time_taken, shift
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, '', %s, %s, %s, NULL, 0.00, %s)
-                """, (
-                    DEVICE_LINE,
-                    normalized_barcode,
-                    staff_row.get("staffname"),
-                    staff_row.get("staffpos"),
-                    staff_row.get("staffdept"),
-                    now_dt_sec,
-                    new_status,
-                    pic_url,
-                    work_date_str,
-                    now_dt_sec,
-                    shift_value
-                ))
-
-                connection.commit()
-
-                # Update per-staff last scan time after successful commit
-                staff_last_scan_ts[normalized_barcode] = now_ts
-
-                debug(f"✅ Staff toggled: {normalized_barcode} -> {new_status} (work_date={work_date_str}, shift={shift_value})")
-                blink_light(GREEN_PIN, times=1)
-                buzz(times=1)
-
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                    debug("💡 Restored GREEN solid (template already set)")
-
-                return
-
-            except Exception as e:
-                debug(f"🔥 Error during staff scan: {e}")
-                try:
-                    if connection:
-                        connection.rollback()
-                except Exception:
-                    pass
-                start_red_buzzer_alert()
-                if green_should_be_solid:
-                    set_light(GREEN_PIN, True)
-                return
+        # Probe the row once; these feed all three statements below, so the
+        # repeated dict lookups would otherwise sit inside the transaction.
+        staff_name = staff_row.get("staffname")
+        staff_pos = staff_row.get("staffpos")
+        staff_dept = staff_row.get("staffdept")
+        staff_agency = staff_row.get("staffagency", "")
+        pic_url = resolve_image_url(staff_row.get("pic") or "")
+        debug(f"👷 Staff info: id={normalized_barcode}, name={staff_name}, pos={staff_pos}, dept={staff_dept}, agency={staff_agency}, factory={staff_row.get('factory','')}")
+
+        # 3) Now do allocation_m3 operations (allocation_temp/prod_attendance/allcation_log) using STAFF_DB (unchanged)
+        connection = None
+        try:
+            connection = connect_allocation_m3()
+            cursor = connection.cursor(dictionary=True)
+
+            # reuse the scan's clock snapshot; no extra clock_gettime calls
+            now_dt = now
+            now_dt_sec = now_dt.replace(microsecond=0)
+
+            # Work date is ALWAYS today (no cross-midnight remapping)  <-- keep your current behavior
+            work_date_str = now_dt.strftime("%Y-%m-%d")
+
+            # 3) allocation_temp (per-staff toggle; staffid is UNIQUE)
+            # One upsert: inserts as IN, or flips IN<->OUT atomically on the
+            # existing row. @new_status carries the server-side decision.
+            cursor.execute(ALLOC_TEMP_UPSERT_SQL, (
+                normalized_barcode,
+                DEVICE_LINE,
+                staff_name,
+                staff_pos,
+                staff_dept,
+                now_dt.date(),
+                pic_url
+            ))
+
+            # 4) prod_attendance (SHIFT source of truth)
+            # Compute the candidate shift up front; the upsert keeps any
+            # non-empty shift already stored and @shift_final reads back
+            # whichever value won.
+            minutes = now_dt.hour * 60 + now_dt.minute
+            in_overlap = (6 * 60 + 30 <= minutes < 7 * 60) or (18 * 60 + 30 <= minutes < 19 * 60)
+            overlap_hint = None
+            if in_overlap:
+                cursor.execute(ATTENDANCE_LAST_SHIFT_SQL, (normalized_barcode,))
+                last_shift_row = cursor.fetchone()
+                if last_shift_row and (last_shift_row.get("shift") or "").strip():
+                    overlap_hint = (last_shift_row.get("shift") or "").strip().upper()
+
+            shift_value = compute_shift_value(now_dt, overlap_hint=overlap_hint)
+            debug(f"🕒 shift computed: time={now_dt.strftime('%H:%M:%S')}, overlap_hint={overlap_hint}, shift_value={shift_value}")
+
+            cursor.execute(ATTENDANCE_UPSERT_SQL, (
+                normalized_barcode,
+                staff_name,
+                staff_pos,
+                staff_dept,
+                now_dt,
+                pic_url,
+                work_date_str,
+                shift_value,
+                staff_agency,
+                _DAY_NAMES[now_dt.weekday()]
+            ))
+
+            cursor.execute(STAFF_READBACK_SQL)
+            readback = cursor.fetchone() or {}
+            new_status = readback.get("new_status")
+            if isinstance(new_status, (bytes, bytearray)):
+                new_status = new_status.decode()
+            new_status = new_status or "IN"
+            shift_value = readback.get("shift_value")
+            if isinstance(shift_value, (bytes, bytearray)):
+                shift_value = shift_value.decode()
+            debug(f"🧭 allocation_temp toggle -> new_status={new_status}, shift locked={shift_value}")
+
+            # 5) allcation_log (INSERT a new record on EVERY staff scan)
+            debug(f"🧾 allcation_log insert: status={new_status} datetime_log={now_dt} date_run={work_date_str} shift={shift_value}")
+            cursor.execute(ALLOC_LOG_INSERT_SQL, (
+                DEVICE_LINE,
+                normalized_barcode,
+                staff_name,
+                staff_pos,
+                staff_dept,
+                now_dt_sec,
+                new_status,
+                pic_url,
+                work_date_str,
+                now_dt_sec,
+                shift_value
+            ))
+
+            connection.commit()
+
+            # Update per-staff last scan time after successful commit
+            staff_last_scan_ts[normalized_barcode] = now_ts
+
+            debug(f"✅ Staff toggled: {normalized_barcode} -> {new_status} (work_date={work_date_str}, shift={shift_value})")
+            # Feedback blink/beep; end=True leaves green solid when a
+            # template is already set, so no restore step is needed.
+            LIGHTS.set("GREEN", pulse_pattern(times=1, end=green_should_be_solid))
+            LIGHTS.set("BUZZER", pulse_pattern(times=1, on_s=0.15, off_s=0.1))
+
+            if green_should_be_solid:
+                debug("💡 Restored GREEN solid (template already set)")
 
-            finally:
-                try:
-                    if connection:
-                        connection.close()
-                except Exception:
-                    pass
+            return
 
-        # Must RESET first
-        if not current_batch:
-            debug("⚠️ Please scan RESET first.")
+        except Exception as e:
+            debug(f"🔥 Error during staff scan: {e}")
+            try:
+                if connection:
+                    connection.rollback()
+            except Exception:
+                pass
             start_red_buzzer_alert()
+            if green_should_be_solid:
+                LIGHTS.set("GREEN", True)
             return
 
-        # MUF stage
-        if current_muf is None:
+        finally:
             try:
-                clean = normalize_barcode(barcode)
-                conn = connect_production(dict_cursor=True)
-                cursor = conn.cursor()
-                muf_info = fetch_muf_info(cursor, clean)
-                conn.close()
-
-                if muf_info:
-                    current_muf = clean
-                    debug(f"✅ MUF found: {current_muf}")
-                    debug("Green continues blinking until template set.")
-                else:
-                    debug(f"❌ MUF not found: {clean}")
-                    start_red_buzzer_alert()
-                return
+                if connection:
+                    connection.close()
+            except Exception:
+                pass
 
-            except Exception as e:
-                debug(f"⚠️ DB connection error: {e}")
-                start_red_buzzer_alert()
-                return
+    # Must RESET first
+    if not ctx.batch:
+        debug("⚠️ Please scan RESET first.")
+        start_red_buzzer_alert()
+        return
 
-        # Template stage
-        if template_code is None:
-            normalized = normalize_barcode(barcode)
-            if normalized == current_muf:
-                debug(f"⚠️ Duplicate MUF barcode scanned as template: {normalized}")
+    # MUF stage
+    if ctx.muf is None:
+        try:
+            with production_conn() as conn:
+                cursor = conn.cursor(pymysql.cursors.DictCursor)
+                ctx.muf_info = fetch_muf_info(cursor, normalized_barcode)
+                cursor.close()
+
+            if ctx.muf_info:
+                ctx.muf = normalized_barcode
+                ctx.muf_prefix = _build_muf_prefix(ctx.muf, ctx.muf_info)
+                debug(f"✅ MUF found: {ctx.muf}")
+                debug("Green continues blinking until template set.")
+            else:
+                debug(f"❌ MUF not found: {normalized_barcode}")
                 start_red_buzzer_alert()
-                return
-
-            template_code = normalized
-            debug(f"🧾 Template barcode set: {template_code}")
-
-            green_blink_running = False
-            if green_blink_thread and green_blink_thread.is_alive():
-                green_blink_thread.join(timeout=1)
-
-            set_light(GREEN_PIN, True)  # solid ON
-            debug("✅ Green light solid ON (Template Set)")
+            return
 
-            process_and_store(barcode, muf_info, remarks="TEMPLATE")
+        except Exception as e:
+            debug(f"⚠️ DB connection error: {e}")
+            start_red_buzzer_alert()
             return
 
-        # MISMATCH stage (THIS MUST ALERT)
-        if normalize_barcode(barcode) != template_code:
-            debug(f"❌ Carton mismatch! scanned={normalize_barcode(barcode)} != template={template_code}")
+    # Template stage
+    if ctx.template is None:
+        if normalized_barcode == ctx.muf:
+            debug(f"⚠️ Duplicate MUF barcode scanned as template: {normalized_barcode}")
             start_red_buzzer_alert()
             return
 
-        # MATCH stage
-        debug(f"✅ Carton matches template: {template_code}")
-        process_and_store(template_code, muf_info, remarks="SCAN")
+        ctx.template = normalized_barcode
+        debug(f"🧾 Template barcode set: {ctx.template}")
+
+        LIGHTS.set("GREEN", True)  # solid ON
+        debug("✅ Green light solid ON (Template Set)")
+
+        process_and_store(normalized_barcode, ctx.muf_info, remarks="TEMPLATE", now=now)
         return
 
-    elif len(event.name) == 1:
-        barcode_buffer += event.name
-    elif event.name == "minus":
-        barcode_buffer += "-"
+    # MISMATCH stage (THIS MUST ALERT)
+    if normalized_barcode != ctx.template:
+        debug(f"❌ Carton mismatch! scanned={normalized_barcode} != template={ctx.template}")
+        start_red_buzzer_alert()
+        return
+
+    # MATCH stage
+    debug(f"✅ Carton matches template: {ctx.template}")
+    process_and_store(ctx.template, ctx.muf_info, remarks="SCAN", now=now)
+    return
+
+# ===================== Scanner input (evdev) =====================
+# evdev reads only the scanner's own event node instead of the `keyboard`
+# library's global hook, which needed root and ran a Python callback for
+# every key on every keyboard in the system.
+_KEYCODE_TO_CHAR = {ecodes.KEY_MINUS: "-"}
+for _i in range(10):
+    _KEYCODE_TO_CHAR[getattr(ecodes, f"KEY_{_i}")] = str(_i)
+for _c in "abcdefghijklmnopqrstuvwxyz":
+    _KEYCODE_TO_CHAR[getattr(ecodes, f"KEY_{_c.upper()}")] = _c
+
+def find_scanner_device():
+    by_id = "/dev/input/by-id"
+    try:
+        names = sorted(os.listdir(by_id))
+    except FileNotFoundError:
+        return None
+    # Prefer a node that identifies itself as a barcode scanner, else any
+    # keyboard-class device (HID scanners enumerate as keyboards).
+    for name in names:
+        if "barcode" in name.lower() and name.endswith("-event-kbd"):
+            return os.path.join(by_id, name)
+    for name in names:
+        if name.endswith("-event-kbd"):
+            return os.path.join(by_id, name)
+    return None
+
+def input_loop():
+    path = find_scanner_device()
+    if not path:
+        debug("❌ No scanner input device found under /dev/input/by-id")
+        sys.exit(1)
+
+    device = InputDevice(path)
+    debug(f"🧭 Listening for barcode scan on {path} ({device.name})")
+
+    for event in device.read_loop():
+        if event.type != ecodes.EV_KEY or event.value != 1:  # key-down only
+            continue
+        if event.code == ecodes.KEY_ENTER:
+            handle_barcode()
+        else:
+            ch = _KEYCODE_TO_CHAR.get(event.code)
+            if ch is not None:
+                ctx.buffer += ch
 
 # ===================== Main =====================
 if __name__ == "__main__":
@@ -966,12 +1357,12 @@ if __name__ == "__main__":
     debug(f"ERROR_ALERT_MODE={ERROR_ALERT_MODE}")
     debug(f"CHANNEL_ACTIVE_LOW={CHANNEL_ACTIVE_LOW}")
 
-    upload_from_csv()
+    threading.Thread(target=_csv_writer_loop, daemon=True).start()
+    debug("CSV writer thread started.")
+
+    PERIODIC.add(UPLOAD_INTERVAL_SEC, upload_from_csv)
 
-    green_blink_thread = threading.Thread(target=continuous_green_blink, daemon=True)
-    green_blink_thread.start()
+    LIGHTS.set("GREEN", green_ready_pattern())
     debug("Initial green light blinking started.")
 
-    debug("🧭 Listening for barcode scan via keyboard...")
-    keyboard.on_press(on_key)
-    keyboard.wait()
+    input_loop()
@@ -0,0 +1,9 @@
+# wsgi.py
+# Production entry point for api_server. The Flask dev server started by
+# "python api_server.py" handles one request at a time; run this under a
+# multi-worker WSGI server so concurrent /summary polls are served in
+# parallel (each worker keeps its own DB pool):
+#
+#   gunicorn -w 4 -k gthread --threads 4 -b 0.0.0.0:5001 wsgi:app
+#
+from api_server import app  # noqa: F401
@@ -0,0 +1,14 @@
+-- Indexes for the hot api_server.py queries on output_log.
+-- "WHERE line=? ORDER BY id DESC LIMIT 1" and "WHERE muf_no=? ORDER BY id DESC LIMIT 1"
+-- otherwise filesort all matching rows; with these composite indexes MySQL does a
+-- single backward B-tree descent. The (muf_no, line, scanned_at) index turns the
+-- hourly SUM(ctn_count) range scan into an index range.
+--
+-- Apply once on the production DB:
+--   mysql production < sql/add_output_log_indexes.sql
+--
+-- Verify with EXPLAIN that the LIMIT 1 queries report "Backward index scan".
+
+CREATE INDEX ix_output_log_line_id ON output_log (line, id DESC);
+CREATE INDEX ix_output_log_muf_id ON output_log (muf_no, id DESC);
+CREATE INDEX ix_output_log_muf_line_scanned ON output_log (muf_no, line, scanned_at);
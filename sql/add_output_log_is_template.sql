@@ -0,0 +1,15 @@
+-- The /summary SUM queries exclude template rows with
+-- LOWER(remarks) NOT LIKE '%template%', which is non-sargable and forces a
+-- scan of every matching row. A stored generated column computes the flag
+-- once at insert time (covers rows written by all scanner variants without
+-- any code change to the insert paths) and gets indexed together with the
+-- columns the SUM queries filter on.
+--
+-- Apply once on the production DB:
+--   mysql production < sql/add_output_log_is_template.sql
+
+ALTER TABLE output_log
+    ADD COLUMN is_template TINYINT
+    AS (remarks IS NOT NULL AND LOWER(remarks) LIKE '%template%') STORED;
+
+CREATE INDEX ix_output_log_muf_tmpl_scanned ON output_log (muf_no, is_template, scanned_at);
@@ -0,0 +1,19 @@
+-- Staff validation queries staff_list with WHERE UPPER(staffid) = %s,
+-- which can't use an index, and pulls every column with SELECT *. A
+-- stored generated column makes the upper-cased id indexable (same
+-- pattern as sql/add_output_log_is_template.sql) and a narrow view
+-- limits the transfer to the columns the scanner actually reads.
+--
+-- Apply once on staff_gwidb:
+--   mysql staff_gwidb < sql/add_staff_list_lookup.sql
+
+ALTER TABLE staff_list
+    ADD COLUMN staffid_u VARCHAR(64)
+    AS (UPPER(staffid)) STORED;
+
+CREATE INDEX ix_staff_list_staffid_u ON staff_list (staffid_u);
+
+CREATE VIEW staff_scan_lookup AS
+    SELECT staffid_u, staffid, staffname, staffpos, staffdept,
+           staffagency, factory, pic
+    FROM staff_list;
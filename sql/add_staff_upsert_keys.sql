@@ -0,0 +1,16 @@
+-- The staff scan flow replaces its SELECT-then-INSERT/UPDATE pairs with
+-- INSERT ... ON DUPLICATE KEY UPDATE, which needs unique keys to fire on:
+--   allocation_temp : one row per staff (staffid)
+--   prod_attendance : one row per staff per day (staffid, date)
+-- De-duplicate prod_attendance first if historical double rows exist.
+--
+-- Apply once on allocation_m3:
+--   mysql allocation_m3 < sql/add_staff_upsert_keys.sql
+
+-- allocation_temp.staffid is already UNIQUE on existing installs; include
+-- it here for fresh databases and skip the statement if the key exists.
+ALTER TABLE allocation_temp
+    ADD UNIQUE KEY ux_allocation_temp_staffid (staffid);
+
+ALTER TABLE prod_attendance
+    ADD UNIQUE KEY ux_prod_attendance_staff_date (staffid, date);